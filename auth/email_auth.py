@@ -4,8 +4,8 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from passlib.context import CryptContext
 
-# Import our JSON storage
-from utils.json_storage import create_user, verify_user, get_user_by_email
+# Import the configured storage backend
+from utils.storage import create_user, verify_user, get_user_by_email
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
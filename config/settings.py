@@ -10,8 +10,57 @@ APP_LAYOUT = "wide"
 
 # Database settings
 DATABASE_URL = os.getenv('DATABASE_URL')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
 
 # Email settings
 EMAIL_USER = os.getenv('EMAIL_USER')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 SECRET_KEY = os.getenv('SECRET_KEY')
+
+# Storage settings
+STORAGE_JOURNAL = os.getenv('STORAGE_JOURNAL', 'true').lower() in ('1', 'true', 'yes')
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', str(1024 * 1024)))
+# 'single' keeps everything in carbon_data.json, 'sharded' writes one file per user
+STORAGE_LAYOUT = os.getenv('STORAGE_LAYOUT', 'single')
+# Parsed side files (shards, rollups, indexes) kept in memory by the JSON
+# storage, least recently used dropped first
+FILE_CACHE_SIZE = int(os.getenv('FILE_CACHE_SIZE', '256'))
+# 'json' uses utils/json_storage.py, 'sqlite' the indexed SQLite database below,
+# 'postgresql' the SQLAlchemy models in database/models.py on DATABASE_URL
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_PATH = os.getenv('SQLITE_PATH', './carbon.db')
+# 'columnar' stores emission_details as a shared key schema plus a value array,
+# 'dict' keeps the nested dicts (and the pretty-printed data file)
+EMISSION_ENCODING = os.getenv('EMISSION_ENCODING', 'columnar')
+EMISSION_FLOAT32 = os.getenv('EMISSION_FLOAT32', 'false').lower() in ('1', 'true', 'yes')
+# Serialization of the data file: 'json' (orjson when installed) or 'msgpack'
+STORAGE_FORMAT = os.getenv('STORAGE_FORMAT', 'json')
+# Footprints older than this many days (rounded down to whole months) are
+# moved to compressed archive segments when the journal is compacted; 0 disables
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+# 'gzip' or 'zstd' (requires the zstandard package)
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'gzip')
+# Parquet analytics mirror (utils/parquet_mirror.py, requires pyarrow). When
+# enabled, saves sync it once PARQUET_MIRROR_BATCH footprints are pending
+PARQUET_MIRROR = os.getenv('PARQUET_MIRROR', 'false').lower() in ('1', 'true', 'yes')
+PARQUET_MIRROR_DIR = os.getenv(
+    'PARQUET_MIRROR_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'parquet')
+)
+PARQUET_MIRROR_BATCH = int(os.getenv('PARQUET_MIRROR_BATCH', '100'))
+
+# Emission factors (utils/factor_store.py): versioned CSV factor sets in
+# FACTOR_SET_DIR; FACTOR_SET_VERSION is the set new calculations use
+FACTOR_SET_DIR = os.getenv(
+    'FACTOR_SET_DIR', os.path.join(os.path.dirname(__file__), 'factor_sets')
+)
+FACTOR_SET_VERSION = os.getenv('FACTOR_SET_VERSION', '2026.1')
+
+# Calculator results (utils/emissions_engine.py) are cached for this many
+# distinct sets of inputs; 0 disables the cache
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '1024'))
+# When enabled, a footprint saved with the same input_hash as an earlier
+# footprint of its user is stored as a reference to it (utils/dedupe.py)
+FOOTPRINT_DEDUPE = os.getenv('FOOTPRINT_DEDUPE', 'false').lower() in ('1', 'true', 'yes')
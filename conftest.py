@@ -0,0 +1,51 @@
+"""Shared pytest fixtures: every storage test gets its own empty data directory."""
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def json_store(tmp_path, monkeypatch):
+    """utils.json_storage working on an empty data directory under tmp_path, journaled, single file layout."""
+    from utils import dedupe, json_storage
+
+    data_dir = json_storage.DATA_DIR
+    for name, value in list(vars(json_storage).items()):
+        if isinstance(value, Path) and (value == data_dir or data_dir in value.parents):
+            monkeypatch.setattr(json_storage, name, tmp_path / value.relative_to(data_dir))
+    monkeypatch.setattr(json_storage, "STORAGE_LAYOUT", "single")
+    monkeypatch.setattr(json_storage, "STORAGE_JOURNAL", True)
+    monkeypatch.setattr(json_storage, "ARCHIVE_AFTER_DAYS", 0)
+    monkeypatch.setattr(dedupe, "FOOTPRINT_DEDUPE", False)
+    monkeypatch.setattr(json_storage, "_pointer", ("unread", 0))
+    monkeypatch.setattr(json_storage, "_file_cache", OrderedDict())
+    monkeypatch.setattr(json_storage, "_by_user", OrderedDict())
+    json_storage.invalidate_cache()
+    yield json_storage
+    json_storage.invalidate_cache()
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    """The SQLite backend on a new database file."""
+    from utils.storage import SQLiteStorageBackend
+    return SQLiteStorageBackend(str(tmp_path / "carbon.db"))
+
+
+@pytest.fixture
+def sqlalchemy_store(tmp_path, monkeypatch):
+    """The SQLAlchemy backend on a new SQLite database instead of PostgreSQL."""
+    pytest.importorskip("sqlalchemy")
+    import database
+    from database.backend import SQLAlchemyStorageBackend
+
+    def reset():
+        database._thread_sessions.remove()
+        database.get_sessionmaker.cache_clear()
+        database.get_engine.cache_clear()
+
+    monkeypatch.setattr(database, "DATABASE_URL", f"sqlite:///{tmp_path / 'carbon.db'}")
+    reset()
+    yield SQLAlchemyStorageBackend()
+    reset()
@@ -1,20 +1,127 @@
 import os
+import threading
+import weakref
+from functools import lru_cache
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 # Load environment variables
 load_dotenv()
 
+from config.settings import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+
 # Get DATABASE_URL from environment variables
 DATABASE_URL = os.getenv('DATABASE_URL')
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@lru_cache(maxsize=None)
+def get_engine():
+    """Return the process-wide engine for DATABASE_URL.
+
+    The engine owns a QueuePool shared by every Streamlit session in the
+    process. pre_ping drops connections the server closed, and recycle
+    replaces them before server-side idle timeouts hit.
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL is not set")
+    return create_engine(
+        DATABASE_URL,
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+@lru_cache(maxsize=None)
+def get_sessionmaker():
+    """Return the session factory bound to the shared engine."""
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+def __getattr__(name):
+    # engine and SessionLocal are created on first use, so importing the
+    # package does not require DATABASE_URL to be set.
+    if name == "engine":
+        return get_engine()
+    if name == "SessionLocal":
+        return get_sessionmaker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Sessions scoped to a Streamlit rerun: id(ScriptRunContext) -> (rerun number, Session)
+_rerun_sessions = {}
+_rerun_lock = threading.RLock()  # finalizers may run while it is held
+_thread_sessions = scoped_session(lambda: get_sessionmaker()())
+
+def _script_run_ctx():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    return get_script_run_ctx(suppress_warning=True)
+
+def _count_reruns(ctx):
+    """Number the reruns of a script run context and close its session once the context is gone.
+
+    ScriptRunContext.reset() starts every rerun, so it is wrapped to advance
+    the number. The wrapper only holds a weak reference, which lets the
+    context be freed when its browser session ends. reset() is not a public
+    Streamlit API: returns False, leaving the context untouched, when this
+    version has no reset() to wrap.
+    """
+    if not callable(getattr(type(ctx), "reset", None)):
+        return False
+
+    def reset(*args, **kwargs):
+        context = context_ref()
+        context._db_rerun += 1
+        type(context).reset(context, *args, **kwargs)
+
+    try:
+        context_ref = weakref.ref(ctx)
+        ctx.reset = reset
+    except (AttributeError, TypeError):  # a context without weak references or instance attributes
+        return False
+    ctx._db_rerun = 0
+    weakref.finalize(ctx, _close_rerun_session, id(ctx))
+    return True
+
+def _close_rerun_session(key):
+    with _rerun_lock:
+        entry = _rerun_sessions.pop(key, None)
+    if entry is not None:
+        entry[1].close()
+
+def get_session():
+    """Return the SQLAlchemy session for the current Streamlit rerun.
+
+    Every call within one script run gets the same session, and the previous
+    run's session is closed when the next rerun of that browser session
+    starts, or when the session's script run context goes away. Outside
+    Streamlit (CLI scripts, tests) sessions are per thread, and on a
+    Streamlit version whose context cannot be wrapped, per call.
+    """
+    ctx = _script_run_ctx()
+    if ctx is None:
+        return _thread_sessions()
+
+    with _rerun_lock:
+        if not hasattr(ctx, "_db_rerun") and not _count_reruns(ctx):
+            # Reruns cannot be told apart: a session for this call only
+            return get_sessionmaker()()
+        entry = _rerun_sessions.get(id(ctx))
+        if entry is not None and entry[0] == ctx._db_rerun:
+            return entry[1]
+        if entry is not None:
+            entry[1].close()
+        session = get_sessionmaker()()
+        _rerun_sessions[id(ctx)] = (ctx._db_rerun, session)
+        return session
 
 def get_db():
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,425 @@
+"""
+Storage backend on the SQLAlchemy models in database/models.py.
+
+Selected with STORAGE_BACKEND = 'postgresql' and meant for a PostgreSQL
+DATABASE_URL in production. All sessions come from the pooled engine in
+database/__init__.py and are scoped to the current Streamlit rerun.
+Rollup rows (FootprintRollup) are updated in the same transaction as the
+footprint they count, and revised footprints move their previous revision
+to FootprintRevision in the transaction that updates them; both keep the
+FootprintDependency rows of the recalculation index in step. References
+among deduplicated footprints (utils/dedupe.py) are resolved in the session
+that read them.
+"""
+import copy
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import and_, case, delete, func, inspect, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from database import get_engine, get_session
+from database.models import Base, User, CarbonFootprint, FootprintDependency, FootprintRevision, FootprintRollup
+from utils import dedupe, pagination, recalculation, rollups
+from utils.storage import StorageBackend
+
+
+def _user_dict(user):
+    return {
+        "id": user.id,
+        "email": user.email,
+        "password": user.password,
+        "created_at": user.created_at
+    }
+
+def _footprint_dict(footprint):
+    return {
+        "id": footprint.id,
+        "user_id": footprint.user_id,
+        "created_at": footprint.created_at,
+        "scope1_emissions": footprint.scope1_emissions,
+        "scope2_emissions": footprint.scope2_emissions,
+        "scope3_emissions": footprint.scope3_emissions,
+        "total_emissions": footprint.total_emissions,
+        "emission_details": footprint.emission_details,
+        "inputs": footprint.inputs,
+        "factor_set_version": footprint.factor_set_version,
+        "revision": footprint.revision,
+        "input_hash": footprint.input_hash,
+        "reference_id": footprint.reference_id,
+        "formula_version": footprint.formula_version
+    }
+
+def _revision_dict(row):
+    return {
+        "footprint_id": row.footprint_id,
+        "revision": row.revision,
+        "user_id": row.user_id,
+        "created_at": row.created_at,
+        "scope1_emissions": row.scope1_emissions,
+        "scope2_emissions": row.scope2_emissions,
+        "scope3_emissions": row.scope3_emissions,
+        "total_emissions": row.total_emissions,
+        "emission_details": row.emission_details,
+        "inputs": row.inputs,
+        "factor_set_version": row.factor_set_version,
+        "superseded_at": row.superseded_at,
+        "input_hash": row.input_hash,
+        "reference_id": row.reference_id,
+        "formula_version": row.formula_version
+    }
+
+def _bucket_dict(row):
+    # A copy, so updating the bucket never mutates the loaded JSON value
+    bucket = {"period_key": row.period_key, "count": row.count, "categories": copy.deepcopy(row.categories)}
+    for field in rollups.SCOPE_FIELDS:
+        bucket[field] = getattr(row, field)
+    return bucket
+
+def _rollup_rows(user_id, user_rollups):
+    for period in rollups.PERIODS:
+        for bucket in rollups.sorted_buckets(user_rollups, period):
+            yield FootprintRollup(user_id=user_id, period=period, **bucket)
+
+
+class SQLAlchemyStorageBackend(StorageBackend):
+    """Backend storing users and footprints through the SQLAlchemy models."""
+
+    def __init__(self):
+        indexed = inspect(get_engine()).has_table(FootprintDependency.__tablename__)
+        Base.metadata.create_all(bind=get_engine())
+        if not indexed:
+            self.rebuild_dependencies()
+
+    @contextmanager
+    def transaction(self):
+        """Run a unit of work on the rerun's session and release its connection."""
+        session = get_session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def get_user_by_email(self, email):
+        with self.transaction() as session:
+            user = session.execute(select(User).where(User.email == email)).scalar_one_or_none()
+            return _user_dict(user) if user else None
+
+    def create_user(self, email, password):
+        user = User(email=email, password=password, created_at=datetime.utcnow().timestamp())
+        try:
+            with self.transaction() as session:
+                session.add(user)
+                session.flush()
+                return _user_dict(user)
+        except IntegrityError:
+            raise ValueError("User with this email already exists")
+
+    def save_carbon_footprint(self, user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions,
+                              emission_details, inputs=None, factor_set_version=None, input_hash=None,
+                              formula_version=None):
+        return self.save_carbon_footprints(user_id, [{
+            "scope1_emissions": scope1_emissions,
+            "scope2_emissions": scope2_emissions,
+            "scope3_emissions": scope3_emissions,
+            "total_emissions": total_emissions,
+            "emission_details": emission_details,
+            "inputs": inputs,
+            "factor_set_version": factor_set_version,
+            "input_hash": input_hash,
+            "formula_version": formula_version
+        }])[0]
+
+    def save_carbon_footprints(self, user_id, footprints):
+        if not footprints:
+            return []
+        created_at = datetime.utcnow().timestamp()
+        with self.transaction() as session:
+            reference_ids = dedupe.reference_ids(
+                footprints, lambda hashes: self._find_by_hash(session, user_id, hashes)
+            )
+            stored = [dedupe.stored_form(f, reference_id) for f, reference_id in zip(footprints, reference_ids)]
+            rows = [
+                CarbonFootprint(
+                    user_id=user_id,
+                    created_at=created_at,
+                    scope1_emissions=footprint["scope1_emissions"],
+                    scope2_emissions=footprint["scope2_emissions"],
+                    scope3_emissions=footprint["scope3_emissions"],
+                    total_emissions=footprint["total_emissions"],
+                    emission_details=footprint["emission_details"],
+                    inputs=footprint.get("inputs"),
+                    factor_set_version=footprint.get("factor_set_version"),
+                    revision=0,
+                    input_hash=footprint.get("input_hash"),
+                    reference_id=footprint.get("reference_id"),
+                    formula_version=footprint.get("formula_version")
+                )
+                for footprint in stored
+            ]
+            # Flushed as batched multi-row INSERT ... RETURNING statements
+            session.add_all(rows)
+            session.flush()
+            # References are returned complete
+            saved = [
+                {**_footprint_dict(row), "emission_details": footprint["emission_details"],
+                 "inputs": footprint.get("inputs")}
+                for row, footprint in zip(rows, footprints)
+            ]
+            self._index_dependencies(session, saved)
+            self._update_rollups(session, user_id, saved)
+            return saved
+
+    def revise_footprints(self, revisions):
+        if not revisions:
+            return []
+        superseded_at = datetime.utcnow().timestamp()
+        wanted = {revision["id"]: revision for revision in revisions}
+        query = (
+            select(CarbonFootprint)
+            .where(CarbonFootprint.id.in_(list(wanted)))
+            .order_by(CarbonFootprint.id)
+            .with_for_update()
+        )
+        revised, by_user = [], {}
+        with self.transaction() as session:
+            for row in session.execute(query).scalars():
+                revision = wanted[row.id]
+                if row.revision != revision.get("revision", 0):
+                    continue
+                old = _footprint_dict(row)
+                session.add(FootprintRevision(
+                    footprint_id=row.id,
+                    superseded_at=superseded_at,
+                    **{key: value for key, value in old.items() if key != "id"}
+                ))
+                for field in rollups.SCOPE_FIELDS:
+                    setattr(row, field, revision[field])
+                row.emission_details = revision["emission_details"]
+                row.inputs = revision.get("inputs")
+                row.factor_set_version = revision.get("factor_set_version")
+                row.input_hash = revision.get("input_hash")
+                row.reference_id = None
+                row.formula_version = revision.get("formula_version")
+                row.revision = old["revision"] + 1
+                new = _footprint_dict(row)
+                revised.append(new)
+                by_user.setdefault(row.user_id, ([], []))
+                by_user[row.user_id][0].append(new)
+                by_user[row.user_id][1].append(old)
+            session.flush()
+            self._index_dependencies(session, revised, replace=True)
+            for user_id, (footprints, replaced) in by_user.items():
+                # The replaced revisions are subtracted from the rollups with their details
+                self._update_rollups(session, user_id, footprints, self._resolve(session, replaced))
+        return revised
+
+    def get_footprint_revisions(self, footprint_id):
+        with self.transaction() as session:
+            return self._revisions(session, footprint_id)
+
+    def _revisions(self, session, footprint_id):
+        query = (
+            select(FootprintRevision)
+            .where(FootprintRevision.footprint_id == footprint_id)
+            .order_by(FootprintRevision.revision)
+        )
+        return self._resolve(session, [_revision_dict(row) for row in session.execute(query).scalars()])
+
+    def _lookup(self, session, user_id, ids):
+        query = select(CarbonFootprint).where(CarbonFootprint.user_id == user_id, CarbonFootprint.id.in_(list(ids)))
+        return {row.id: _footprint_dict(row) for row in session.execute(query).scalars()}
+
+    def _find_by_hash(self, session, user_id, hashes):
+        query = (
+            select(CarbonFootprint.id, CarbonFootprint.input_hash, CarbonFootprint.reference_id)
+            .where(CarbonFootprint.user_id == user_id, CarbonFootprint.input_hash.in_(list(hashes)))
+            # The latest footprint with each hash comes last, preferring ones stored in full
+            .order_by(CarbonFootprint.reference_id.is_(None), CarbonFootprint.created_at, CarbonFootprint.id)
+        )
+        return {row.input_hash: row._asdict() for row in session.execute(query)}
+
+    def _resolve(self, session, footprints):
+        """Resolve the references among footprints in session (see utils/dedupe.py)."""
+        return dedupe.resolve(
+            footprints,
+            lambda user_id, ids: self._lookup(session, user_id, ids),
+            lambda footprint_id: self._revisions(session, footprint_id)
+        )
+
+    def _index_dependencies(self, session, footprints, replace=False):
+        """Record the factor ids footprints depend on in session.
+
+        With replace, the rows of revised footprints are replaced.
+        """
+        if replace and footprints:
+            session.execute(delete(FootprintDependency).where(
+                FootprintDependency.footprint_id.in_([f["id"] for f in footprints])
+            ))
+        rows = [
+            {"footprint_id": f["id"], "factor_id": factor_id}
+            for f in footprints for factor_id in recalculation.footprint_factor_ids(f)
+        ]
+        if rows:
+            session.execute(insert(FootprintDependency), rows)
+
+    def rebuild_dependencies(self):
+        query = select(CarbonFootprint).order_by(CarbonFootprint.id).execution_options(yield_per=1000)
+        with self.transaction() as session:
+            session.execute(delete(FootprintDependency))
+            batch = []
+            for footprint in session.execute(query).scalars():
+                batch.append(_footprint_dict(footprint))
+                if len(batch) == 1000:
+                    self._index_dependencies(session, self._resolve(session, batch))
+                    batch = []
+            self._index_dependencies(session, self._resolve(session, batch))
+
+    def _update_rollups(self, session, user_id, footprints, replaced=()):
+        """Add footprints of a user to its rollup rows, locking them until commit.
+
+        replaced footprints (previous revisions) are subtracted.
+        """
+        months = rollups.summarize(footprints, replaced)
+        for period in rollups.PERIODS:
+            buckets = {}
+            for created_at, month in months:
+                key = rollups.period_key(created_at, period)
+                if key not in buckets:
+                    row = session.get(FootprintRollup, (user_id, period, key), with_for_update=True)
+                    if row is None:
+                        row = FootprintRollup(user_id=user_id, period=period, **rollups.new_bucket(key))
+                        session.add(row)
+                    buckets[key] = (row, _bucket_dict(row))
+                rollups.merge_bucket(buckets[key][1], month)
+            for row, bucket in buckets.values():
+                for field in rollups.SCOPE_FIELDS:
+                    setattr(row, field, bucket[field])
+                row.count = bucket["count"]
+                row.categories = bucket["categories"]
+
+    def get_user_footprints(self, user_id, since=None, until=None, limit=None, order="desc", cursor=None):
+        pagination.check_order(order)
+        query = select(CarbonFootprint).where(CarbonFootprint.user_id == user_id)
+        if since is not None:
+            query = query.where(CarbonFootprint.created_at >= pagination.to_timestamp(since))
+        if until is not None:
+            query = query.where(CarbonFootprint.created_at <= pagination.to_timestamp(until))
+        if cursor is not None:
+            created_at, footprint_id = pagination.decode_cursor(cursor)
+            if order == "desc":
+                query = query.where(or_(
+                    CarbonFootprint.created_at < created_at,
+                    and_(CarbonFootprint.created_at == created_at, CarbonFootprint.id < footprint_id)
+                ))
+            else:
+                query = query.where(or_(
+                    CarbonFootprint.created_at > created_at,
+                    and_(CarbonFootprint.created_at == created_at, CarbonFootprint.id > footprint_id)
+                ))
+        if order == "desc":
+            query = query.order_by(CarbonFootprint.created_at.desc(), CarbonFootprint.id.desc())
+        else:
+            query = query.order_by(CarbonFootprint.created_at, CarbonFootprint.id)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.transaction() as session:
+            return self._resolve(session, [_footprint_dict(f) for f in session.execute(query).scalars()])
+
+    def iter_footprints(self, after_id=None):
+        query = (
+            select(CarbonFootprint)
+            .where(CarbonFootprint.id > (after_id or 0))
+            .order_by(CarbonFootprint.id)
+            .execution_options(yield_per=1000)
+        )
+        with self.transaction() as session:
+            for footprint in session.execute(query).scalars():
+                yield self._resolve(session, [_footprint_dict(footprint)])[0]
+
+    def data_version(self):
+        with self.transaction() as session:
+            # Revisions change rows in place, so they are counted too
+            return tuple(session.execute(select(
+                func.count(CarbonFootprint.id), func.max(CarbonFootprint.id),
+                func.coalesce(func.sum(CarbonFootprint.revision), 0)
+            )).one())
+
+    def count_footprints_by_version(self):
+        without_inputs = func.sum(case(
+            (and_(CarbonFootprint.inputs.is_(None), CarbonFootprint.reference_id.is_(None)), 1), else_=0
+        ))
+        formula_version = func.coalesce(CarbonFootprint.formula_version, 1)
+        query = (
+            select(CarbonFootprint.factor_set_version, formula_version, func.count(CarbonFootprint.id), without_inputs)
+            .group_by(CarbonFootprint.factor_set_version, formula_version)
+        )
+        with self.transaction() as session:
+            return {
+                (version, formula): (count, int(without or 0))
+                for version, formula, count, without in session.execute(query)
+            }
+
+    def iter_dependent_footprints(self, factor_set_version, formula_version, factor_ids=None):
+        query = (
+            select(FootprintDependency.footprint_id, FootprintDependency.factor_id)
+            .join(CarbonFootprint, CarbonFootprint.id == FootprintDependency.footprint_id)
+            .where(
+                CarbonFootprint.factor_set_version == factor_set_version,
+                func.coalesce(CarbonFootprint.formula_version, 1) == formula_version
+            )
+        )
+        if factor_ids is not None:
+            query = query.where(FootprintDependency.factor_id.in_(sorted(factor_ids)))
+        with self.transaction() as session:
+            matched = {}
+            for footprint_id, factor_id in session.execute(query):
+                matched.setdefault(footprint_id, []).append(factor_id)
+            ids = sorted(matched)
+            for start in range(0, len(ids), 500):
+                rows = session.execute(
+                    select(CarbonFootprint).where(CarbonFootprint.id.in_(ids[start:start + 500]))
+                    .order_by(CarbonFootprint.id)
+                ).scalars()
+                for footprint in self._resolve(session, [_footprint_dict(row) for row in rows]):
+                    yield {
+                        "id": footprint["id"],
+                        "user_id": footprint["user_id"],
+                        "revision": footprint["revision"],
+                        "inputs": footprint["inputs"],
+                        "factor_ids": matched[footprint["id"]]
+                    }
+
+    def get_rollups(self, user_id, period="month"):
+        if period not in rollups.PERIODS:
+            raise ValueError(f"period must be one of {rollups.PERIODS}, got {period!r}")
+        query = (
+            select(FootprintRollup)
+            .where(FootprintRollup.user_id == user_id, FootprintRollup.period == period)
+            .order_by(FootprintRollup.period_key)
+        )
+        with self.transaction() as session:
+            return [_bucket_dict(row) for row in session.execute(query).scalars()]
+
+    def rebuild_rollups(self, user_id=None):
+        query = select(CarbonFootprint).order_by(CarbonFootprint.user_id)
+        clear = delete(FootprintRollup)
+        if user_id is not None:
+            query = query.where(CarbonFootprint.user_id == user_id)
+            clear = clear.where(FootprintRollup.user_id == user_id)
+        users = 0
+        with self.transaction() as session:
+            session.execute(clear)
+            current, user_rollups = None, None
+            for footprint in session.execute(query.execution_options(yield_per=1000)).scalars():
+                if footprint.user_id != current:
+                    if user_rollups is not None:
+                        session.add_all(_rollup_rows(current, user_rollups))
+                    current, user_rollups = footprint.user_id, rollups.build([])
+                    users += 1
+                rollups.apply(user_rollups, self._resolve(session, [_footprint_dict(footprint)])[0])
+            if user_rollups is not None:
+                session.add_all(_rollup_rows(current, user_rollups))
+        return users
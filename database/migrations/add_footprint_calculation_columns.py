@@ -0,0 +1,20 @@
+"""
+Add the inputs and factor_set_version columns of carbon_footprints to a
+database created before they existed. New databases get them from the
+models; existing rows keep NULL, meaning unknown.
+
+    python -m database.migrations.add_footprint_calculation_columns
+"""
+from sqlalchemy import create_engine, text
+from database import DATABASE_URL
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text("ALTER TABLE carbon_footprints ADD COLUMN IF NOT EXISTS inputs JSONB"))
+        conn.execute(text("ALTER TABLE carbon_footprints ADD COLUMN IF NOT EXISTS factor_set_version VARCHAR"))
+        conn.commit()
+
+if __name__ == "__main__":
+    migrate()
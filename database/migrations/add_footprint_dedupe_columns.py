@@ -0,0 +1,25 @@
+"""
+Add the input_hash and reference_id columns of carbon_footprints and
+footprint_revisions, and the (user_id, input_hash) index, to a database
+created before footprints were deduplicated (utils/dedupe.py). Existing
+rows keep NULL: they are stored in full and never referenced.
+
+    python -m database.migrations.add_footprint_dedupe_columns
+"""
+from sqlalchemy import create_engine, text
+from database import DATABASE_URL
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+
+    with engine.connect() as conn:
+        for table in ("carbon_footprints", "footprint_revisions"):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS input_hash VARCHAR"))
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS reference_id INTEGER"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_carbon_footprints_user_hash ON carbon_footprints (user_id, input_hash)"
+        ))
+        conn.commit()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,22 @@
+"""
+Add the formula_version column of carbon_footprints and footprint_revisions
+to a database created before formulas were versioned
+(emissions_engine.FORMULA_VERSION). Existing rows keep NULL, which counts as
+formula version 1, so recalculation revises those that use a formula
+changed since.
+
+    python -m database.migrations.add_footprint_formula_version
+"""
+from sqlalchemy import create_engine, text
+from database import DATABASE_URL
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+
+    with engine.connect() as conn:
+        for table in ("carbon_footprints", "footprint_revisions"):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS formula_version INTEGER"))
+        conn.commit()
+
+if __name__ == "__main__":
+    migrate()
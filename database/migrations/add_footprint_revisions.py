@@ -0,0 +1,23 @@
+"""
+Add the revision column of carbon_footprints and the footprint_revisions
+table to a database created before footprints could be recalculated
+(utils/recalculation.py). Existing rows start at revision 0.
+
+    python -m database.migrations.add_footprint_revisions
+"""
+from sqlalchemy import create_engine, text
+from database import DATABASE_URL
+from database.models import FootprintRevision
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text(
+            "ALTER TABLE carbon_footprints ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0"
+        ))
+        conn.commit()
+    FootprintRevision.__table__.create(bind=engine, checkfirst=True)
+
+if __name__ == "__main__":
+    migrate()
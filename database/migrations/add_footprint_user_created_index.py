@@ -0,0 +1,26 @@
+"""
+Add the (user_id, created_at) index of carbon_footprints to a database
+created before footprints were paginated by date (utils/pagination.py).
+create_all only creates missing tables, so existing tables never get it.
+
+On PostgreSQL the index is built CONCURRENTLY, without blocking writes to
+the table while it builds.
+
+    python -m database.migrations.add_footprint_user_created_index
+"""
+from sqlalchemy import create_engine, text
+from database import DATABASE_URL
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+    concurrently = "CONCURRENTLY " if engine.dialect.name == "postgresql" else ""
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(
+            f"CREATE INDEX {concurrently}IF NOT EXISTS ix_carbon_footprints_user_created "
+            "ON carbon_footprints (user_id, created_at)"
+        ))
+
+if __name__ == "__main__":
+    migrate()
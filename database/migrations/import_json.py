@@ -0,0 +1,433 @@
+"""
+Bulk import of the JSON storage (carbon_data.json plus its journal) into the
+database on DATABASE_URL.
+
+    python -m database.migrations.import_json [data/carbon_data.json] [--batch-size N]
+
+Footprints moved to archive segments (data/archive, see utils/archive.py)
+and the revision history of recalculated footprints
+(data/footprint_revisions.jsonl) are imported as well. The data file is parsed incrementally, so memory use does not grow with its
+size. Rows are inserted in batches, with COPY on PostgreSQL and executemany
+elsewhere. Progress is recorded in a checkpoint table in the same
+transaction as each batch, so an interrupted import resumes exactly where it
+stopped when run again. Afterwards the id sequences are re-synced the same
+way database/migrations/fix_sequence.py does, and the footprint rollups and
+the recalculation dependency index are rebuilt from the imported rows.
+"""
+import argparse
+import csv
+import io
+import json
+import time
+from pathlib import Path
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, insert, select, text, update
+
+from database import get_engine
+from database.models import Base, User, CarbonFootprint, FootprintRevision
+from utils import archive, emission_codec
+from utils.serialization import MSGPACK_MAGIC, detect_format
+
+DEFAULT_SOURCE = Path(__file__).resolve().parents[2] / "data" / "carbon_data.json"
+DEFAULT_BATCH_SIZE = 5000
+CHUNK_SIZE = 1024 * 1024
+
+TABLES = {
+    "users": User.__table__,
+    "carbon_footprints": CarbonFootprint.__table__,
+    "footprint_revisions": FootprintRevision.__table__,
+}
+COLUMNS = {
+    "users": ["id", "email", "password", "created_at"],
+    "carbon_footprints": [
+        "id", "user_id", "created_at", "scope1_emissions", "scope2_emissions",
+        "scope3_emissions", "total_emissions", "emission_details", "inputs", "factor_set_version", "revision",
+        "input_hash", "reference_id", "formula_version"
+    ],
+    "footprint_revisions": [
+        "footprint_id", "revision", "user_id", "created_at", "scope1_emissions", "scope2_emissions",
+        "scope3_emissions", "total_emissions", "emission_details", "inputs", "factor_set_version", "superseded_at",
+        "input_hash", "reference_id", "formula_version"
+    ],
+}
+JSON_COLUMNS = {"emission_details", "inputs"}
+
+checkpoint_metadata = MetaData()
+checkpoints = Table(
+    "json_import_checkpoints", checkpoint_metadata,
+    Column("source", String, primary_key=True),
+    Column("section", String, primary_key=True),
+    Column("position", Integer, nullable=False),
+)
+
+
+def iter_array_items(path, chunk_size=CHUNK_SIZE):
+    """Yield (key, item) for every element of the top-level arrays in a JSON object file.
+
+    Only one element at a time is held in memory besides the read buffer.
+    Other top-level values are decoded whole and skipped.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def expect(chars):
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] not in chars:
+                raise ValueError(f"Malformed JSON in {path}: expected one of {chars!r}")
+            pos += 1
+            return buf[pos - 1]
+
+        def decode():
+            nonlocal pos
+            while True:
+                skip_ws()
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # Most likely the value continues past the buffer
+                    if eof:
+                        raise
+                    fill()
+                    continue
+                # A number at the very end of the buffer may be cut short
+                if end == len(buf) and not eof:
+                    fill()
+                    continue
+                pos = end
+                return value
+
+        fill()
+        expect("{")
+        skip_ws()
+        if pos < len(buf) and buf[pos] == "}":
+            return
+        while True:
+            key = decode()
+            expect(":")
+            skip_ws()
+            if pos < len(buf) and buf[pos] == "[":
+                pos += 1
+                skip_ws()
+                if pos < len(buf) and buf[pos] == "]":
+                    pos += 1
+                else:
+                    while True:
+                        yield key, decode()
+                        if expect(",]") == "]":
+                            break
+            else:
+                decode()
+            if expect(",}") == "}":
+                return
+
+
+def iter_msgpack_array_items(path):
+    """Yield (key, item) like iter_array_items for a data file in MessagePack format."""
+    import msgpack
+
+    with open(path, "rb") as f:
+        f.read(len(MSGPACK_MAGIC))
+        unpacker = msgpack.Unpacker(f, raw=False, strict_map_key=False)
+        for _ in range(unpacker.read_map_header()):
+            key = unpacker.unpack()
+            try:
+                length = unpacker.read_array_header()
+            except ValueError:
+                unpacker.skip()
+                continue
+            for _ in range(length):
+                yield key, unpacker.unpack()
+
+
+def iter_data_file_items(path):
+    """Yield (key, item) from a data file in any format written by utils/serialization.py."""
+    with open(path, "rb") as f:
+        header = f.read(len(MSGPACK_MAGIC))
+    if detect_format(header) == "msgpack":
+        return iter_msgpack_array_items(path)
+    return iter_array_items(path)
+
+
+def iter_journal_items(path):
+    """Yield (table, record) for every readable entry of a storage journal."""
+    if not path.exists():
+        return
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("table") in TABLES and isinstance(entry.get("record"), dict):
+                yield entry["table"], entry["record"]
+
+
+def iter_archive_items(source):
+    """Yield (table, record) for every footprint in the archive segments next to the data file."""
+    directory = Path(source).with_name("archive")
+    manifest = directory / "manifest.json"
+    if not manifest.exists():
+        return
+    with open(manifest, "r") as f:
+        segments = json.load(f)["segments"]
+    for segment in segments:
+        with open(directory / segment["file"], "rb") as f:
+            for record in archive.decode_segment(f.read(), segment["compression"]):
+                yield "carbon_footprints", record
+
+
+def iter_revision_items(source):
+    """Yield (table, record) for every entry of the revision history next to the data file."""
+    path = Path(source).with_name("footprint_revisions.jsonl")
+    if not path.exists():
+        return
+    seen = set()
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # An interrupted revision can leave an entry twice
+            key = (record.get("footprint_id"), record.get("revision"))
+            if key not in seen:
+                seen.add(key)
+                yield "footprint_revisions", record
+
+
+def journal_path(source):
+    """Journal holding the records written since the data file's snapshot.
+
+    carbon_data.json mirrors the current snapshot generation; its journal
+    is the one named by data/generations/current.json (see utils/json_storage.py).
+    """
+    pointer = source.with_name("generations") / "current.json"
+    if pointer.exists():
+        with open(pointer, "r") as f:
+            generation = json.load(f)["generation"]
+        return pointer.with_name(f"{generation}.journal.jsonl")
+    return source.with_name(source.stem + ".journal.jsonl")
+
+
+def load_layouts(source):
+    """Load the emission_details key layouts stored next to the data file."""
+    path = Path(source).with_name("emission_schemas.json")
+    if not path.exists():
+        return []
+    with open(path, "r") as f:
+        return [[tuple(key) for key in layout] for layout in json.load(f)]
+
+
+def _row(table, record, layouts):
+    row = {column: record.get(column) for column in COLUMNS[table]}
+    if table != "users":
+        row["emission_details"] = emission_codec.decode(row["emission_details"] or {}, layouts)
+        row["revision"] = row["revision"] or 0
+    return row
+
+
+def _copy_rows(conn, table, rows):
+    """Insert rows with PostgreSQL COPY on the connection's current transaction."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            # None stays an empty field, which COPY reads as NULL
+            json.dumps(row[column]) if column in JSON_COLUMNS and row[column] is not None else row[column]
+            for column in COLUMNS[table]
+        ])
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(COLUMNS[table])}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+
+class JsonImporter:
+    """Batch writer that commits rows together with their checkpoint."""
+
+    def __init__(self, engine, source, batch_size):
+        self.engine = engine
+        self.source = str(source)
+        self.batch_size = batch_size
+        self.use_copy = engine.dialect.name == "postgresql"
+        self.started = time.monotonic()
+        self.imported = {table: 0 for table in TABLES}
+        self.layouts = load_layouts(source)
+
+    def position(self, section):
+        with self.engine.connect() as conn:
+            value = conn.execute(
+                select(checkpoints.c.position)
+                .where(checkpoints.c.source == self.source, checkpoints.c.section == section)
+            ).scalar()
+        return value or 0
+
+    def write(self, section, position, batch, replace=False):
+        """Insert one batch and advance the section's checkpoint atomically.
+
+        With replace, the rows overwrite the existing rows with their ids.
+        """
+        with self.engine.begin() as conn:
+            for table in TABLES:
+                rows = [_row(table, record, self.layouts) for t, record in batch if t == table]
+                if not rows:
+                    continue
+                if replace:
+                    columns = TABLES[table].c
+                    conn.execute(
+                        update(TABLES[table]).where(columns.id == bindparam("_id"))
+                        .values({column: bindparam(column) for column in COLUMNS[table] if column != "id"}),
+                        [{**row, "_id": row["id"]} for row in rows]
+                    )
+                    continue
+                if self.use_copy:
+                    _copy_rows(conn, table, rows)
+                else:
+                    conn.execute(insert(TABLES[table]), rows)
+                self.imported[table] += len(rows)
+            updated = conn.execute(
+                update(checkpoints)
+                .where(checkpoints.c.source == self.source, checkpoints.c.section == section)
+                .values(position=position)
+            )
+            if updated.rowcount == 0:
+                conn.execute(insert(checkpoints).values(source=self.source, section=section, position=position))
+        self.report(section, position)
+
+    def report(self, section, position):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        total = sum(self.imported.values())
+        print(f"{section}: {position} records processed, "
+              f"{self.imported['users']} users / {self.imported['carbon_footprints']} footprints / "
+              f"{self.imported['footprint_revisions']} revisions imported ({total / elapsed:.0f} rows/s)")
+
+    def run(self, section, items, replace=False):
+        """Import (table, record) items of one section, skipping the checkpointed prefix."""
+        done = self.position(section)
+        if done:
+            print(f"{section}: resuming after {done} records")
+        position = 0
+        batch = []
+        for item in items:
+            position += 1
+            if position <= done:
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.write(section, position, batch, replace)
+                batch = []
+        if batch:
+            self.write(section, position, batch, replace)
+
+
+def resync_sequences(engine):
+    """Move the id sequences past the imported ids (PostgreSQL only)."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect() as conn:
+        for table in TABLES:
+            max_id = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0
+            conn.execute(text(f"""
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'), {max(max_id, 1)}, {'true' if max_id else 'false'})
+            """))
+        conn.commit()
+
+
+def import_json(source=DEFAULT_SOURCE, batch_size=DEFAULT_BATCH_SIZE):
+    """Import a JSON data file and its journal into DATABASE_URL, resuming if interrupted."""
+    source = Path(source).resolve()
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    checkpoint_metadata.create_all(bind=engine)
+    importer = JsonImporter(engine, source, batch_size)
+
+    # json_storage writes "users" before "carbon_footprints", so footprints
+    # never reference users that have not been inserted yet.
+    max_ids = {"users": 0, "carbon_footprints": 0}
+
+    def snapshot_items():
+        for key, record in iter_data_file_items(source):
+            if key in TABLES and isinstance(record, dict):
+                max_ids[key] = max(max_ids[key], record.get("id") or 0)
+                yield key, record
+
+    importer.run("snapshot", snapshot_items())
+
+    def archive_items():
+        for table, record in iter_archive_items(source):
+            max_ids[table] = max(max_ids[table], record.get("id") or 0)
+            yield table, record
+
+    importer.run("archive", archive_items())
+
+    # The snapshot and archive are parsed whole even when resuming, so max_ids is complete
+    # here. Journal entries at or below it were already compacted into it, unless
+    # they are later revisions of a footprint, which replace the imported row.
+    # Only the latest revision of a record in the journal counts.
+    latest = {}
+    for table, record in iter_journal_items(journal_path(source)):
+        key = (table, record.get("id"))
+        if key not in latest or (record.get("revision") or 0) > (latest[key][1].get("revision") or 0):
+            latest[key] = (table, record)
+    importer.run("journal", (
+        (table, record) for table, record in latest.values() if (record.get("id") or 0) > max_ids[table]
+    ))
+    importer.run("journal revisions", (
+        (table, record) for table, record in latest.values()
+        if (record.get("id") or 0) <= max_ids[table] and record.get("revision")
+    ), replace=True)
+    importer.run("revision history", iter_revision_items(source))
+
+    resync_sequences(engine)
+
+    from database.backend import SQLAlchemyStorageBackend
+    backend = SQLAlchemyStorageBackend()
+    users = backend.rebuild_rollups()
+    print(f"Rebuilt rollups for {users} users")
+    backend.rebuild_dependencies()
+    print(f"Import complete: {importer.imported['users']} users, "
+          f"{importer.imported['carbon_footprints']} footprints, "
+          f"{importer.imported['footprint_revisions']} footprint revisions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import carbon_data.json into DATABASE_URL")
+    parser.add_argument("source", nargs="?", default=DEFAULT_SOURCE, help="Path to carbon_data.json")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per transaction")
+    args = parser.parse_args()
+    import_json(args.source, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
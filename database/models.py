@@ -1,17 +1,21 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, JSON, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 Base = declarative_base()
 
+def _utc_timestamp():
+    return datetime.utcnow().timestamp()
+
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     email = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
-    created_at = Column(Float, default=datetime.utcnow().timestamp, nullable=False)
+    created_at = Column(Float, default=_utc_timestamp, nullable=False)
 
     # Relationship to CarbonFootprint
     carbon_footprints = relationship("CarbonFootprint", back_populates="user")
@@ -19,10 +23,16 @@ class User(Base):
 
 class CarbonFootprint(Base):
     __tablename__ = 'carbon_footprints'
+    __table_args__ = (
+        # History and latest-footprint queries filter by user and sort by date
+        Index('ix_carbon_footprints_user_created', 'user_id', 'created_at'),
+        # Deduplicated saves look up a user's footprints by input_hash
+        Index('ix_carbon_footprints_user_hash', 'user_id', 'input_hash'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    created_at = Column(Float, default=datetime.utcnow().timestamp, nullable=False)
+    created_at = Column(Float, default=_utc_timestamp, nullable=False)
     
     # Emissions by scope
     scope1_emissions = Column(Float, nullable=False)  # Direct emissions
@@ -31,7 +41,78 @@ class CarbonFootprint(Base):
     total_emissions = Column(Float, nullable=False)   # Total carbon footprint
     
     # Detailed emission data
-    emission_details = Column(JSON, nullable=False)   # Stores detailed breakdown by category
+    emission_details = Column(JSON().with_variant(JSONB, 'postgresql'), nullable=False)   # Stores detailed breakdown by category
+
+    # How the footprint was calculated: calculator inputs that differ from
+    # their defaults and the emission factor set version (utils/factor_store.py)
+    inputs = Column(JSON().with_variant(JSONB, 'postgresql'), nullable=True)
+    factor_set_version = Column(String, nullable=True)
+
+    # Incremented each time a recalculation revises the footprint; the
+    # previous revisions are kept in footprint_revisions
+    revision = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # Hash of the inputs, factor set and formula versions (emissions_engine.input_hash).
+    # A footprint with the same hash as an earlier one of its user may be
+    # stored as a reference to it, without emission_details and inputs
+    # (utils/dedupe.py)
+    input_hash = Column(String, nullable=True)
+    reference_id = Column(Integer, nullable=True)
+
+    # emissions_engine.FORMULA_VERSION of the results (NULL: version 1)
+    formula_version = Column(Integer, nullable=True)
     
     # Relationship to User
-    user = relationship("User", back_populates="carbon_footprints")
\ No newline at end of file
+    user = relationship("User", back_populates="carbon_footprints")
+
+
+class FootprintRevision(Base):
+    """A previous revision of a footprint, superseded by a recalculation (utils/recalculation.py)."""
+    __tablename__ = 'footprint_revisions'
+
+    footprint_id = Column(Integer, ForeignKey('carbon_footprints.id'), primary_key=True)
+    revision = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+    scope1_emissions = Column(Float, nullable=False)
+    scope2_emissions = Column(Float, nullable=False)
+    scope3_emissions = Column(Float, nullable=False)
+    total_emissions = Column(Float, nullable=False)
+    emission_details = Column(JSON().with_variant(JSONB, 'postgresql'), nullable=False)
+    inputs = Column(JSON().with_variant(JSONB, 'postgresql'), nullable=True)
+    factor_set_version = Column(String, nullable=True)
+    input_hash = Column(String, nullable=True)
+    reference_id = Column(Integer, nullable=True)
+    formula_version = Column(Integer, nullable=True)
+
+    superseded_at = Column(Float, default=_utc_timestamp, nullable=False)
+
+
+class FootprintDependency(Base):
+    """A factor a footprint depends on, indexed for recalculation (utils/recalculation.py)."""
+    __tablename__ = 'footprint_dependencies'
+    __table_args__ = (
+        Index('ix_footprint_dependencies_footprint', 'footprint_id'),
+    )
+
+    factor_id = Column(String, primary_key=True)
+    footprint_id = Column(Integer, ForeignKey('carbon_footprints.id'), primary_key=True)
+
+
+class FootprintRollup(Base):
+    """Running totals of a user's footprints for one month, quarter or year (utils/rollups.py)."""
+    __tablename__ = 'footprint_rollups'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    period = Column(String, primary_key=True)      # 'month', 'quarter' or 'year'
+    period_key = Column(String, primary_key=True)  # e.g. '2025-03', '2025-Q1', '2025'
+
+    count = Column(Integer, nullable=False)
+    scope1_emissions = Column(Float, nullable=False)
+    scope2_emissions = Column(Float, nullable=False)
+    scope3_emissions = Column(Float, nullable=False)
+    total_emissions = Column(Float, nullable=False)
+
+    # Sums of every emission_details category, by scope
+    categories = Column(JSON().with_variant(JSONB, 'postgresql'), nullable=False)
@@ -13,6 +13,9 @@ from datetime import datetime
 
 t = get_translations()
 
+# Footprints per page of the detailed history table
+HISTORY_PAGE_SIZE = 20
+
 # Hide default sidebar navigation
 st.markdown('''
     <style>
@@ -69,8 +72,9 @@ if not st.session_state.get('authenticated', False):
 st.title("📈 " + t.get("history", "History"))
 
 try:
-    # Get user's footprint history from json_storage
-    from utils.json_storage import get_user_footprints
+    # Get user's footprint history from the configured storage backend
+    from utils.storage import get_user_footprints, get_rollups
+    from utils.pagination import encode_cursor
     
     # Get the current user's ID from session state
     user_id = st.session_state.get('user_id')
@@ -78,20 +82,17 @@ try:
         st.error("User not authenticated")
         st.stop()
         
-    # Get user's footprints
-    footprints = get_user_footprints(user_id)
-    
-    # Sort by creation date, descending
-    footprints = sorted(footprints, key=lambda x: x.get('created_at', 0), reverse=True)
+    # Only the latest footprint is needed for the overview and breakdown
+    latest_page = get_user_footprints(user_id, limit=1)
     
-    if not footprints:
+    if not latest_page:
         st.info("📃 " + t.get("no_history", "No calculation history yet. Try calculating your carbon footprint first!"))
         if st.button("🌍 " + t.get("go_to_calculator", "Go to Calculator")):
             st.switch_page("pages/2_Calculator.py")
         st.stop()
     
     # Get latest footprint
-    latest = footprints[0]
+    latest = latest_page[0]
     
     # Display latest emissions overview
     st.subheader("📈 " + t.get("latest_carbon_footprint_overview", "Latest Carbon Footprint Overview"))
@@ -201,16 +202,49 @@ try:
     # Historical Trends
     st.subheader("📈 " + t.get("historical_trends", "Historical Trends"))
     
+    periods = {
+        t.get("monthly", "Monthly"): "month",
+        t.get("quarterly", "Quarterly"): "quarter",
+        t.get("yearly", "Yearly"): "year"
+    }
+    aggregations = {
+        t.get("average_per_calculation", "Average per calculation"): "average",
+        t.get("sum", "Sum"): "sum"
+    }
+    col_period, col_aggregation = st.columns(2)
+    with col_period:
+        period = periods[st.selectbox(t.get("period", "Period"), list(periods.keys()))]
+    with col_aggregation:
+        aggregation = aggregations[st.selectbox(t.get("aggregation", "Aggregation"), list(aggregations.keys()))]
+    
+    # The trend reads the precomputed rollups, one row per period
+    buckets = get_rollups(user_id, period)
+    
+    def to_rows(items):
+        return pd.DataFrame([
+            {
+                'Date': pd.to_datetime(f['created_at'], unit='s'),
+                'Scope 1': f['scope1_emissions'],
+                'Scope 2': f['scope2_emissions'],
+                'Scope 3': f['scope3_emissions'],
+                'Total': f['total_emissions']
+            } for f in items
+        ], columns=['Date', 'Scope 1', 'Scope 2', 'Scope 3', 'Total'])
+    
     # Prepare historical data
     hist_data = pd.DataFrame([
         {
-            'Date': pd.to_datetime(f['created_at'], unit='s'),
-            'Scope 1': f['scope1_emissions'],
-            'Scope 2': f['scope2_emissions'],
-            'Scope 3': f['scope3_emissions'],
-            'Total': f['total_emissions']
-        } for f in footprints
-    ])
+            'Date': b['period_key'],
+            'Scope 1': b['scope1_emissions'],
+            'Scope 2': b['scope2_emissions'],
+            'Scope 3': b['scope3_emissions'],
+            'Total': b['total_emissions'],
+            'Calculations': b['count']
+        } for b in buckets
+    ], columns=['Date', 'Scope 1', 'Scope 2', 'Scope 3', 'Total', 'Calculations'])
+    if aggregation == "average":
+        for column in ['Scope 1', 'Scope 2', 'Scope 3', 'Total']:
+            hist_data[column] = hist_data[column] / hist_data['Calculations']
     
     # Create line chart
     fig = go.Figure()
@@ -222,6 +256,7 @@ try:
     fig.update_layout(
         title=t.get('emissions_over_time', 'Emissions Over Time'),
         xaxis_title=t.get('date', 'Date'),
+        xaxis_type='category',
         yaxis_title=t.get('emissions_kgco2e', 'Emissions (kgCO₂e)'),
         hovermode='x unified',
         showlegend=True,
@@ -229,10 +264,19 @@ try:
     )
     st.plotly_chart(fig, use_container_width=True)
     
-    # Data table
+    # Data table, paged with cursors so each rerun reads one page
     st.subheader("📋 " + t.get("detailed_history", "Detailed History"))
+    # One stack of page cursors per user, so signing in as someone else starts on the newest page
+    if st.session_state.get('history_cursors_user') != user_id:
+        st.session_state.history_cursors = [None]
+        st.session_state.history_cursors_user = user_id
+    cursor = st.session_state.history_cursors[-1]
+    page = get_user_footprints(user_id, limit=HISTORY_PAGE_SIZE + 1, cursor=cursor)
+    has_older = len(page) > HISTORY_PAGE_SIZE
+    page = page[:HISTORY_PAGE_SIZE]
+    
     st.dataframe(
-        hist_data.style.format({
+        to_rows(page).style.format({
             'Scope 1': '{:.1f}',
             'Scope 2': '{:.1f}',
             'Scope 3': '{:.1f}',
@@ -241,6 +285,15 @@ try:
         hide_index=True,
         use_container_width=True
     )
+    col_newer, col_older = st.columns(2)
+    with col_newer:
+        if st.button("⬅️ " + t.get("newer", "Newer"), disabled=len(st.session_state.history_cursors) == 1, use_container_width=True):
+            st.session_state.history_cursors.pop()
+            st.rerun()
+    with col_older:
+        if st.button(t.get("older", "Older") + " ➡️", disabled=not has_older, use_container_width=True):
+            st.session_state.history_cursors.append(encode_cursor(page[-1]))
+            st.rerun()
 
 except Exception as e:
     st.error(t.get("error_loading_history", "Error loading history:") + f" {str(e)}")
@@ -10,6 +10,7 @@ from geopy.distance import geodesic
 from folium.plugins import HeatMap
 from components.sidebar import show_sidebar
 from datetime import datetime
+from utils.factor_store import get_factor_set
 
 t = get_translations()
 
@@ -37,11 +38,14 @@ with col1:
 with col2:
     fuel_type = st.selectbox(t.get("fuel_type", "Fuel Type"), [t.get("diesel", "Diesel"), t.get("gasoline", "Gasoline"), t.get("lpg", "LPG")])
 
-# Emission factors (kg CO2 per km)
+# Emission factors (kg CO2 per km) from the configured factor set
+factor_set = get_factor_set()
 EMISSION_FACTORS = {
-    "Light Truck": {"Diesel": 0.25, "Gasoline": 0.29, "LPG": 0.21},
-    "Medium Truck": {"Diesel": 0.35, "Gasoline": 0.40, "LPG": 0.30},
-    "Heavy Truck": {"Diesel": 0.45, "Gasoline": 0.50, "LPG": 0.40}
+    vehicle: {
+        fuel: factor_set.find(f"{vehicle.lower().replace(' ', '_')}_{fuel.lower()}", "kg CO2/km").value
+        for fuel in ("Diesel", "Gasoline", "LPG")
+    }
+    for vehicle in ("Light Truck", "Medium Truck", "Heavy Truck")
 }
 
 # Initialize session state
@@ -0,0 +1,125 @@
+"""Tests of the emissions engine (utils/emissions_engine.py)."""
+import random
+
+import pytest
+
+from utils import emissions_engine
+
+
+def calculator_formulas(v):
+    """The Calculator page's original formulas, with the freight correction of formula version 2."""
+    freight = 0.001  # masses in kg against factors per tonne-km (emissions_engine.FORMULA_CHANGES)
+    scope1 = {
+        "stationary_combustion": v["stationary_fuel_consumption"] * (v["stationary_cc"] * (44 / 12))
+        if v["stationary_use_cc"] and v["stationary_cc"] > 0
+        else v["stationary_fuel_consumption"] * v["stationary_ef"],
+        "road_transport": v["road_transport_fuel"] * v["road_transport_ef"],
+        "railways": v["railways_fuel"] * 4150 if v["railways_fuel"] > 0 else 0,
+        "marine_navigation": v["marine_fuel"] * v["marine_ef"],
+        "offroad_vehicles": v["offroad_fuel"] * v["offroad_ef"],
+        "process_emissions": v["process_activity_level"] * v["process_ef"],
+        "fugitive_emissions": v["fugitive_activity_data"] * v["fugitive_ef"],
+        "custom_natural_gas": v["custom_natural_gas"] * 2.1,
+        "custom_fuel_oil": v["custom_fuel_oil"] * 2.68,
+        "custom_company_vehicles": v["custom_company_vehicle_distance"] * 0.14,
+        "custom_fleet_fuel": v["custom_fleet_fuel_consumption"] * 2.31,
+        "custom_process": v["custom_process_activity_data"] * 1.0,
+        "custom_fugitive": v["custom_refrigerant_leakage"] * 1430,
+    }
+    scope2 = {
+        "purchased_energy": v["scope2_purchased_energy"] * v["scope2_purchased_energy_ef"],
+        "custom_electricity": v["custom_electricity_usage"] * 0.233 * (1 - v["custom_renewable_percentage"] / 100),
+        "custom_heat": v["custom_heat_steam_usage"] * 270,
+    }
+    scope3 = {
+        "purchased_goods_spend": v["scope3_spend_goods"] * v["scope3_ef_spend_goods"],
+        "purchased_goods_mass": v["scope3_mass_goods"] * v["scope3_ef_mass_goods"],
+        "capital_goods": v["scope3_mass_capital"] * v["scope3_ef_capital"],
+        "fuel_energy_related": v["scope3_fuel_energy_purchased"] * v["scope3_ef_wtt"],
+        "upstream_transport": (v["scope3_mass_upstream"] * v["scope3_dist_upstream"]) * v["scope3_ef_tonne_km_up"] * freight,
+        "waste_ch4": v["scope3_waste_mass"] * v["scope3_doc"] * v["scope3_docf"] * v["scope3_f"] * (16 / 12) * (1 - v["scope3_r"]),
+        "waste_co2_incineration": v["scope3_waste_mass"] * v["scope3_ef_incineration"],
+        "business_travel": v["scope3_business_travel_distance"] * v["scope3_ef_mode_travel"],
+        "employee_commuting": v["scope3_employees"] * v["scope3_trips_per_year"] * v["scope3_avg_commute_distance"]
+        * v["scope3_ef_mode_commute"],
+        "upstream_leased_assets": v["scope3_fuel_leased"] * v["scope3_ef_fuel_leased"],
+        "downstream_transport": (v["scope3_mass_downstream"] * v["scope3_dist_downstream"]) * v["scope3_ef_tonne_km_down"]
+        * freight,
+        "processing_sold_products": v["scope3_mass_sold_products"] * v["scope3_ef_processing"],
+        "use_sold_products": v["scope3_energy_use_sold"] * v["scope3_ef_energy_sold"],
+        "end_of_life": v["scope3_waste_sold_products"] * v["scope3_ef_disposal"],
+        "downstream_leased_assets": v["scope3_fuel_downleased"] * v["scope3_ef_fuel_downleased"],
+        "franchises": v["scope3_franchise_area"] * v["scope3_ef_franchise_area"],
+        "investee_emissions": v["scope3_investee_emissions"],
+        "investment_value": v["scope3_investment_value"] * v["scope3_ef_investment"],
+        "custom_flight_miles": v["custom_flight_distance"] * 0.200,
+        "custom_hotel_nights": v["custom_hotel_nights"] * 31.3,
+        "custom_employee_commuting": v["custom_num_employees"] * v["custom_avg_commute"] * v["custom_work_days"] * 0.14,
+    }
+    return {"scope1": scope1, "scope2": scope2, "scope3": scope3}
+
+
+def random_values(rng):
+    """Calculator values with about half the inputs moved away from their defaults."""
+    values = dict(emissions_engine.defaults())
+    for key, default in emissions_engine.defaults().items():
+        if rng.random() < 0.5:
+            if isinstance(default, bool):
+                values[key] = rng.random() < 0.5
+            elif key in ("scope3_r", "scope3_doc", "scope3_docf", "scope3_f", "custom_renewable_percentage"):
+                values[key] = rng.random() * (100 if key == "custom_renewable_percentage" else 1)
+            elif isinstance(default, int):
+                values[key] = rng.randint(0, 300)
+            else:
+                values[key] = rng.uniform(0, 1000)
+    return values
+
+
+ROWS = [random_values(random.Random(seed)) for seed in range(200)]
+
+
+def assert_matches(footprint, values):
+    expected = calculator_formulas(values)
+    for scope, categories in expected.items():
+        assert footprint["emission_details"][scope] == pytest.approx(categories, rel=1e-12, abs=1e-9)
+        assert footprint[f"{scope}_emissions"] == pytest.approx(sum(categories.values()), rel=1e-12, abs=1e-9)
+    total = sum(sum(categories.values()) for categories in expected.values())
+    assert footprint["total_emissions"] == pytest.approx(total, rel=1e-12, abs=1e-9)
+
+
+def test_defaults_match_the_calculator():
+    assert_matches(emissions_engine.calculate({}), dict(emissions_engine.defaults()))
+
+
+@pytest.mark.parametrize("values", ROWS[:50])
+def test_calculate_matches_the_calculator(values):
+    footprint = emissions_engine.calculate(values)
+    assert_matches(footprint, values)
+    assert footprint["formula_version"] == emissions_engine.FORMULA_VERSION
+
+
+def test_batch_evaluation_matches_single_footprints():
+    batch = emissions_engine.to_footprints(emissions_engine.evaluate(ROWS))
+    for footprint, values in zip(batch, ROWS):
+        assert_matches(footprint, values)
+        assert footprint["inputs"] == emissions_engine.calculate(values)["inputs"]
+
+
+@pytest.mark.parametrize("stream", ["upstream", "downstream"])
+def test_freight_is_tonnes_times_km_times_the_tonne_km_factor(stream):
+    # 2,000 kg over 100 km is 200 tonne-km
+    footprint = emissions_engine.calculate({f"scope3_mass_{stream}": 2000.0, f"scope3_dist_{stream}": 100.0})
+    factor = emissions_engine.factor_values()["freight_transport"]
+    assert footprint["emission_details"]["scope3"][f"{stream}_transport"] == pytest.approx(200 * factor)
+    assert footprint["formula_version"] == 2
+    assert emissions_engine.changed_activities(1) == [
+        activity for activity in emissions_engine.ACTIVITIES if activity.formula is emissions_engine.freight
+    ]
+
+
+def test_unit_check_rejects_activities_at_another_scale(monkeypatch):
+    emissions_engine._check_units()
+    # Freight without its conversion to tonnes gives emissions 1000x too high
+    monkeypatch.setattr(emissions_engine, "CONVERTED_ARGS", {})
+    with pytest.raises(ValueError, match="upstream_transport"):
+        emissions_engine._check_units()
@@ -0,0 +1,58 @@
+"""Syncing the Parquet mirror when footprint ids are committed out of order."""
+import time
+
+import pytest
+
+from utils import emissions_engine
+
+pytest.importorskip("pyarrow")
+from utils import parquet_mirror  # noqa: E402
+
+
+class Committed:
+    """A storage whose committed footprints the test controls."""
+
+    def __init__(self):
+        self.footprints = {}
+
+    def commit(self, footprint_id, age=0.0):
+        footprint = emissions_engine.calculate({"custom_electricity_usage": 100.0 * footprint_id})
+        self.footprints[footprint_id] = {**footprint, "id": footprint_id, "user_id": 1,
+                                         "created_at": time.time() - age}
+
+    def iter_footprints(self, after_id=None):
+        return (self.footprints[i] for i in sorted(self.footprints) if i > (after_id or 0))
+
+
+def mirrored_ids(root):
+    return sorted(parquet_mirror.read_dataset(root).to_table(columns=["id"]).column("id").to_pylist())
+
+
+def test_sync_picks_up_ids_committed_after_higher_ones(tmp_path):
+    storage = Committed()
+    for footprint_id in (1, 2, 4):
+        storage.commit(footprint_id)
+    assert parquet_mirror.sync(storage, root=tmp_path) == 3
+    assert parquet_mirror.read_state(tmp_path)["watermark"] == 2
+
+    # Id 3 was allocated before 4 but committed after the sync
+    storage.commit(3)
+    storage.commit(5)
+    assert parquet_mirror.sync(storage, root=tmp_path) == 2
+    assert mirrored_ids(tmp_path) == [1, 2, 3, 4, 5]
+    assert parquet_mirror.read_state(tmp_path) == {"watermark": 5, "mirrored": {}}
+
+
+def test_ids_never_committed_are_passed_over_after_the_grace_period(tmp_path):
+    storage = Committed()
+    storage.commit(1)
+    storage.commit(3, age=parquet_mirror.COMMIT_GRACE + 60)
+    storage.commit(6)
+    assert parquet_mirror.sync(storage, root=tmp_path) == 3
+    # 2 is given up on, 4 and 5 may still come
+    state = parquet_mirror.read_state(tmp_path)
+    assert state["watermark"] == 3 and list(state["mirrored"]) == ["6"]
+
+    storage.commit(5)
+    assert parquet_mirror.sync(storage, root=tmp_path) == 1
+    assert mirrored_ids(tmp_path) == [1, 3, 5, 6]
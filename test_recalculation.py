@@ -0,0 +1,98 @@
+"""Recalculation of stale footprints on the JSON, SQLite and SQLAlchemy backends."""
+import pytest
+
+from utils import emissions_engine, factor_store, recalculation
+from utils.storage import JsonStorageBackend
+
+TARGET = "test.2"
+
+
+@pytest.fixture
+def corrected_set(monkeypatch):
+    """A factor set version that only changes grid_electricity."""
+    current = factor_store.get_factor_set()
+    key = emissions_engine.FACTORS["grid_electricity"]
+    factors = dict(current.factors)
+    factors[key] = factors[key]._replace(value=factors[key].value * 2)
+    corrected = factor_store.FactorSet(TARGET, factors)
+    monkeypatch.setitem(factor_store._sets, TARGET, corrected)
+    return corrected
+
+
+@pytest.fixture(params=["json", "sqlite", "sqlalchemy"])
+def backend(request):
+    if request.param == "json":
+        request.getfixturevalue("json_store")
+        return JsonStorageBackend()
+    return request.getfixturevalue(f"{request.param}_store")
+
+
+def test_recalculation_revises_only_stale_footprints(backend, corrected_set):
+    user = backend.create_user("recalc@example.com", "secret")
+    electricity = [emissions_engine.calculate({"custom_electricity_usage": 1000.0 * i}) for i in range(1, 4)]
+    fuel = [emissions_engine.calculate({"stationary_fuel_consumption": float(i)}) for i in range(1, 3)]
+    # Saved before the freight correction of formula version 2
+    freight = {**emissions_engine.calculate({"scope3_mass_upstream": 10.0, "scope3_dist_upstream": 100.0}),
+               "formula_version": 1}
+    saved = backend.save_carbon_footprints(user["id"], electricity + fuel + [freight])
+    backend.save_carbon_footprint(user["id"], 1.0, 2.0, 3.0, 6.0, {"scope1": {"legacy": 1.0}})
+
+    stale_ids = [saved[i]["id"] for i in (0, 1, 2, 5)]
+    stale, report = recalculation.plan(TARGET, storage=backend)
+    assert [footprint["id"] for footprint in stale] == stale_ids
+    assert (report["scanned"], report["without_inputs"], report["unaffected"]) == (7, 1, 2)
+
+    report = recalculation.recalculate(TARGET, workers=1, storage=backend)
+    assert report["revised"] == 4
+
+    stored = {footprint["id"]: footprint for footprint in backend.get_user_footprints(user["id"])}
+    for footprint in saved:
+        current = stored[footprint["id"]]
+        if footprint["id"] in stale_ids:
+            expected = emissions_engine.calculate(footprint["inputs"], factor_set=corrected_set)
+            assert current["revision"] == 1
+            assert current["factor_set_version"] == TARGET
+            assert current["formula_version"] == emissions_engine.FORMULA_VERSION
+            assert current["total_emissions"] == pytest.approx(expected["total_emissions"])
+            assert backend.get_footprint_revisions(footprint["id"])[0]["total_emissions"] == \
+                pytest.approx(footprint["total_emissions"])
+        else:
+            assert (current.get("revision") or 0) == 0
+            assert current["total_emissions"] == pytest.approx(footprint["total_emissions"])
+    assert stored[saved[5]["id"]]["total_emissions"] == pytest.approx(freight["total_emissions"])
+
+    assert recalculation.plan(TARGET, storage=backend)[0] == []
+
+
+def test_rebuilt_dependency_index_finds_the_same_footprints(backend, corrected_set):
+    user = backend.create_user("index@example.com", "secret")
+    backend.save_carbon_footprints(user["id"], [
+        emissions_engine.calculate({"custom_electricity_usage": 500.0}),
+        emissions_engine.calculate({"stationary_fuel_consumption": 2.0}),
+    ])
+    before = recalculation.plan(TARGET, storage=backend)[0]
+    backend.rebuild_dependencies()
+    assert recalculation.plan(TARGET, storage=backend)[0] == before
+    assert len(before) == 1
+
+
+def test_archived_footprints_are_not_stale(json_store, corrected_set):
+    backend = JsonStorageBackend()
+    user = backend.create_user("archive@example.com", "secret")
+    old, hot = backend.save_carbon_footprints(user["id"], [
+        emissions_engine.calculate({"custom_electricity_usage": 500.0}),
+        emissions_engine.calculate({"custom_electricity_usage": 700.0}),
+    ])
+    data = json_store.load_data()
+    for footprint in data["carbon_footprints"]:
+        if footprint["id"] == old["id"]:
+            footprint["created_at"] -= 400 * 86400
+    json_store.save_data(data)
+    assert json_store.archive_footprints(30) == 1
+
+    # revise_footprints skips archived footprints, so they must not show up as stale
+    assert [footprint["id"] for footprint in recalculation.plan(TARGET, storage=backend)[0]] == [hot["id"]]
+    backend.rebuild_dependencies()
+    assert [footprint["id"] for footprint in recalculation.plan(TARGET, storage=backend)[0]] == [hot["id"]]
+    assert recalculation.recalculate(TARGET, workers=1, storage=backend)["revised"] == 1
+    assert recalculation.plan(TARGET, storage=backend)[0] == []
@@ -0,0 +1,212 @@
+"""Tests of the JSON storage (utils/json_storage.py)."""
+import json
+import multiprocessing
+
+import pytest
+
+from utils import dedupe, emissions_engine, rollups
+from utils.pagination import encode_cursor
+
+
+def _footprints(count, start=0):
+    return [emissions_engine.calculate({"custom_electricity_usage": 1000.0 + i}) for i in range(start, start + count)]
+
+
+def test_journal_replay_skips_torn_lines_and_folded_records(json_store):
+    user = json_store.create_user("journal@example.com", "secret")
+    saved = json_store.save_carbon_footprints(user["id"], _footprints(3))
+
+    snapshot, journal = json_store._generation_files(json_store.current_generation())
+    assert len(json.loads(snapshot.read_text())["carbon_footprints"]) == 0
+    with open(journal, "a") as f:
+        # A record already replayed, and the torn line of an interrupted append
+        f.write(json.dumps({"table": "carbon_footprints", "record": json_store.load_data()["carbon_footprints"][0]}))
+        f.write('\n{"table": "carbon_footprints", "rec')
+
+    json_store.invalidate_cache()
+    stored = json_store.load_data()["carbon_footprints"]
+    assert [f["id"] for f in stored] == [f["id"] for f in saved]
+    assert json_store.get_user_by_email("journal@example.com")["id"] == user["id"]
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(json_store, monkeypatch):
+    monkeypatch.setattr(json_store, "JOURNAL_COMPACT_BYTES", 1)
+    user = json_store.create_user("compact@example.com", "secret")
+    first = json_store.save_carbon_footprints(user["id"], _footprints(2))
+    second = json_store.save_carbon_footprints(user["id"], _footprints(2, start=2))
+
+    snapshot, journal = json_store._generation_files(json_store.current_generation())
+    assert journal.stat().st_size == 0
+    assert len(json.loads(snapshot.read_text())["carbon_footprints"]) == 4
+
+    json_store.invalidate_cache()
+    ids = [f["id"] for f in json_store.get_user_footprints(user["id"], order="asc")]
+    assert ids == [f["id"] for f in first + second]
+
+
+def test_compaction_publishes_generations_and_retires_generation_zero(json_store, monkeypatch):
+    monkeypatch.setattr(json_store, "JOURNAL_COMPACT_BYTES", 1)
+    user = json_store.create_user("generations@example.com", "secret")
+    json_store.save_carbon_footprints(user["id"], _footprints(2))
+    json_store.save_carbon_footprints(user["id"], _footprints(2, start=2))
+
+    generation = json_store.current_generation()
+    assert generation >= 2
+    # Generation 0 is retired, and carbon_data.json mirrors the current snapshot
+    assert not json_store.JOURNAL_FILE.exists()
+    assert json_store.DATA_FILE.read_bytes() == json_store._generation_files(generation)[0].read_bytes()
+
+
+def test_first_generation_keeps_generation_zero(json_store):
+    user = json_store.create_user("gen0@example.com", "secret")
+    json_store.save_carbon_footprints(user["id"], _footprints(1))
+    original = json_store.DATA_FILE.read_bytes()
+
+    json_store.compact_journal()
+    assert json_store.current_generation() == 1
+    assert json_store.DATA_FILE.read_bytes() == original
+    assert len(json_store._read_data(0)["carbon_footprints"]) == 1
+
+
+def _allocate(queue, count):
+    from utils import json_storage
+    queue.put([json_storage.next_id("carbon_footprints") for _ in range(count)])
+
+
+def _save(user_id, count):
+    from utils import json_storage
+    for i in range(count):
+        json_storage.save_carbon_footprints(user_id, _footprints(1, start=i))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_ids_stay_unique_across_processes(json_store):
+    # Forked children inherit the data directory of the fixture
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    workers = [context.Process(target=_allocate, args=(queue, 25)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    ids = [i for _ in workers for i in queue.get(timeout=60)]
+    for worker in workers:
+        worker.join()
+    assert sorted(ids) == list(range(1, 101))
+    assert json.loads(json_store.SEQUENCE_FILE.read_text())["carbon_footprints"] == 100
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_concurrent_saves_keep_every_footprint(json_store):
+    user = json_store.create_user("concurrent@example.com", "secret")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_save, args=(user["id"], 10)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    json_store.invalidate_cache()
+    ids = [f["id"] for f in json_store.get_user_footprints(user["id"])]
+    assert len(ids) == len(set(ids)) == 30
+    assert sum(bucket["count"] for bucket in json_store.get_rollups(user["id"], "year")) == 30
+
+
+@pytest.mark.parametrize("order", ["desc", "asc"])
+def test_cursor_pages_cover_every_footprint_once(json_store, order):
+    user = json_store.create_user("pages@example.com", "secret")
+    # Footprints saved together share created_at, so pages also split ties on id
+    for start in range(0, 23, 5):
+        json_store.save_carbon_footprints(user["id"], _footprints(5, start=start))
+    expected = [f["id"] for f in json_store.get_user_footprints(user["id"], order=order)]
+    assert expected == sorted(expected, reverse=order == "desc")
+
+    seen, cursor = [], None
+    while True:
+        page = json_store.get_user_footprints(user["id"], limit=4, order=order, cursor=cursor)
+        if not page:
+            break
+        seen += [f["id"] for f in page]
+        cursor = encode_cursor(page[-1])
+    assert seen == expected
+
+    # A footprint saved meanwhile does not shift the pages after a cursor
+    first = json_store.get_user_footprints(user["id"], limit=4, order=order)
+    json_store.save_carbon_footprints(user["id"], _footprints(1, start=99))
+    after = json_store.get_user_footprints(user["id"], limit=4, order=order, cursor=encode_cursor(first[-1]))
+    assert [f["id"] for f in after] == expected[4:8]
+
+
+def test_rollups_follow_saves_and_revisions(json_store):
+    user = json_store.create_user("rollups@example.com", "secret")
+    saved = json_store.save_carbon_footprints(user["id"], _footprints(4))
+
+    def totals():
+        buckets = json_store.get_rollups(user["id"], "month")
+        return sum(b["count"] for b in buckets), sum(b["total_emissions"] for b in buckets)
+
+    assert totals() == (4, pytest.approx(sum(f["total_emissions"] for f in saved)))
+
+    revised = emissions_engine.calculate({"custom_electricity_usage": 50000.0})
+    json_store.revise_footprints([{**revised, "id": saved[0]["id"], "user_id": user["id"], "revision": 0}])
+    expected = sum(f["total_emissions"] for f in saved[1:]) + revised["total_emissions"]
+    assert totals() == (4, pytest.approx(expected))
+
+    maintained = {period: json_store.get_rollups(user["id"], period) for period in rollups.PERIODS}
+    json_store.rebuild_rollups(user["id"])
+    for period in rollups.PERIODS:
+        rebuilt = json_store.get_rollups(user["id"], period)
+        assert [b["period_key"] for b in rebuilt] == [b["period_key"] for b in maintained[period]]
+        totals = [b["total_emissions"] for b in maintained[period]]
+        assert [b["total_emissions"] for b in rebuilt] == pytest.approx(totals)
+
+
+def _revise(footprint_id, user_id, values):
+    from utils import json_storage
+    revised = emissions_engine.calculate(values)
+    json_storage.revise_footprints([{**revised, "id": footprint_id, "user_id": user_id, "revision": 0}])
+
+
+def test_duplicates_are_stored_as_references_and_resolved(json_store, monkeypatch):
+    monkeypatch.setattr(dedupe, "FOOTPRINT_DEDUPE", True)
+    user = json_store.create_user("dedupe@example.com", "secret")
+    values = {"custom_electricity_usage": 1234.0}
+    original = json_store.save_carbon_footprints(user["id"], [emissions_engine.calculate(values)])[0]
+    copy = json_store.save_carbon_footprints(user["id"], [emissions_engine.calculate(values)])[0]
+
+    stored = {f["id"]: f for f in json_store.load_data()["carbon_footprints"]}
+    assert stored[copy["id"]]["reference_id"] == original["id"]
+    assert dedupe.unresolved(json_store.decode_footprint(stored[copy["id"]]))
+
+    read = {f["id"]: f for f in json_store.get_user_footprints(user["id"])}
+    assert read[copy["id"]]["emission_details"] == original["emission_details"]
+    assert read[copy["id"]]["inputs"] == original["inputs"]
+
+    # Revising the referenced footprint keeps the reference on its old revision
+    revised = emissions_engine.calculate({"custom_electricity_usage": 9999.0})
+    json_store.revise_footprints([{**revised, "id": original["id"], "user_id": user["id"], "revision": 0}])
+    read = {f["id"]: f for f in json_store.get_user_footprints(user["id"])}
+    assert read[original["id"]]["inputs"] == revised["inputs"]
+    assert read[copy["id"]]["emission_details"] == original["emission_details"]
+    assert read[copy["id"]]["inputs"] == original["inputs"]
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_duplicates_see_revisions_by_other_processes(json_store, monkeypatch):
+    monkeypatch.setattr(dedupe, "FOOTPRINT_DEDUPE", True)
+    user = json_store.create_user("elsewhere@example.com", "secret")
+    before, after = {"custom_electricity_usage": 1234.0}, {"custom_electricity_usage": 9999.0}
+    original = json_store.save_carbon_footprints(user["id"], [emissions_engine.calculate(before)])[0]
+    # Indexes the original in this process's lookup of the user's hashes
+    json_store.save_carbon_footprints(user["id"], _footprints(1))
+
+    worker = multiprocessing.get_context("fork").Process(target=_revise, args=(original["id"], user["id"], after))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    # The revision keeps the number and order of the user's records
+    stale = json_store.save_carbon_footprints(user["id"], [emissions_engine.calculate(before)])[0]
+    copy = json_store.save_carbon_footprints(user["id"], [emissions_engine.calculate(after)])[0]
+    stored = {f["id"]: f for f in json_store.load_data()["carbon_footprints"]}
+    assert stored[stale["id"]].get("reference_id") is None
+    assert stored[copy["id"]]["reference_id"] == original["id"]
@@ -0,0 +1,94 @@
+"""
+Compressed, immutable archive segments for old footprints.
+
+A segment holds the footprints of one user and one month, serialized as a
+JSON array and compressed with gzip, or zstd when ARCHIVE_COMPRESSION asks
+for it and the zstandard package is installed. Segments are written once
+and never modified; data/archive/manifest.json lists every segment with its
+user, month, record count, created_at/id ranges and the prefixes of its
+input hashes, so queries can decide which segments to open without reading
+them.
+"""
+import gzip
+from datetime import datetime, timezone
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from utils import serialization
+
+COMPRESSIONS = {"gzip": ".json.gz", "zstd": ".json.zst"}
+
+# Hex digits of each input_hash listed in the manifest
+HASH_PREFIX_LENGTH = 8
+
+
+def available_compression(preferred):
+    """Return preferred if it can be used here, falling back to gzip."""
+    if preferred == "zstd" and zstandard is None:
+        print("zstandard is not installed, archiving with gzip instead")
+        return "gzip"
+    if preferred not in COMPRESSIONS:
+        raise ValueError(f"Unknown archive compression: {preferred}")
+    return preferred
+
+
+def compress(payload, compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(payload)
+    # mtime=0 keeps segments byte-identical for identical contents
+    return gzip.compress(payload, compresslevel=9, mtime=0)
+
+
+def decompress(payload, compression):
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading this archive segment requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return gzip.decompress(payload)
+
+
+def month_of(created_at):
+    """Return the 'YYYY-MM' month (UTC) of a timestamp."""
+    moment = datetime.fromtimestamp(created_at or 0, timezone.utc)
+    return f"{moment.year:04d}-{moment.month:02d}"
+
+
+def month_start(moment):
+    """Timestamp of the first instant of moment's month (UTC)."""
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc).timestamp()
+
+
+def segment_name(user_id, month, sequence, compression):
+    """Relative path of a segment inside the archive directory."""
+    return f"{user_id}/{month}-{sequence}{COMPRESSIONS[compression]}"
+
+
+def encode_segment(records, compression):
+    """Serialize and compress a list of records."""
+    return compress(serialization.dumps(records, "json"), compression)
+
+
+def decode_segment(payload, compression):
+    """Inverse of encode_segment."""
+    return serialization.loads(decompress(payload, compression))
+
+
+def describe(user_id, month, name, compression, records):
+    """Manifest entry for a segment holding records."""
+    created = [r.get("created_at") or 0.0 for r in records]
+    ids = [r.get("id") or 0 for r in records]
+    return {
+        "user_id": user_id,
+        "month": month,
+        "file": name,
+        "compression": compression,
+        "count": len(records),
+        "min_created_at": min(created),
+        "max_created_at": max(created),
+        "min_id": min(ids),
+        "max_id": max(ids),
+        "hash_prefixes": sorted({r["input_hash"][:HASH_PREFIX_LENGTH] for r in records if r.get("input_hash")}),
+    }
@@ -0,0 +1,308 @@
+"""
+Bulk import of facility activity data from CSV or Excel files.
+
+Each row of a file is one footprint. Columns are matched to the Calculator
+inputs of utils/emissions_engine.py by name, ignoring case, spaces and
+punctuation ("Stationary Fuel Consumption" matches
+stationary_fuel_consumption), or through an explicit column mapping.
+Empty cells take the form default.
+
+Values are converted to the unit of their input (emissions_engine.input_unit)
+from the unit in their header, "stationary_fuel_consumption (GJ)", and/or a
+"<input key>_unit" column giving each row's unit, so one column can mix
+units. Units are checked once per distinct unit (utils/units.py).
+
+The file is read and validated in chunks of CHUNK_SIZE rows, emissions are
+computed with one vectorized emissions_engine.evaluate() call per chunk,
+and every valid row is saved with a single save_carbon_footprints() call at
+the end. Invalid rows are reported with their line number and skipped; they
+never stop the rest of the file.
+
+    python -m utils.bulk_import sites.csv --user-id 3
+    python -m utils.bulk_import sites.xlsx --user-id 3 --map "Diesel (TJ)=road_transport_fuel"
+
+Excel files require the openpyxl package.
+"""
+import argparse
+import csv
+import itertools
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils import emissions_engine, units
+
+CHUNK_SIZE = 10000
+FORMATS = {".csv": "csv", ".txt": "csv", ".xlsx": "excel", ".xlsm": "excel"}
+BOOLEAN_WORDS = {
+    "true": 1.0, "yes": 1.0, "y": 1.0, "x": 1.0, "1": 1.0, "1.0": 1.0,
+    "false": 0.0, "no": 0.0, "n": 0.0, "0": 0.0, "0.0": 0.0,
+}
+BOOLEAN_INPUTS = {key for key, default in emissions_engine.INPUTS.items() if isinstance(default, bool)}
+UNIT_HEADER = re.compile(r"^(.*?)\s*[(\[]([^)\]]+)[)\]]\s*$")  # "name (unit)" or "name [unit]"
+UNIT_COLUMN_SUFFIX = "_unit"
+
+
+def file_format(source):
+    """Return 'csv' or 'excel' from a path or an uploaded file's name."""
+    name = getattr(source, "name", source)
+    fmt = FORMATS.get(Path(str(name)).suffix.lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported file type: {name} (expected CSV or Excel)")
+    return fmt
+
+
+def normalize(name):
+    """Column name in input key form: 'Stationary Fuel (TJ)' -> 'stationary_fuel_tj'."""
+    return re.sub(r"[^0-9a-z]+", "_", str(name).strip().lower()).strip("_")
+
+
+def resolve_columns(header, mapping=None):
+    """Map file columns to input keys.
+
+    mapping ({column: input key}) takes precedence over name matching.
+    Returns ({column: input key}, [ignored columns]).
+    """
+    mapping = mapping or {}
+    for column, key in mapping.items():
+        if key not in emissions_engine.INPUTS:
+            raise ValueError(f"Column {column!r} is mapped to unknown input {key!r}")
+        if column not in header:
+            raise ValueError(f"Mapped column {column!r} is not in the file")
+    columns, ignored = {}, []
+    for column in header:
+        key = mapping.get(column) or normalize(column)
+        match = UNIT_HEADER.match(str(column))
+        if key not in emissions_engine.INPUTS and match:
+            key = normalize(match.group(1))
+        if key in emissions_engine.INPUTS:
+            columns[column] = key
+        else:
+            ignored.append(column)
+    duplicates = {key for key in columns.values() if list(columns.values()).count(key) > 1}
+    if duplicates:
+        raise ValueError(f"Several columns map to {', '.join(sorted(duplicates))}")
+    if not columns:
+        raise ValueError("No column matches a calculator input")
+    return columns, ignored
+
+
+def _header_unit(column):
+    """Unit given in a column header, if any."""
+    match = UNIT_HEADER.match(str(column))
+    if match is None:
+        return None
+    try:
+        units.parse(match.group(2))
+    except ValueError:
+        return None
+    return match.group(2).strip()
+
+
+def resolve_units(header, columns):
+    """Units of the matched columns: {column: (header unit, unit column)}.
+
+    Either may be None; a unit column's empty cells fall back to the header
+    unit, then to the input's unit. A header unit that cannot be converted
+    to its input's unit raises ValueError here, before any row is read.
+    """
+    unit_columns = {normalize(column): column for column in header}
+    result = {}
+    for column, key in columns.items():
+        if key in BOOLEAN_INPUTS:
+            continue
+        unit = _header_unit(column)
+        target = emissions_engine.input_unit(key)
+        if unit is not None and not units.compatible(unit, target):
+            raise ValueError(f"Column {column!r} is in {unit}, which cannot be converted to {target}")
+        unit_column = unit_columns.get(key + UNIT_COLUMN_SUFFIX)
+        if unit is not None or unit_column is not None:
+            result[column] = (unit, unit_column)
+    return result
+
+
+def _csv_chunks(source, chunk_size):
+    # Blank lines are kept (and skipped later) so row numbers match file lines
+    yield from pd.read_csv(source, dtype=str, keep_default_na=False, skip_blank_lines=False,
+                           chunksize=chunk_size)
+
+
+def _excel_chunks(source, chunk_size):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("Importing Excel files requires the openpyxl package")
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(c) if c is not None else f"column_{i + 1}" for i, c in enumerate(next(rows, ()))]
+        start = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield pd.DataFrame(chunk, columns=header, index=range(start, start + len(chunk)))
+            start += len(chunk)
+    finally:
+        workbook.close()
+
+
+def read_chunks(source, fmt=None, chunk_size=CHUNK_SIZE):
+    """Yield the rows of a CSV or Excel file as DataFrames of raw cell values.
+
+    Row index i is line i + 2 of the file (line 1 is the header).
+    """
+    fmt = fmt or file_format(source)
+    if fmt == "excel":
+        return _excel_chunks(source, chunk_size)
+    return _csv_chunks(source, chunk_size)
+
+
+def _blank(raw):
+    """Mask of empty cells."""
+    return raw.isna() | raw.astype(str).str.strip().eq("")
+
+
+def parse_chunk(chunk, columns, column_units=None):
+    """Validate a chunk of raw rows.
+
+    column_units ({column: (header unit, unit column)}, see resolve_units)
+    gives the units to convert from. Returns (inputs, valid, errors): the
+    parsed input columns of every row in the inputs' units (empty cells
+    filled with defaults; only meaningful where valid), a mask of the rows
+    without errors and the list of errors found. Entirely empty rows are
+    neither valid nor reported.
+    """
+    column_units = column_units or {}
+    input_defaults = emissions_engine.defaults()
+    lines = chunk.index.to_numpy() + 2
+    blank = {column: _blank(chunk[column]).to_numpy() for column in columns}
+    empty_rows = np.logical_and.reduce(list(blank.values()))
+    valid = ~empty_rows
+    errors = []
+    inputs = {}
+    for column, key in columns.items():
+        raw = chunk[column]
+        if key in BOOLEAN_INPUTS:
+            values = raw.astype(str).str.strip().str.lower().map(BOOLEAN_WORDS).to_numpy(dtype=np.float64)
+            message = "is not true/false"
+        else:
+            values = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=np.float64)
+            message = "is not a number"
+        low, high = emissions_engine.input_bounds(key)
+        checks = [(np.isnan(values) & ~blank[column], message)]
+        unit, unit_column = column_units.get(column, (None, None))
+        target = emissions_engine.input_unit(key)
+        if unit_column is not None:
+            values, bad_unit = units.convert_column(values, chunk[unit_column].to_numpy(), target, default=unit)
+            bad_unit &= ~blank[column] & ~empty_rows
+            for i in np.flatnonzero(bad_unit):
+                errors.append({"line": int(lines[i]), "column": unit_column, "value": chunk[unit_column].iloc[i],
+                               "error": f"{unit_column} is not a unit convertible to {target}"})
+            valid &= ~bad_unit
+        elif unit is not None:
+            values = units.convert(values, unit, target)
+        with np.errstate(invalid="ignore"):
+            checks.append((values < low, f"must be at least {low}"))
+            if high is not None:
+                checks.append((values > high, f"must be at most {high}"))
+        for bad, text in checks:
+            bad &= ~empty_rows
+            for i in np.flatnonzero(bad):
+                errors.append({"line": int(lines[i]), "column": column, "value": raw.iloc[i],
+                               "error": f"{column} {text}"})
+            valid &= ~bad
+        inputs[key] = np.where(blank[column], float(input_defaults[key]), values)
+    errors.sort(key=lambda e: e["line"])
+    return inputs, valid, errors
+
+
+def import_file(source, user_id, mapping=None, fmt=None, chunk_size=CHUNK_SIZE, dry_run=False, storage=None):
+    """Compute and save a footprint for every valid row of a CSV or Excel file.
+
+    source is a path or a file-like object with a name (e.g. a Streamlit
+    upload). With dry_run the rows are validated and computed but nothing
+    is saved. Returns a report dict with the number of rows read, the saved
+    footprints, the per-row errors and the ignored columns.
+    """
+    footprints, errors, rows = [], [], 0
+    columns = ignored = None
+    for chunk in read_chunks(source, fmt, chunk_size):
+        if columns is None:
+            columns, ignored = resolve_columns(list(chunk.columns), mapping)
+            column_units = resolve_units(list(chunk.columns), columns)
+            unit_columns = {unit_column for _, unit_column in column_units.values()}
+            ignored = [column for column in ignored if column not in unit_columns]
+        inputs, valid, chunk_errors = parse_chunk(chunk, columns, column_units)
+        errors.extend(chunk_errors)
+        rows += int(valid.sum()) + len({e["line"] for e in chunk_errors})
+        if valid.any():
+            result = emissions_engine.evaluate({key: values[valid] for key, values in inputs.items()})
+            footprints.extend(emissions_engine.to_footprints(result))
+    if columns is None:
+        raise ValueError("The file has no rows")
+
+    saved = footprints
+    if footprints and not dry_run:
+        if storage is None:
+            from utils.storage import save_carbon_footprints
+            saved = save_carbon_footprints(user_id, footprints)
+        else:
+            saved = storage.save_carbon_footprints(user_id, footprints)
+    return {"rows": rows, "footprints": saved, "errors": errors, "ignored_columns": ignored}
+
+
+def write_errors(errors, path):
+    """Write the errors of an import report to a CSV file."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["line", "column", "value", "error"])
+        writer.writeheader()
+        writer.writerows(errors)
+
+
+def template_csv():
+    """CSV header with every calculator input, as a starting point for a file."""
+    return ",".join(emissions_engine.INPUTS) + "\n"
+
+
+def parse_mapping(pairs):
+    """Parse 'Column=input_key' arguments into a mapping."""
+    mapping = {}
+    for pair in pairs or []:
+        column, sep, key = pair.rpartition("=")
+        if not sep or not column:
+            raise ValueError(f"Expected COLUMN=INPUT_KEY, got {pair!r}")
+        mapping[column] = key.strip()
+    return mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import activity data from a CSV or Excel file")
+    parser.add_argument("file", help="CSV or Excel (.xlsx) file, one footprint per row")
+    parser.add_argument("--user-id", type=int, required=True, help="User the footprints are saved for")
+    parser.add_argument("--map", action="append", metavar="COLUMN=INPUT_KEY",
+                        help="Map a column to a calculator input (repeatable)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Validate and compute without saving")
+    parser.add_argument("--errors", metavar="CSV", help="Write the row errors to this file")
+    args = parser.parse_args()
+
+    report = import_file(args.file, args.user_id, parse_mapping(args.map),
+                         chunk_size=args.chunk_size, dry_run=args.dry_run)
+    if report["ignored_columns"]:
+        print(f"Ignored columns: {', '.join(map(str, report['ignored_columns']))}")
+    for error in report["errors"][:20]:
+        print(f"Line {error['line']}: {error['error']} ({error['value']!r})")
+    if len(report["errors"]) > 20:
+        print(f"... and {len(report['errors']) - 20} more errors")
+    if args.errors:
+        write_errors(report["errors"], args.errors)
+    verb = "Validated" if args.dry_run else "Imported"
+    print(f"{verb} {len(report['footprints'])} of {report['rows']} rows, "
+          f"{len(report['errors'])} errors")
+
+
+if __name__ == "__main__":
+    main()
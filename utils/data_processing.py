@@ -1,6 +1,9 @@
 from datetime import datetime
 import pandas as pd
 
+from utils import units
+from utils.factor_store import get_factor_set
+
 def process_footprint_data(footprints):
     """Convert footprint data to a pandas DataFrame."""
     if not footprints:
@@ -19,24 +22,29 @@ def process_footprint_data(footprints):
 
 def calculate_emissions(transportation_data, electricity_data, diet_data, waste_data):
     """Calculate emissions for each category."""
-    # Emission factors
+    # Emission factors from the configured factor set
+    factors = get_factor_set()
+
+    def factor(activity, unit):
+        return factors.find(activity, unit).value
+
     TRANSPORT_FACTORS = {
-        'car_miles': 0.404,     # kg CO2 per mile
-        'public_miles': 0.14,    # kg CO2 per mile
-        'flight_miles': 0.257    # kg CO2 per mile
+        'car_miles': factor("car_distance", "kg CO2/mile"),
+        'public_miles': factor("public_transport_distance", "kg CO2/mile"),
+        'flight_miles': factor("flight_distance_personal", "kg CO2/mile")
     }
     
     ELECTRICITY_FACTORS = {
-        'kwh': 0.433  # kg CO2 per kWh
+        'kwh': factor("household_electricity", "kg CO2/kWh")
     }
     
     DIET_FACTORS = {
-        'meat_servings': 3.3,    # kg CO2 per serving
-        'dairy_servings': 1.9     # kg CO2 per serving
+        'meat_servings': factor("meat_serving", "kg CO2/serving"),
+        'dairy_servings': factor("dairy_serving", "kg CO2/serving")
     }
     
     WASTE_FACTORS = {
-        'landfill_kg': 2.89  # kg CO2 per kg waste
+        'landfill_kg': factor("landfill_waste", "kg CO2/kg")
     }
     
     # Transportation emissions calculation
@@ -64,10 +72,11 @@ def calculate_emissions(transportation_data, electricity_data, diet_data, waste_
     )
     
     # Convert from kg to tonnes
-    transport_emissions = round(transport_emissions / 1000, 2)
-    electricity_emissions = round(electricity_emissions / 1000, 2)
-    diet_emissions = round(diet_emissions / 1000, 2)
-    waste_emissions = round(waste_emissions / 1000, 2)
+    to_tonnes = units.conversion_factor("kg CO2", "t CO2")
+    transport_emissions = round(transport_emissions * to_tonnes, 2)
+    electricity_emissions = round(electricity_emissions * to_tonnes, 2)
+    diet_emissions = round(diet_emissions * to_tonnes, 2)
+    waste_emissions = round(waste_emissions * to_tonnes, 2)
     
     total_emissions = round(
         transport_emissions + electricity_emissions + diet_emissions + waste_emissions,
@@ -0,0 +1,96 @@
+"""
+Content-hash deduplication of stored footprints.
+
+Footprints carry the input_hash of emissions_engine.input_hash(): footprints
+with the same hash have the same inputs, factor set and formula versions,
+and results.
+With FOOTPRINT_DEDUPE on, every backend stores a footprint whose
+input_hash matches an earlier footprint of the same user as a reference:
+its own id, created_at, scope totals and input_hash plus the reference_id
+of that footprint, but no emission_details or inputs. Saves return the
+complete footprint, and backends resolve references on every read, so
+callers never see the difference.
+
+A reference stays valid when the footprint it references is revised: the
+revision that still has its input_hash is found in that footprint's
+history. A revised reference is stored in full again.
+"""
+from config.settings import FOOTPRINT_DEDUPE
+
+
+def unresolved(footprint):
+    """Whether a footprint is a reference as stored, without its emission_details and inputs."""
+    return footprint.get("reference_id") is not None and not footprint.get("emission_details")
+
+
+def reference_ids(footprints, find):
+    """The id each of a user's new footprints can reference instead of being stored in full.
+
+    find(input_hashes) returns {input_hash: latest stored footprint of the
+    user with it}. The ids are None for footprints to store in full, and
+    all None unless FOOTPRINT_DEDUPE is on.
+    """
+    if not FOOTPRINT_DEDUPE:
+        return [None] * len(footprints)
+    hashes = {footprint["input_hash"] for footprint in footprints if footprint.get("input_hash")}
+    found = find(hashes) if hashes else {}
+    ids = []
+    for footprint in footprints:
+        existing = found.get(footprint.get("input_hash"))
+        # Always point at a footprint stored in full, never at another reference
+        ids.append(None if existing is None else existing.get("reference_id") or existing["id"])
+    return ids
+
+
+def stored_form(footprint, reference_id):
+    """What to store for a footprint: itself, or a reference to reference_id without details and inputs."""
+    if reference_id is None:
+        return footprint
+    return {**footprint, "emission_details": {}, "inputs": None, "reference_id": reference_id}
+
+
+def resolve(footprints, lookup, revisions):
+    """Fill in the emission_details and inputs of the references among footprints.
+
+    lookup(user_id, ids) returns {id: stored footprint} and revisions(id)
+    the previous revisions of a footprint. Returns the footprints in the
+    same order; a reference whose source is missing is reported and
+    returned as stored.
+    """
+    pending = [footprint for footprint in footprints if unresolved(footprint)]
+    if not pending:
+        return footprints
+    wanted = {}
+    for footprint in pending:
+        wanted.setdefault(footprint["user_id"], set()).add(footprint["reference_id"])
+    targets = {}
+    for user_id, ids in wanted.items():
+        targets.update(lookup(user_id, ids))
+
+    sources = {}
+    for footprint in pending:
+        key = (footprint["reference_id"], footprint.get("input_hash"))
+        if key not in sources:
+            sources[key] = _source(footprint, targets.get(footprint["reference_id"]), lookup, revisions)
+    resolved = []
+    for footprint in footprints:
+        source = sources.get((footprint.get("reference_id"), footprint.get("input_hash")))
+        if source is not None and unresolved(footprint):
+            footprint = {**footprint, "emission_details": source["emission_details"], "inputs": source["inputs"]}
+        resolved.append(footprint)
+    return resolved
+
+
+def _source(footprint, target, lookup, revisions):
+    """The footprint, or previous revision, whose details and inputs a reference shares."""
+    if target is None or target.get("input_hash") != footprint.get("input_hash"):
+        # Revised since: the revision it referenced is in the history
+        history = revisions(footprint["reference_id"])
+        target = next((r for r in reversed(history) if r.get("input_hash") == footprint.get("input_hash")), None)
+    if target is not None and unresolved(target):
+        target = resolve([target], lookup, revisions)[0]
+    if target is None or unresolved(target):
+        print(f"Footprint {footprint.get('id')} references footprint {footprint['reference_id']}, "
+              "which no longer has its inputs")
+        return None
+    return target
@@ -0,0 +1,75 @@
+"""
+Compact columnar encoding for footprint emission_details.
+
+emission_details is a dict of scopes, each a dict of category -> emissions.
+Every record repeats the same category keys, so the key layout is stored
+once in a schema list and each record keeps only its schema id and the
+values in layout order:
+
+    {"scope1": {"road_transport": 12.5, ...}, "scope2": {...}, ...}
+    -> {"_schema": 0, "_values": [12.5, ...]}
+
+Details that are not a two-level dict of numbers are left as they are.
+"""
+import struct
+
+SCHEMA_KEY = "_schema"
+VALUES_KEY = "_values"
+
+
+def layout_of(details):
+    """Return the key layout of emission_details as a tuple of (scope, category) pairs.
+
+    Returns None if the details cannot be encoded.
+    """
+    if not isinstance(details, dict):
+        return None
+    layout = []
+    for scope, categories in details.items():
+        if not isinstance(categories, dict):
+            return None
+        for category, value in categories.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None
+            layout.append((scope, category))
+    return tuple(layout)
+
+
+def to_float32(value):
+    """Round a float to float32 precision, keeping its shortest decimal form."""
+    try:
+        single = struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        return float(value)
+    for digits in range(6, 10):
+        candidate = float(f"{value:.{digits}g}")
+        if struct.unpack('f', struct.pack('f', candidate))[0] == single:
+            return candidate
+    return single
+
+
+def encode(details, schema_id, float32=False):
+    """Encode emission_details against the layout registered as schema_id."""
+    values = [float(v) for categories in details.values() for v in categories.values()]
+    if float32:
+        values = [to_float32(v) for v in values]
+    return {SCHEMA_KEY: schema_id, VALUES_KEY: values}
+
+
+def is_encoded(details):
+    """True if emission_details is in the columnar form."""
+    return isinstance(details, dict) and SCHEMA_KEY in details and VALUES_KEY in details
+
+
+def decode(details, layouts):
+    """Rebuild nested emission_details from the columnar form.
+
+    layouts is the schema list (schema id -> layout). Details that are not
+    encoded are returned unchanged.
+    """
+    if not is_encoded(details):
+        return details
+    decoded = {}
+    for (scope, category), value in zip(layouts[details[SCHEMA_KEY]], details[VALUES_KEY]):
+        decoded.setdefault(scope, {})[category] = value
+    return decoded
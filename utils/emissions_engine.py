@@ -0,0 +1,683 @@
+"""
+Emissions calculation engine behind the Calculator.
+
+Every Scope 1/2/3 category is an Activity in ACTIVITIES: the formula that
+computes it and the arguments it takes, each either a Calculator input
+(keyed like the page's widgets, defaults in INPUTS) or a fixed emission
+factor (Factor, values in FACTORS). All results are in kgCO2e.
+
+evaluate() runs every formula with NumPy, so any input can be a scalar or
+an array and they broadcast together: one footprint, 100,000 rows from a
+spreadsheet or an n-dimensional scenario grid are the same call. preview()
+computes one footprint from independent SECTIONS of activities, memoized
+on their inputs, for the Calculator's live preview.
+
+Results are versioned by FORMULA_VERSION as well as by factor set: a
+change to a formula that alters the results of existing inputs bumps it
+and lists the activities it changed in FORMULA_CHANGES, so recalculation
+(utils/recalculation.py) revises the footprints computed before.
+
+Every footprint carries an input_hash, a canonical hash of its non-default
+inputs, factor set version and FORMULA_VERSION: footprints with the same
+hash have the same results. calculate_cached() serves repeated calculations of the same inputs
+from an LRU cache of RESULT_CACHE_SIZE footprints.
+
+    from utils import emissions_engine
+    footprint = emissions_engine.calculate({"custom_electricity_usage": 12000})
+"""
+import copy
+import hashlib
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from config.settings import RESULT_CACHE_SIZE
+from utils import units
+from utils.factor_store import get_factor_set
+
+SCOPES = ("scope1", "scope2", "scope3")
+TOTALS = ("scope1_emissions", "scope2_emissions", "scope3_emissions", "total_emissions")
+
+# Reference to an emission factor of the factor store by its name in FACTORS
+Factor = namedtuple("Factor", "name")
+
+# Every Calculator input and its default value on the form. Emission factor
+# inputs default to a factor of the configured factor set.
+INPUTS = {
+    # Scope 1
+    "stationary_fuel_consumption": 0.0,   # TJ
+    "stationary_ef": Factor("natural_gas_combustion"),
+    "stationary_cc": 0.0,                 # kg C/TJ
+    "stationary_use_cc": False,           # Tier 2: use carbon content instead of the EF
+    "road_transport_fuel": 0.0,           # TJ
+    "road_transport_ef": Factor("diesel_road_transport"),
+    "railways_fuel": 0.0,                 # TJ
+    "marine_fuel": 0.0,                   # TJ
+    "marine_ef": Factor("residual_fuel_oil_marine"),
+    "offroad_fuel": 0.0,                  # TJ
+    "offroad_ef": Factor("diesel_offroad"),
+    "process_activity_level": 0.0,        # tonnes
+    "process_ef": Factor("process_emissions"),
+    "fugitive_activity_data": 0.0,        # tonnes
+    "fugitive_ef": Factor("fugitive_emissions"),
+    "custom_natural_gas": 0.0,            # m³/year
+    "custom_fuel_oil": 0.0,               # liters/year
+    "custom_company_vehicle_distance": 0.0,  # km/year
+    "custom_fleet_fuel_consumption": 0.0,    # liters/year
+    "custom_process_activity_data": 0.0,     # units/year
+    "custom_refrigerant_leakage": 0.0,       # kg/year
+    # Scope 2
+    "scope2_purchased_energy": 0.0,       # kWh
+    "scope2_purchased_energy_ef": Factor("grid_electricity"),
+    "custom_electricity_usage": 0.0,      # kWh/year
+    "custom_renewable_percentage": 0,     # %
+    "custom_heat_steam_usage": 0.0,       # MWh/year
+    # Scope 3
+    "scope3_spend_goods": 0.0,            # $
+    "scope3_ef_spend_goods": Factor("purchased_goods_spend"),
+    "scope3_mass_goods": 0.0,             # kg
+    "scope3_ef_mass_goods": Factor("purchased_goods_mass"),
+    "scope3_mass_capital": 0.0,           # kg
+    "scope3_ef_capital": Factor("capital_goods_mass"),
+    "scope3_fuel_energy_purchased": 0.0,  # MJ
+    "scope3_ef_wtt": Factor("fuel_well_to_tank"),
+    "scope3_mass_upstream": 0.0,          # kg
+    "scope3_dist_upstream": 0.0,          # km
+    "scope3_ef_tonne_km_up": Factor("freight_transport"),
+    "scope3_waste_mass": 0.0,             # kg
+    "scope3_doc": Factor("landfill_doc"),
+    "scope3_docf": Factor("landfill_docf"),
+    "scope3_f": Factor("landfill_gas_methane"),
+    "scope3_r": 0.0,                      # fraction recovered
+    "scope3_ef_incineration": Factor("waste_incineration"),
+    "scope3_business_travel_distance": 0.0,  # km
+    "scope3_ef_mode_travel": Factor("business_travel_distance"),
+    "scope3_employees": 0,
+    "scope3_trips_per_year": 220,
+    "scope3_avg_commute_distance": 0.0,   # km
+    "scope3_ef_mode_commute": Factor("commuting_distance"),
+    "scope3_fuel_leased": 0.0,            # TJ
+    "scope3_ef_fuel_leased": Factor("natural_gas_combustion"),
+    "scope3_mass_downstream": 0.0,        # kg
+    "scope3_dist_downstream": 0.0,        # km
+    "scope3_ef_tonne_km_down": Factor("freight_transport"),
+    "scope3_mass_sold_products": 0.0,     # kg
+    "scope3_ef_processing": Factor("product_processing"),
+    "scope3_energy_use_sold": 0.0,        # kWh
+    "scope3_ef_energy_sold": Factor("grid_electricity"),
+    "scope3_waste_sold_products": 0.0,    # kg
+    "scope3_ef_disposal": Factor("product_disposal"),
+    "scope3_fuel_downleased": 0.0,        # TJ
+    "scope3_ef_fuel_downleased": Factor("natural_gas_combustion"),
+    "scope3_franchise_area": 0.0,         # m²
+    "scope3_ef_franchise_area": Factor("franchise_area"),
+    "scope3_investee_emissions": 0.0,     # kg CO2e
+    "scope3_investment_value": 0.0,       # $
+    "scope3_ef_investment": Factor("investment_value"),
+    "custom_flight_distance": 0.0,        # miles/year
+    "custom_hotel_nights": 0.0,           # nights/year
+    "custom_num_employees": 0,
+    "custom_avg_commute": 0.0,            # km/day
+    "custom_work_days": 220,
+    # Collected on the form but not used by any activity yet
+    "custom_waste_generated": 0.0,        # kg/year
+    "custom_recycling_percentage": 0,     # %
+    "custom_annual_procurement_spend": 0.0,  # $
+}
+
+# Allowed (min, max) of inputs, as enforced by the form widgets; every
+# other input only has to be >= 0
+BOUNDS = {
+    "scope3_doc": (0, 1),
+    "scope3_docf": (0, 1),
+    "scope3_f": (0, 1),
+    "scope3_r": (0, 1),
+    "custom_renewable_percentage": (0, 100),
+    "custom_recycling_percentage": (0, 100),
+}
+
+def input_bounds(key):
+    """Return the (min, max) allowed for an input; max is None when unbounded."""
+    return BOUNDS.get(key, (0, None))
+
+# Emission factors used by the activities and the input defaults, by name,
+# as keys of the factor store (utils/factor_store.py)
+FACTORS = {
+    "natural_gas_combustion": ("IPCC", "GLOBAL", 2006, "natural_gas_combustion", "kg CO2/TJ"),
+    "diesel_road_transport": ("IPCC", "GLOBAL", 2006, "diesel_road_transport", "kg CO2/TJ"),
+    "diesel_offroad": ("IPCC", "GLOBAL", 2006, "diesel_offroad", "kg CO2/TJ"),
+    "residual_fuel_oil_marine": ("IPCC", "GLOBAL", 2006, "residual_fuel_oil_marine", "kg CO2/TJ"),
+    "railways_fuel": ("TerraMetrics", "GLOBAL", 2026, "railways_fuel", "kg CO2/TJ"),
+    "process_emissions": ("TerraMetrics", "GLOBAL", 2026, "process_emissions", "kg CO2/tonne"),
+    "fugitive_emissions": ("TerraMetrics", "GLOBAL", 2026, "fugitive_emissions", "kg CO2/unit"),
+    "natural_gas_volume": ("TerraMetrics", "GLOBAL", 2026, "natural_gas_volume", "kg CO2e/m3"),
+    "fuel_oil_volume": ("TerraMetrics", "GLOBAL", 2026, "fuel_oil_volume", "kg CO2e/l"),
+    "company_vehicle_distance": ("TerraMetrics", "GLOBAL", 2026, "company_vehicle_distance", "kg CO2e/km"),
+    "fleet_fuel_volume": ("TerraMetrics", "GLOBAL", 2026, "fleet_fuel_volume", "kg CO2e/l"),
+    "process_activity": ("TerraMetrics", "GLOBAL", 2026, "process_activity", "kg CO2e/unit"),
+    "hfc_134a_leakage": ("IPCC", "GLOBAL", 2007, "hfc_134a_leakage", "kg CO2e/kg"),
+    "grid_electricity": ("TerraMetrics", "GLOBAL", 2026, "grid_electricity", "kg CO2e/kWh"),
+    "heat_steam": ("TerraMetrics", "GLOBAL", 2026, "heat_steam", "kg CO2e/MWh"),
+    "purchased_goods_spend": ("TerraMetrics", "GLOBAL", 2026, "purchased_goods_spend", "kg CO2e/USD"),
+    "purchased_goods_mass": ("TerraMetrics", "GLOBAL", 2026, "purchased_goods_mass", "kg CO2e/kg"),
+    "capital_goods_mass": ("TerraMetrics", "GLOBAL", 2026, "capital_goods_mass", "kg CO2e/kg"),
+    "fuel_well_to_tank": ("TerraMetrics", "GLOBAL", 2026, "fuel_well_to_tank", "kg CO2e/MJ"),
+    "freight_transport": ("TerraMetrics", "GLOBAL", 2026, "freight_transport", "kg CO2e/tonne-km"),
+    "landfill_doc": ("IPCC", "GLOBAL", 2006, "landfill_doc", "fraction"),
+    "landfill_docf": ("IPCC", "GLOBAL", 2006, "landfill_docf", "fraction"),
+    "landfill_gas_methane": ("IPCC", "GLOBAL", 2006, "landfill_gas_methane", "fraction"),
+    "waste_incineration": ("TerraMetrics", "GLOBAL", 2026, "waste_incineration", "kg CO2/kg"),
+    "business_travel_distance": ("TerraMetrics", "GLOBAL", 2026, "business_travel_distance", "kg CO2e/km"),
+    "commuting_distance": ("TerraMetrics", "GLOBAL", 2026, "commuting_distance", "kg CO2e/km"),
+    "product_processing": ("TerraMetrics", "GLOBAL", 2026, "product_processing", "kg CO2/kg"),
+    "product_disposal": ("TerraMetrics", "GLOBAL", 2026, "product_disposal", "kg CO2/kg"),
+    "franchise_area": ("TerraMetrics", "GLOBAL", 2026, "franchise_area", "kg CO2e/m2"),
+    "investment_value": ("TerraMetrics", "GLOBAL", 2026, "investment_value", "kg CO2e/USD"),
+    "flight_distance": ("TerraMetrics", "GLOBAL", 2026, "flight_distance", "kg CO2e/mile"),
+    "hotel_night": ("TerraMetrics", "GLOBAL", 2026, "hotel_night", "kg CO2e/night"),
+}
+
+Activity = namedtuple("Activity", "scope category formula args")
+
+
+# Formulas. Arguments arrive as float64 arrays (or scalars) in the order of
+# the activity's args.
+def product(*values):
+    """Activity data times emission factor(s)."""
+    result = values[0]
+    for value in values[1:]:
+        result = result * value
+    return result
+
+def stationary_combustion(fuel, ef, carbon_content, use_carbon_content):
+    """Tier 1 (EF) or, when enabled and given, Tier 2 (carbon content × 44/12)."""
+    tier2 = (use_carbon_content != 0) & (carbon_content > 0)
+    return np.where(tier2, fuel * (carbon_content * (44 / 12)), fuel * ef)
+
+def renewable_adjusted(energy, ef, renewable_percentage):
+    """Grid electricity net of the renewable share."""
+    return energy * ef * (1 - renewable_percentage / 100)
+
+def freight(mass, distance, ef):
+    """Freight transport: mass in kg, converted to the tonnes of the tonne-km factor, × km × EF."""
+    return mass * _TONNES_PER_KG * distance * ef
+
+_TONNES_PER_KG = units.conversion_factor("kg", "tonne")
+
+def landfill_methane(waste, doc, docf, f, recovered):
+    """IPCC first-order CH4 from landfilled waste (mass × DOC × DOCf × F × 16/12 × (1 − R))."""
+    return waste * doc * docf * f * (16 / 12) * (1 - recovered)
+
+def reported(value):
+    """Emissions reported directly in kg CO2e."""
+    return value
+
+
+ACTIVITIES = [
+    # Scope 1
+    Activity("scope1", "stationary_combustion", stationary_combustion,
+             ("stationary_fuel_consumption", "stationary_ef", "stationary_cc", "stationary_use_cc")),
+    Activity("scope1", "road_transport", product, ("road_transport_fuel", "road_transport_ef")),
+    Activity("scope1", "railways", product, ("railways_fuel", Factor("railways_fuel"))),
+    Activity("scope1", "marine_navigation", product, ("marine_fuel", "marine_ef")),
+    Activity("scope1", "offroad_vehicles", product, ("offroad_fuel", "offroad_ef")),
+    Activity("scope1", "process_emissions", product, ("process_activity_level", "process_ef")),
+    Activity("scope1", "fugitive_emissions", product, ("fugitive_activity_data", "fugitive_ef")),
+    Activity("scope1", "custom_natural_gas", product, ("custom_natural_gas", Factor("natural_gas_volume"))),
+    Activity("scope1", "custom_fuel_oil", product, ("custom_fuel_oil", Factor("fuel_oil_volume"))),
+    Activity("scope1", "custom_company_vehicles", product,
+             ("custom_company_vehicle_distance", Factor("company_vehicle_distance"))),
+    Activity("scope1", "custom_fleet_fuel", product, ("custom_fleet_fuel_consumption", Factor("fleet_fuel_volume"))),
+    Activity("scope1", "custom_process", product, ("custom_process_activity_data", Factor("process_activity"))),
+    Activity("scope1", "custom_fugitive", product, ("custom_refrigerant_leakage", Factor("hfc_134a_leakage"))),
+    # Scope 2
+    Activity("scope2", "purchased_energy", product, ("scope2_purchased_energy", "scope2_purchased_energy_ef")),
+    Activity("scope2", "custom_electricity", renewable_adjusted,
+             ("custom_electricity_usage", Factor("grid_electricity"), "custom_renewable_percentage")),
+    Activity("scope2", "custom_heat", product, ("custom_heat_steam_usage", Factor("heat_steam"))),
+    # Scope 3
+    Activity("scope3", "purchased_goods_spend", product, ("scope3_spend_goods", "scope3_ef_spend_goods")),
+    Activity("scope3", "purchased_goods_mass", product, ("scope3_mass_goods", "scope3_ef_mass_goods")),
+    Activity("scope3", "capital_goods", product, ("scope3_mass_capital", "scope3_ef_capital")),
+    Activity("scope3", "fuel_energy_related", product, ("scope3_fuel_energy_purchased", "scope3_ef_wtt")),
+    Activity("scope3", "upstream_transport", freight,
+             ("scope3_mass_upstream", "scope3_dist_upstream", "scope3_ef_tonne_km_up")),
+    Activity("scope3", "waste_ch4", landfill_methane,
+             ("scope3_waste_mass", "scope3_doc", "scope3_docf", "scope3_f", "scope3_r")),
+    Activity("scope3", "waste_co2_incineration", product, ("scope3_waste_mass", "scope3_ef_incineration")),
+    Activity("scope3", "business_travel", product, ("scope3_business_travel_distance", "scope3_ef_mode_travel")),
+    Activity("scope3", "employee_commuting", product,
+             ("scope3_employees", "scope3_trips_per_year", "scope3_avg_commute_distance", "scope3_ef_mode_commute")),
+    Activity("scope3", "upstream_leased_assets", product, ("scope3_fuel_leased", "scope3_ef_fuel_leased")),
+    Activity("scope3", "downstream_transport", freight,
+             ("scope3_mass_downstream", "scope3_dist_downstream", "scope3_ef_tonne_km_down")),
+    Activity("scope3", "processing_sold_products", product, ("scope3_mass_sold_products", "scope3_ef_processing")),
+    Activity("scope3", "use_sold_products", product, ("scope3_energy_use_sold", "scope3_ef_energy_sold")),
+    Activity("scope3", "end_of_life", product, ("scope3_waste_sold_products", "scope3_ef_disposal")),
+    Activity("scope3", "downstream_leased_assets", product, ("scope3_fuel_downleased", "scope3_ef_fuel_downleased")),
+    Activity("scope3", "franchises", product, ("scope3_franchise_area", "scope3_ef_franchise_area")),
+    Activity("scope3", "investee_emissions", reported, ("scope3_investee_emissions",)),
+    Activity("scope3", "investment_value", product, ("scope3_investment_value", "scope3_ef_investment")),
+    Activity("scope3", "custom_flight_miles", product, ("custom_flight_distance", Factor("flight_distance"))),
+    Activity("scope3", "custom_hotel_nights", product, ("custom_hotel_nights", Factor("hotel_night"))),
+    Activity("scope3", "custom_employee_commuting", product,
+             ("custom_num_employees", "custom_avg_commute", "custom_work_days", Factor("commuting_distance"))),
+]
+
+
+def _check_registry():
+    for key, default in INPUTS.items():
+        if isinstance(default, Factor) and default.name not in FACTORS:
+            raise ValueError(f"{key}: unknown factor {default.name!r}")
+    for activity in ACTIVITIES:
+        for arg in activity.args:
+            if isinstance(arg, Factor):
+                if arg.name not in FACTORS:
+                    raise ValueError(f"{activity.category}: unknown factor {arg.name!r}")
+            elif arg not in INPUTS:
+                raise ValueError(f"{activity.category}: unknown input {arg!r}")
+
+_check_registry()
+
+# Unit of every quantity input; emission factor inputs take the unit of
+# their factor
+INPUT_UNITS = {
+    "stationary_fuel_consumption": "TJ",
+    "stationary_cc": "kg C/TJ",
+    "road_transport_fuel": "TJ",
+    "railways_fuel": "TJ",
+    "marine_fuel": "TJ",
+    "offroad_fuel": "TJ",
+    "process_activity_level": "tonne",
+    "fugitive_activity_data": "unit",
+    "custom_natural_gas": "m3",
+    "custom_fuel_oil": "l",
+    "custom_company_vehicle_distance": "km",
+    "custom_fleet_fuel_consumption": "l",
+    "custom_process_activity_data": "unit",
+    "custom_refrigerant_leakage": "kg",
+    "scope2_purchased_energy": "kWh",
+    "custom_electricity_usage": "kWh",
+    "custom_renewable_percentage": "%",
+    "custom_heat_steam_usage": "MWh",
+    "scope3_spend_goods": "USD",
+    "scope3_mass_goods": "kg",
+    "scope3_mass_capital": "kg",
+    "scope3_fuel_energy_purchased": "MJ",
+    "scope3_mass_upstream": "kg",
+    "scope3_dist_upstream": "km",
+    "scope3_waste_mass": "kg",
+    "scope3_r": "fraction",
+    "scope3_business_travel_distance": "km",
+    "scope3_employees": "employee",
+    "scope3_trips_per_year": "trip",
+    "scope3_avg_commute_distance": "km",
+    "scope3_fuel_leased": "TJ",
+    "scope3_mass_downstream": "kg",
+    "scope3_dist_downstream": "km",
+    "scope3_mass_sold_products": "kg",
+    "scope3_energy_use_sold": "kWh",
+    "scope3_waste_sold_products": "kg",
+    "scope3_fuel_downleased": "TJ",
+    "scope3_franchise_area": "m2",
+    "scope3_investee_emissions": "kg CO2e",
+    "scope3_investment_value": "USD",
+    "custom_flight_distance": "mile",
+    "custom_hotel_nights": "night",
+    "custom_num_employees": "employee",
+    "custom_avg_commute": "km/day",
+    "custom_work_days": "day",
+    "custom_waste_generated": "kg",
+    "custom_recycling_percentage": "%",
+    "custom_annual_procurement_spend": "USD",
+}
+
+RESULT_UNIT = "kg CO2e"
+
+# The arguments of each formula whose units multiply into its result; the
+# others are dimensionless or converted by the formula itself. Formulas
+# missing here are not unit checked (landfill_methane yields CH4 from a
+# waste mass).
+UNIT_ARGS = {
+    product: slice(None),
+    stationary_combustion: slice(0, 2),
+    renewable_adjusted: slice(0, 2),
+    reported: slice(None),
+    freight: slice(None),
+}
+# Units some formulas convert an argument to themselves: {formula: {arg index: unit}}
+CONVERTED_ARGS = {
+    freight: {0: "tonne"},
+}
+
+
+def input_unit(key):
+    """Unit of an input (None for switches)."""
+    default = INPUTS[key]
+    if isinstance(default, Factor):
+        return FACTORS[default.name][4]
+    return INPUT_UNITS.get(key)
+
+
+def _check_units():
+    """Check the units of the inputs and activities.
+
+    Raises ValueError on an unknown unit or an activity whose units do not
+    give kg CO2e: another dimension, or emissions at another scale that
+    the formula would have to convert (see CONVERTED_ARGS).
+    """
+    for key, default in INPUTS.items():
+        if isinstance(default, bool):
+            continue
+        if input_unit(key) is None:
+            raise ValueError(f"{key}: no unit")
+        try:
+            units.parse(input_unit(key))
+        except ValueError as e:
+            raise ValueError(f"{key}: {e}") from None
+    for activity in ACTIVITIES:
+        selected = UNIT_ARGS.get(activity.formula)
+        if selected is None:
+            continue
+        arg_units = [FACTORS[arg.name][4] if isinstance(arg, Factor) else input_unit(arg)
+                     for arg in activity.args]
+        try:
+            for index, unit in CONVERTED_ARGS.get(activity.formula, {}).items():
+                units.conversion_factor(arg_units[index], unit)
+                arg_units[index] = unit
+            scale = units.unit_factor(units.multiply(*arg_units[selected]), RESULT_UNIT)
+        except ValueError as e:
+            raise ValueError(f"{activity.category} ({' × '.join(map(str, arg_units))}): {e}") from None
+        if scale != 1.0:
+            raise ValueError(
+                f"{activity.category} ({' × '.join(arg_units[selected])}): one of each gives {scale:g} {RESULT_UNIT}"
+            )
+
+# Checked once at import; evaluate() never converts units
+_check_units()
+
+# Version of the formulas; stored with every footprint next to its factor set version
+FORMULA_VERSION = 2
+# (scope, category) of the activities whose results each formula version changed
+FORMULA_CHANGES = {
+    # Freight masses are in kg and its factors per tonne-km: version 1 did not
+    # convert the mass to tonnes, overstating freight 1000x (see freight())
+    2: (("scope3", "upstream_transport"), ("scope3", "downstream_transport")),
+}
+
+
+def changed_activities(formula_version):
+    """Activities whose results changed since an older formula version (None counts as 1)."""
+    changed = set()
+    for version in range((formula_version or 1) + 1, FORMULA_VERSION + 1):
+        changed.update(FORMULA_CHANGES.get(version, ()))
+    return [activity for activity in ACTIVITIES if (activity.scope, activity.category) in changed]
+
+_factor_values = {}
+
+
+def factor_values(factor_set=None, factors=None):
+    """Values of FACTORS in a factor set (the configured one by default).
+
+    factors ({name: value}) overrides some of them.
+    """
+    if factor_set is None:
+        factor_set = get_factor_set()
+    values = _factor_values.get(factor_set.version)
+    if values is None:
+        values = _factor_values[factor_set.version] = {
+            name: factor_set.value(*key) for name, key in FACTORS.items()
+        }
+    return values if not factors else {**values, **factors}
+
+
+def defaults(factor_set=None, factors=None):
+    """Default value of every input, with emission factor inputs resolved."""
+    values = factor_values(factor_set, factors)
+    return {
+        key: values[default.name] if isinstance(default, Factor) else default
+        for key, default in INPUTS.items()
+    }
+
+
+def input_columns(inputs, input_defaults=None):
+    """Convert inputs to float64 arrays, filling in defaults.
+
+    inputs is a mapping of input key to a scalar or array (a dict, a pandas
+    DataFrame...) or a list of such mappings, one per row.
+    """
+    if input_defaults is None:
+        input_defaults = defaults()
+    if isinstance(inputs, (list, tuple)):
+        rows = inputs
+        inputs = {key: [row.get(key, default) for row in rows] for key, default in input_defaults.items()}
+    unknown = [key for key in inputs.keys() if key not in INPUTS]
+    if unknown:
+        raise ValueError(f"Unknown calculator inputs: {', '.join(map(str, unknown))}")
+    return {
+        key: np.asarray(inputs[key], dtype=np.float64) if key in inputs else np.float64(default)
+        for key, default in input_defaults.items()
+    }
+
+
+def evaluate(inputs, factors=None, factor_set=None, activities=None):
+    """Compute every activity (or only those in activities) for a batch of inputs.
+
+    Factors come from factor_set (the configured factor set by default);
+    factors ({name: value}) overrides some of them, input defaults included.
+    Returns a dict with 'emission_details' ({scope: {category: array}}), the
+    scope1/scope2/scope3/total_emissions arrays, all broadcast to the shape
+    of the inputs, and the 'inputs', 'defaults', 'factor_set_version' and
+    'formula_version' they were computed from.
+    """
+    if factor_set is None:
+        factor_set = get_factor_set()
+    values = factor_values(factor_set, factors)
+    input_defaults = defaults(factor_set, factors)
+    columns = input_columns(inputs, input_defaults)
+    details = {scope: {} for scope in SCOPES}
+    for activity in ACTIVITIES if activities is None else activities:
+        args = [
+            np.float64(values[arg.name]) if isinstance(arg, Factor) else columns[arg]
+            for arg in activity.args
+        ]
+        details[activity.scope][activity.category] = activity.formula(*args)
+
+    shape = np.broadcast_shapes(*(np.shape(v) for v in columns.values()))
+    result = {"emission_details": details}
+    total = 0.0
+    for scope in SCOPES:
+        scope_total = 0.0
+        for category, values in details[scope].items():
+            details[scope][category] = np.broadcast_to(values, shape)
+            scope_total = scope_total + details[scope][category]
+        result[f"{scope}_emissions"] = np.broadcast_to(scope_total, shape)
+        total = total + scope_total
+    result["total_emissions"] = np.broadcast_to(total, shape)
+    result.update(
+        inputs=columns, defaults=input_defaults, factor_set_version=factor_set.version,
+        formula_version=FORMULA_VERSION
+    )
+    return result
+
+
+def to_footprints(result):
+    """Split a 1-D (or scalar) evaluate() result into footprint dicts of Python floats.
+
+    Each footprint carries the inputs that differ from the defaults, the
+    factor set and formula versions and their input_hash, as stored with
+    saved footprints.
+    """
+    count = np.size(result["total_emissions"])
+    details = {
+        scope: {category: values.ravel().tolist() for category, values in categories.items()}
+        for scope, categories in result["emission_details"].items()
+    }
+    totals = {key: result[key].ravel().tolist() for key in TOTALS}
+    inputs = [{} for _ in range(count)]
+    for key, values in result["inputs"].items():
+        values = np.broadcast_to(values, (count,))
+        for i in np.flatnonzero(values != result["defaults"][key]):
+            inputs[i][key] = float(values[i])
+    return [
+        {
+            **{key: values[i] for key, values in totals.items()},
+            "emission_details": {
+                scope: {category: values[i] for category, values in categories.items()}
+                for scope, categories in details.items()
+            },
+            "inputs": inputs[i],
+            "factor_set_version": result["factor_set_version"],
+            "formula_version": result["formula_version"],
+            "input_hash": _hash_inputs(inputs[i], result["factor_set_version"], result["formula_version"])
+        }
+        for i in range(count)
+    ]
+
+
+def calculate(values, factors=None, factor_set=None):
+    """Compute a single footprint from one set of Calculator values."""
+    return to_footprints(evaluate(values, factors, factor_set))[0]
+
+
+def _canonical_inputs(inputs):
+    # Sorted (key, float) pairs: the same inputs in any order or numeric type compare equal
+    return tuple(sorted((key, float(value)) for key, value in inputs.items()))
+
+
+def _hash_inputs(inputs, version, formula_version=FORMULA_VERSION):
+    # 'version;formula=N;key=value;...' with the keys sorted and the exact repr of each value as a float
+    payload = f"{version};formula={formula_version}" + "".join(
+        sorted(f";{key}={float(value)!r}" for key, value in inputs.items())
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def input_hash(values, factor_set=None):
+    """Canonical hash of a set of Calculator values, the factor set version and FORMULA_VERSION.
+
+    Only the values that differ from the defaults count, so it is the
+    input_hash of the footprint calculate() returns for them.
+    """
+    if factor_set is None:
+        factor_set = get_factor_set()
+    return _hash_inputs(changed_inputs(values, factor_set), factor_set.version)
+
+
+@lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _cached_footprint(inputs, version):
+    return calculate(dict(inputs), factor_set=get_factor_set(version))
+
+
+def calculate_cached(values, factor_set=None):
+    """calculate() of one set of Calculator values, served from an LRU cache.
+
+    Cached by the canonical non-default inputs and the factor set version,
+    so resubmitting the same values skips the calculation. Returns a copy
+    the caller may modify.
+    """
+    unknown = [key for key in values if key not in INPUTS]
+    if unknown:
+        raise ValueError(f"Unknown calculator inputs: {', '.join(map(str, unknown))}")
+    if factor_set is None:
+        factor_set = get_factor_set()
+    inputs = _canonical_inputs(changed_inputs(values, factor_set))
+    return copy.deepcopy(_cached_footprint(inputs, factor_set.version))
+
+
+def changed_inputs(values, factor_set=None):
+    """The values that differ from the defaults of a factor set, as stored with a footprint."""
+    input_defaults = defaults(factor_set)
+    return {key: value for key, value in values.items() if key in INPUTS and value != input_defaults[key]}
+
+
+def used_activities(inputs):
+    """Activities a footprint has results for, given its stored (non-default) inputs.
+
+    An activity counts once any of its activity data inputs is set.
+    """
+    used = []
+    for activity in ACTIVITIES:
+        data = [arg for arg in activity.args if not isinstance(arg, Factor) and not isinstance(INPUTS[arg], Factor)]
+        if any(arg in inputs for arg in data):
+            used.append(activity)
+    return used
+
+
+def dependencies(inputs):
+    """Names of the FACTORS a footprint depends on, given its stored (non-default) inputs.
+
+    Each used activity depends on its fixed factors and on the emission
+    factor inputs that were left at their default.
+    """
+    names = set()
+    for activity in used_activities(inputs):
+        for arg in activity.args:
+            if isinstance(arg, Factor):
+                names.add(arg.name)
+            elif isinstance(INPUTS[arg], Factor) and arg not in inputs:
+                names.add(INPUTS[arg].name)
+    return names
+
+
+Section = namedtuple("Section", "inputs activities")
+
+
+def _sections():
+    """Group the activities sharing inputs; each group only depends on its own inputs."""
+    sections = []
+    for activity in ACTIVITIES:
+        keys = {arg for arg in activity.args if not isinstance(arg, Factor)}
+        merged = [section for section in sections if section[0] & keys]
+        for section in merged:
+            sections.remove(section)
+            keys |= section[0]
+        activities = [a for section in merged for a in section[1]] + [activity]
+        sections.append((keys, activities))
+    order = {activity: i for i, activity in enumerate(ACTIVITIES)}
+    return [
+        Section(tuple(key for key in INPUTS if key in keys), tuple(sorted(activities, key=order.get)))
+        for keys, activities in sections
+    ]
+
+# Independent groups of activities, with the inputs they read
+SECTIONS = _sections()
+
+
+@lru_cache(maxsize=4096)
+def _section_emissions(index, values, version):
+    section = SECTIONS[index]
+    result = evaluate(dict(zip(section.inputs, values)), factor_set=get_factor_set(version),
+                      activities=section.activities)
+    return {activity: float(result["emission_details"][activity.scope][activity.category])
+            for activity in section.activities}
+
+
+def preview(values, factor_set=None):
+    """Footprint of one set of Calculator values, computed section by section.
+
+    The emissions of each section are memoized on the tuple of its input
+    values, so after a change only the sections whose inputs changed are
+    computed again. Returns the emission_details and totals of calculate().
+    """
+    if factor_set is None:
+        factor_set = get_factor_set()
+    input_defaults = defaults(factor_set)
+    emissions = {}
+    for index, section in enumerate(SECTIONS):
+        key = tuple(float(values.get(name, input_defaults[name])) for name in section.inputs)
+        emissions.update(_section_emissions(index, key, factor_set.version))
+    details = {scope: {} for scope in SCOPES}
+    for activity in ACTIVITIES:
+        details[activity.scope][activity.category] = emissions[activity]
+    footprint = {"emission_details": details}
+    total = 0.0
+    for scope in SCOPES:
+        scope_total = 0.0
+        for value in details[scope].values():
+            scope_total = scope_total + value
+        footprint[f"{scope}_emissions"] = scope_total
+        total = total + scope_total
+    footprint["total_emissions"] = total
+    return footprint
@@ -0,0 +1,166 @@
+"""
+Versioned emission factor sets.
+
+A factor set is a CSV file in FACTOR_SET_DIR named after its version
+(config/factor_sets/2026.1.csv) with one factor per row: source, country,
+year, activity, unit, value and an optional description. Published sets
+are never edited; a corrected factor goes into a new version, and
+FACTOR_SET_VERSION selects the set calculations use. Every footprint
+records the version it was calculated with.
+
+A set is parsed once per process into a dict keyed by
+(source, country, year, activity, unit), so a lookup is one hash probe
+however large the table. The key joined with '|' is the factor's id, e.g.
+'IPCC|GLOBAL|2006|natural_gas_combustion|kg CO2/TJ'; ids stay the same
+across versions so changed factors can be compared between sets.
+
+    from utils.factor_store import get_factor_set
+    get_factor_set().value("IPCC", "GLOBAL", 2006, "natural_gas_combustion", "kg CO2/TJ")
+    get_factor_set().find("natural_gas_combustion", "kg CO2/TJ").value
+"""
+import csv
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from config.settings import FACTOR_SET_DIR, FACTOR_SET_VERSION
+
+ID_SEPARATOR = "|"
+KEY_FIELDS = ("source", "country", "year", "activity", "unit")
+
+EmissionFactor = namedtuple("EmissionFactor", "source country year activity unit value description")
+
+_sets = {}
+_sets_lock = threading.Lock()
+
+
+def factor_key(source, country, year, activity, unit):
+    """Lookup key of a factor; year is normalized to an int."""
+    return (source, country, int(year), activity, unit)
+
+
+def factor_id(key):
+    """Id of a factor key: its fields joined with '|'."""
+    return ID_SEPARATOR.join(str(part) for part in key)
+
+
+def parse_factor_id(identifier):
+    """Inverse of factor_id."""
+    parts = identifier.split(ID_SEPARATOR)
+    if len(parts) != len(KEY_FIELDS):
+        raise ValueError(f"Invalid factor id: {identifier!r}")
+    return factor_key(*parts)
+
+
+class FactorSet:
+    """One version of the emission factors, indexed by factor key."""
+
+    def __init__(self, version, factors):
+        self.version = version
+        self.factors = factors
+        self._by_activity = None
+
+    def __len__(self):
+        return len(self.factors)
+
+    def __contains__(self, key):
+        return factor_key(*key) in self.factors
+
+    def lookup(self, source, country, year, activity, unit):
+        """Return the EmissionFactor with this key. Raises KeyError if the set has none."""
+        key = factor_key(source, country, year, activity, unit)
+        try:
+            return self.factors[key]
+        except KeyError:
+            raise KeyError(f"No emission factor {factor_id(key)!r} in factor set {self.version}") from None
+
+    def value(self, source, country, year, activity, unit):
+        """Return the value of a factor."""
+        return self.lookup(source, country, year, activity, unit).value
+
+    def get(self, identifier):
+        """Return the EmissionFactor with this factor id."""
+        return self.lookup(*parse_factor_id(identifier))
+
+    def find(self, activity, unit):
+        """Return the one factor of this set for an activity and unit, whatever its source, country and year.
+
+        Raises KeyError if the set has none and ValueError if it has several.
+        """
+        if self._by_activity is None:
+            by_activity = {}
+            for key, factor in self.factors.items():
+                by_activity.setdefault((key[3], key[4]), []).append(factor)
+            self._by_activity = by_activity
+        matches = self._by_activity.get((activity, unit), [])
+        if not matches:
+            raise KeyError(f"No emission factor for {activity!r} in {unit!r} in factor set {self.version}")
+        if len(matches) > 1:
+            ids = ", ".join(sorted(factor_id(factor[:5]) for factor in matches))
+            raise ValueError(f"Factor set {self.version} has several factors for {activity!r} in {unit!r}: {ids}")
+        return matches[0]
+
+
+def changed_keys(old, new):
+    """Keys of the factors added, removed or given another value between two factor sets."""
+    changed = set(old.factors.keys() ^ new.factors.keys())
+    changed.update(
+        key for key, factor in new.factors.items()
+        if key in old.factors and old.factors[key].value != factor.value
+    )
+    return changed
+
+
+def factor_set_path(version, directory=FACTOR_SET_DIR):
+    return Path(directory) / f"{version}.csv"
+
+
+def available_versions(directory=FACTOR_SET_DIR):
+    """Versions of the factor sets found in the factor set directory."""
+    return sorted(path.stem for path in Path(directory).glob("*.csv"))
+
+
+def load_factor_set(path, version=None):
+    """Parse a factor set CSV file. Raises ValueError on bad or duplicate rows."""
+    path = Path(path)
+    factors = {}
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        missing = set(KEY_FIELDS + ("value",)) - set(header)
+        if missing:
+            raise ValueError(f"{path.name} is missing the columns {', '.join(sorted(missing))}")
+        source, country, year, activity, unit = (header.index(field) for field in KEY_FIELDS)
+        value_column = header.index("value")
+        description = header.index("description") if "description" in header else None
+        for line_no, row in enumerate(reader, 2):
+            try:
+                key = (row[source], row[country], int(row[year]), row[activity], row[unit])
+                value = float(row[value_column])
+            except (IndexError, ValueError):
+                raise ValueError(f"{path.name} line {line_no}: invalid factor row") from None
+            if key in factors:
+                raise ValueError(f"{path.name} line {line_no}: duplicate factor {factor_id(key)!r}")
+            text = row[description] if description is not None and description < len(row) else ""
+            factors[key] = EmissionFactor(*key, value, text)
+    return FactorSet(version or path.stem, factors)
+
+
+def get_factor_set(version=None):
+    """Return a factor set (FACTOR_SET_VERSION by default), loading it on first use."""
+    version = version or FACTOR_SET_VERSION
+    factor_set = _sets.get(version)
+    if factor_set is None:
+        with _sets_lock:
+            factor_set = _sets.get(version)
+            if factor_set is None:
+                path = factor_set_path(version)
+                if not path.exists():
+                    raise ValueError(f"Unknown factor set version {version!r} (no {path})")
+                factor_set = _sets[version] = load_factor_set(path, version)
+    return factor_set
+
+
+def factor_value(source, country, year, activity, unit, version=None):
+    """Value of one factor of a factor set (the configured one by default)."""
+    return get_factor_set(version).value(source, country, year, activity, unit)
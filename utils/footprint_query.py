@@ -0,0 +1,165 @@
+"""
+Vectorized queries over every stored footprint.
+
+footprint_frame() loads the footprints of the configured storage backend
+into one pandas DataFrame: the scope totals, emission_details flattened
+into '<scope>__<category>' columns (kgCO2e, e.g. scope3__franchises) and
+date/year/month derived from created_at. The frame is cached per process
+and rebuilt only when the backend's data_version() changes.
+
+query() filters, groups and ranks that frame with pandas/NumPy operations
+instead of Python loops over load_data():
+
+    # Footprints from 2025 with more than 10 t of franchise emissions
+    query("year == 2025 and scope3__franchises > 10000")
+
+    # The 20 users with the largest fugitive (refrigerant) emissions
+    query(group_by="user_id", top=20, sort_by="scope1__fugitive_emissions")
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils import pagination
+
+DETAIL_SEPARATOR = "__"
+KEY_COLUMNS = ["id", "user_id", "created_at"]
+SCOPE_COLUMNS = ["scope1_emissions", "scope2_emissions", "scope3_emissions", "total_emissions"]
+DATE_COLUMNS = ["date", "year", "month"]
+AGGREGATIONS = ("sum", "mean", "median", "min", "max", "count")
+
+_frame_lock = threading.Lock()
+_frame = {"version": None, "frame": None}
+
+
+def detail_column(scope, category):
+    """Name of the flattened column of an emission_details category."""
+    return f"{scope}{DETAIL_SEPARATOR}{category}"
+
+
+def emission_columns(frame):
+    """Scope total and flattened category columns of a frame."""
+    return SCOPE_COLUMNS + [c for c in frame.columns if DETAIL_SEPARATOR in c]
+
+
+def build_frame(footprints):
+    """Build the columnar frame from an iterable of footprint dicts.
+
+    Categories missing from a footprint are NaN in its row.
+    """
+    base = {column: [] for column in KEY_COLUMNS + SCOPE_COLUMNS}
+    details = {}
+    count = 0
+    for footprint in footprints:
+        for column, values in base.items():
+            values.append(footprint.get(column))
+        for scope, categories in (footprint.get("emission_details") or {}).items():
+            if not isinstance(categories, dict):
+                continue
+            for category, value in categories.items():
+                values = details.get(detail_column(scope, category))
+                if values is None:
+                    values = details[detail_column(scope, category)] = [np.nan] * count
+                values.append(value)
+        count += 1
+        for values in details.values():
+            if len(values) < count:
+                values.append(np.nan)
+
+    frame = pd.DataFrame({
+        "id": np.asarray(base["id"], dtype=np.int64),
+        "user_id": np.asarray(base["user_id"], dtype=np.int64),
+        "created_at": np.asarray(base["created_at"], dtype=np.float64),
+        **{column: np.asarray(base[column], dtype=np.float64) for column in SCOPE_COLUMNS},
+    })
+    frame["date"] = pd.to_datetime(frame["created_at"], unit="s")
+    frame["year"] = frame["date"].dt.year
+    frame["month"] = frame["date"].dt.month
+    if details:
+        frame = pd.concat([
+            frame,
+            pd.DataFrame({c: np.asarray(details[c], dtype=np.float64) for c in sorted(details)})
+        ], axis=1)
+    return frame
+
+
+def footprint_frame(storage=None):
+    """Return the cached frame of all footprints, rebuilding it if storage changed.
+
+    The frame is shared between callers and must not be modified.
+    """
+    if storage is None:
+        from utils.storage import get_storage
+        storage = get_storage()
+    version = storage.data_version()
+    cached = _frame
+    if cached["frame"] is not None and cached["version"] == version:
+        return cached["frame"]
+    with _frame_lock:
+        if _frame["frame"] is not None and _frame["version"] == version:
+            return _frame["frame"]
+        frame = build_frame(storage.iter_footprints())
+        _frame.update(version=version, frame=frame)
+        return frame
+
+
+def invalidate():
+    """Drop the cached frame."""
+    with _frame_lock:
+        _frame.update(version=None, frame=None)
+
+
+def query(where=None, since=None, until=None, user_id=None, group_by=None, agg="sum",
+          top=None, sort_by=None, ascending=False, columns=None, frame=None):
+    """Filter, group and rank footprints.
+
+    where:       pandas expression over the frame's columns, e.g.
+                 "year == 2025 and scope3__franchises > 10000"
+    since/until: inclusive created_at bounds (datetime or timestamp)
+    user_id:     only this user's footprints
+    group_by:    column name or list of names ("user_id", "year", ...);
+                 each group gets agg of the emission columns and a
+                 "footprints" count
+    top:         keep the top N rows by sort_by (default total_emissions),
+                 largest first unless ascending
+    columns:     emission columns to return (default: all)
+
+    Returns a new DataFrame.
+    """
+    if frame is None:
+        frame = footprint_frame()
+
+    mask = np.ones(len(frame), dtype=bool)
+    if user_id is not None:
+        mask &= frame["user_id"].to_numpy() == user_id
+    created_at = frame["created_at"].to_numpy()
+    if since is not None:
+        mask &= created_at >= pagination.to_timestamp(since)
+    if until is not None:
+        mask &= created_at <= pagination.to_timestamp(until)
+    result = frame[mask]
+    if where:
+        result = result.query(where)
+
+    values = list(columns) if columns is not None else emission_columns(frame)
+    if group_by is not None:
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"agg must be one of {AGGREGATIONS}, got {agg!r}")
+        keys = [group_by] if isinstance(group_by, str) else list(group_by)
+        grouped = result.groupby(keys, sort=True)
+        result = grouped[values].agg(agg)
+        result.insert(0, "footprints", grouped.size())
+        result = result.reset_index()
+    else:
+        result = result[KEY_COLUMNS + DATE_COLUMNS + values]
+
+    if top is not None or sort_by is not None:
+        sort_by = sort_by or "total_emissions"
+        if top is None:
+            result = result.sort_values(sort_by, ascending=ascending, kind="stable")
+        elif ascending:
+            result = result.nsmallest(top, sort_by)
+        else:
+            result = result.nlargest(top, sort_by)
+    return result.reset_index(drop=True)
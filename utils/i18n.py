@@ -33,6 +33,15 @@ TRANSLATIONS = {
         'scope3_breakdown': 'Scope 3 Breakdown',
         'historical_trends': 'Historical Trends',
         'detailed_history': 'Detailed History',
+        'period': 'Period',
+        'monthly': 'Monthly',
+        'quarterly': 'Quarterly',
+        'yearly': 'Yearly',
+        'aggregation': 'Aggregation',
+        'average_per_calculation': 'Average per calculation',
+        'sum': 'Sum',
+        'newer': 'Newer',
+        'older': 'Older',
         'no_history': 'No calculation history yet. Try calculating your carbon footprint first!',
         'go_to_calculator': 'Go to Calculator',
         'emissions_over_time': 'Emissions Over Time',
@@ -170,6 +179,15 @@ TRANSLATIONS = {
         'scope3_breakdown': 'Répartition Scope 3',
         'historical_trends': 'Tendances historiques',
         'detailed_history': 'Historique détaillé',
+        'period': 'Période',
+        'monthly': 'Mensuel',
+        'quarterly': 'Trimestriel',
+        'yearly': 'Annuel',
+        'aggregation': 'Agrégation',
+        'average_per_calculation': 'Moyenne par calcul',
+        'sum': 'Somme',
+        'newer': 'Plus récent',
+        'older': 'Plus ancien',
         'no_history': 'Aucun historique de calcul. Essayez de calculer votre empreinte carbone !',
         'go_to_calculator': 'Aller au calculateur',
         'emissions_over_time': 'Émissions au fil du temps',
@@ -489,6 +507,15 @@ TRANSLATIONS = {
         'scope3_breakdown': 'تفصيل النطاق 3',
         'historical_trends': 'الاتجاهات التاريخية',
         'detailed_history': 'السجل التفصيلي',
+        'period': 'الفترة',
+        'monthly': 'شهري',
+        'quarterly': 'ربع سنوي',
+        'yearly': 'سنوي',
+        'aggregation': 'التجميع',
+        'average_per_calculation': 'المتوسط لكل عملية حساب',
+        'sum': 'المجموع',
+        'newer': 'الأحدث',
+        'older': 'الأقدم',
         'no_history': 'لا يوجد سجل حساب بعد. جرب حساب البصمة الكربونية أولاً!',
         'go_to_calculator': 'اذهب إلى الحاسبة',
         'emissions_over_time': 'الانبعاثات مع مرور الوقت',
@@ -815,6 +842,15 @@ TRANSLATIONS = {
         'scope3_breakdown': 'Détail du scope 3',
         'historical_trends': 'Tendances historiques',
         'detailed_history': 'Historique détaillé',
+        'period': 'Période',
+        'monthly': 'Mensuel',
+        'quarterly': 'Trimestriel',
+        'yearly': 'Annuel',
+        'aggregation': 'Agrégation',
+        'average_per_calculation': 'Moyenne par calcul',
+        'sum': 'Somme',
+        'newer': 'Plus récent',
+        'older': 'Plus ancien',
         'no_history': 'Aucun historique pour le moment. Essayez de calculer l\'empreinte carbone d\'abord!',
         'go_to_calculator': 'Aller à la calculatrice',
         'emissions_over_time': 'Émissions au fil du temps',
@@ -1,25 +1,273 @@
 """
 JSON-based storage system to replace SQLite database.
 Stores all data in a single JSON file in the user's home directory.
+
+When journaling is enabled (STORAGE_JOURNAL), new records are appended to a
+JSONL journal next to the data file instead of rewriting the whole file.
+The journal is folded back into the snapshot once it grows past
+JOURNAL_COMPACT_BYTES, and load_data replays snapshot plus journal.
+
+Snapshots are immutable generations (data/generations/<n>.snapshot, each
+with its own <n>.journal.jsonl). save_data writes a new generation and
+publishes it by atomically replacing data/generations/current.json, so a
+reader always replays one snapshot with its own journal, never waits for a
+writer and never sees a half-written file. Without a pointer file,
+carbon_data.json is generation 0, as in the original layout; it stays
+untouched while generation 0 can still be read, and once that is retired
+it is kept as a hard link to the current snapshot for external tools. A generation that
+cannot be read is reported and the previous one stays in use; nothing is
+ever reset.
+
+Parsed data is kept in a process-wide cache, validated against the stat
+signature of the data and journal files, with hash indexes for lookups by
+email and by user id. Other files (shards, rollups, indexes) are parsed
+through an LRU cache of the FILE_CACHE_SIZE most recently used ones.
+
+With STORAGE_LAYOUT = 'sharded', each user's footprints live in their own
+append-only file (data/footprints/<user_id>.jsonl) next to a small users
+index (data/users.json), so reads and writes only touch the shard they need.
+Run `python -m utils.json_storage shard` to convert an existing data file.
+
+Several server processes may share one data directory: every
+read-modify-write runs under an advisory fcntl lock, whole-file writes go
+through a temp file + fsync + os.replace, and record ids come from a
+sequence file that is only advanced under that lock.
+
+emission_details are stored in the columnar form of utils/emission_codec.py
+(EMISSION_ENCODING = 'columnar'), with the key layouts kept once in
+data/emission_schemas.json. get_user_footprints decodes them transparently;
+load_data returns records as stored.
+
+The data file itself is written in STORAGE_FORMAT through
+utils/serialization.py and its format is detected on read, so
+`python -m utils.json_storage convert` can switch formats at any time.
+
+Each user's footprints are indexed in (created_at, id) order, so
+get_user_footprints answers time-range and cursor-paginated queries with a
+bisect instead of a scan.
+
+Monthly, quarterly and yearly rollups (utils/rollups.py) are kept per user in
+data/rollups/<user_id>.json and updated under the storage lock together with
+every saved footprint.
+
+With ARCHIVE_AFTER_DAYS set, compaction moves whole months of footprints
+older than that out of the hot files into compressed, immutable per-user,
+per-month segments under data/archive (utils/archive.py), listed in
+data/archive/manifest.json. load_data only returns hot records;
+get_user_footprints opens a segment only when the requested range and page
+reach into it. Segments are decompressed on each use and never cached, so
+cold data does not stay in memory. `python -m utils.json_storage archive`
+runs the policy by hand.
+
+revise_footprints() appends a recalculated footprint again under its id
+with a higher "revision"; the journal replay and the shard parser keep the
+highest revision of each id. The revisions it replaces are appended to
+data/footprint_revisions.jsonl first. Archived footprints are immutable
+and never revised. Saves and revisions also append the footprints' entries
+to the dependency index in data/footprint_dependencies.jsonl
+(recalculation.dependency_entry), built from the stored footprints when it
+is missing, so recalculation can find stale footprints without a scan.
+
+With FOOTPRINT_DEDUPE, footprints whose input_hash matches an earlier one of
+their user are stored as references to it (utils/dedupe.py) and resolved
+from a per-user index of the hot footprints' ids and hashes, extended with
+each footprint the user saves or revises. Archived footprints are only
+searched when the hot ones have no match, opening just the segments whose
+manifest entry lists the id or hash prefix.
 """
 import os
 import json
-from datetime import datetime
+import argparse
+import itertools
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+from config.settings import (
+    STORAGE_JOURNAL, JOURNAL_COMPACT_BYTES, STORAGE_LAYOUT, EMISSION_ENCODING, EMISSION_FLOAT32,
+    STORAGE_FORMAT, ARCHIVE_AFTER_DAYS, ARCHIVE_COMPRESSION, FILE_CACHE_SIZE
+)
+from utils import archive, dedupe, emission_codec, pagination, recalculation, rollups, serialization
+
 # Get the absolute path to the data directory
 BASE_DIR = Path(__file__).parent.parent  # Go up two levels to the project root
 DATA_DIR = BASE_DIR / "data"
 DATA_FILE = DATA_DIR / "carbon_data.json"
+JOURNAL_FILE = DATA_DIR / "carbon_data.journal.jsonl"
+USERS_INDEX_FILE = DATA_DIR / "users.json"
+SEQUENCE_FILE = DATA_DIR / "sequences.json"
+SCHEMA_FILE = DATA_DIR / "emission_schemas.json"
+LOCK_FILE = DATA_DIR / ".storage.lock"
+GENERATIONS_DIR = DATA_DIR / "generations"
+POINTER_FILE = GENERATIONS_DIR / "current.json"
+SHARD_DIR = DATA_DIR / "footprints"
+ROLLUP_DIR = DATA_DIR / "rollups"
+ARCHIVE_DIR = DATA_DIR / "archive"
+ARCHIVE_MANIFEST = ARCHIVE_DIR / "manifest.json"
+REVISIONS_FILE = DATA_DIR / "footprint_revisions.jsonl"
+DEPENDENCIES_FILE = DATA_DIR / "footprint_dependencies.jsonl"
 
 # Create data directory if it doesn't exist
 os.makedirs(DATA_DIR, exist_ok=True, mode=0o777)
 
+# New files get the permissions open() would give them; mkstemp alone would
+# create them 0600. Read once at import, as os.umask can only be read by setting it.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Cross-process locking. flock locks belong to an open file description, so
+# nested acquisitions in the same process must reuse the descriptor instead of
+# opening the lock file again (which would deadlock against ourselves).
+_process_lock = threading.RLock()
+_lock_state = threading.local()
+
+@contextmanager
+def storage_lock():
+    """Hold the exclusive advisory lock on the data directory.
+
+    Re-entrant within a thread; other threads and other processes wait.
+    """
+    with _process_lock:
+        depth = getattr(_lock_state, "depth", 0)
+        if depth == 0:
+            fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o666)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            _lock_state.fd = fd
+        _lock_state.depth = depth + 1
+        try:
+            yield
+        finally:
+            _lock_state.depth -= 1
+            if _lock_state.depth == 0:
+                if fcntl is not None:
+                    fcntl.flock(_lock_state.fd, fcntl.LOCK_UN)
+                os.close(_lock_state.fd)
+
+def _atomic_write(path, payload):
+    """Write bytes to path via temp file, fsync and os.replace.
+
+    Readers see either the old or the new file, never a partial write.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            os.chmod(tmp_path, path.stat().st_mode & 0o777)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def _file_key(path):
+    """Return the (mtime, size, inode) signature of a file, or None if missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _ensure_data_file():
+    """Create an empty data file unless another writer already created one."""
+    if _generation_files(current_generation())[0].exists():
+        return
+    with storage_lock():
+        if not _generation_files(current_generation())[0].exists():
+            _atomic_write(DATA_FILE, json.dumps({"users": [], "carbon_footprints": []}, indent=2).encode())
+
+# Snapshot generations
+_pointer = ("unread", 0)
+
+def current_generation():
+    """Number of the published snapshot generation (0 without a pointer file)."""
+    global _pointer
+    key = _file_key(POINTER_FILE)
+    if _pointer[0] != key:
+        generation = 0
+        if key is not None:
+            try:
+                with open(POINTER_FILE, 'r') as f:
+                    generation = json.load(f)["generation"]
+            except FileNotFoundError:
+                key = None
+        _pointer = (key, generation)
+    return _pointer[1]
+
+def _generation_files(generation):
+    """Snapshot and journal paths of a generation."""
+    if generation == 0:
+        return DATA_FILE, JOURNAL_FILE
+    return GENERATIONS_DIR / f"{generation}.snapshot", GENERATIONS_DIR / f"{generation}.journal.jsonl"
+
+def _publish(payload):
+    """Write payload as a new snapshot generation with an empty journal and make it current.
+
+    Must be called under the storage lock. Readers that already started on
+    the previous generation finish on it; the one before that is deleted.
+    """
+    previous = current_generation()
+    generation = previous + 1
+    snapshot, journal = _generation_files(generation)
+    os.makedirs(GENERATIONS_DIR, exist_ok=True)
+    # fsync before os.replace makes the snapshot durable; it is not read back
+    _atomic_write(snapshot, payload)
+    _atomic_write(journal, b"")
+    _atomic_write(POINTER_FILE, json.dumps({"generation": generation}).encode())
+    _retire_generations(keep=previous)
+    # While generation 0 is the backup, carbon_data.json is its snapshot
+    if previous > 0:
+        _mirror_data_file(snapshot)
+    return generation
+
+def _mirror_data_file(snapshot):
+    """Point carbon_data.json at the current snapshot without copying it."""
+    tmp_path = DATA_DIR / f".{DATA_FILE.name}.link"
+    try:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        os.link(snapshot, tmp_path)
+        os.replace(tmp_path, DATA_FILE)
+    except OSError:
+        with open(snapshot, 'rb') as f:
+            _atomic_write(DATA_FILE, f.read())
+
+def _retire_generations(keep):
+    """Delete generations older than keep, which stays as the backup."""
+    for path in GENERATIONS_DIR.glob("*.snapshot"):
+        if path.stem.isdigit() and int(path.stem) < keep:
+            for old in _generation_files(int(path.stem)):
+                if old.exists():
+                    old.unlink()
+    # Generation 0's snapshot is carbon_data.json, which now mirrors the current one
+    if keep > 0 and JOURNAL_FILE.exists():
+        JOURNAL_FILE.unlink()
+
 # Initialize data structure if file doesn't exist
-if not DATA_FILE.exists():
+if not _generation_files(current_generation())[0].exists():
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump({"users": [], "carbon_footprints": []}, f, indent=2)
+        _ensure_data_file()
         # Ensure the file has the right permissions
         os.chmod(DATA_FILE, 0o666)
         print(f"Initialized data file at: {DATA_FILE}")
@@ -30,101 +278,519 @@ if not DATA_FILE.exists():
         print(f"Directory writable: {os.access(DATA_DIR, os.W_OK)}")
         raise
 
+# Process-wide cache of the parsed dataset. The dict is replaced as a whole on
+# every refresh, so readers never observe a half-built index.
+_cache_lock = threading.Lock()
+_cache = {"key": None, "data": None, "users_by_email": {}, "footprints_by_user": {}}
+_cache_builds = itertools.count(1)  # numbers each parse, see _extend_from_cache
+
+def _storage_key():
+    """Signature of everything load_data reads: (generation, snapshot key, journal key)."""
+    generation = current_generation()
+    snapshot, journal = _generation_files(generation)
+    return (generation, _file_key(snapshot), _file_key(journal))
+
+def _build_cache(key, data):
+    """Build the cache entry and its lookup indexes for a parsed dataset."""
+    users_by_email = {}
+    for user in data["users"]:
+        users_by_email.setdefault(user.get("email"), user)
+    grouped = {}
+    for footprint in data["carbon_footprints"]:
+        grouped.setdefault(footprint.get("user_id"), []).append(footprint)
+    footprints_by_user = {user_id: _index_footprints(fps) for user_id, fps in grouped.items()}
+    return {
+        "key": key,
+        "build": next(_cache_builds),
+        "data": data,
+        "users_by_email": users_by_email,
+        "footprints_by_user": footprints_by_user
+    }
+
+def _index_footprints(footprints):
+    """Sort footprints by (created_at, id) along with their bisect keys."""
+    records = sorted(footprints, key=pagination.sort_key)
+    return {"records": records, "keys": [pagination.sort_key(f) for f in records]}
+
+def _insert_footprint(index, footprint):
+    """Add a footprint to a per-user index, keeping it sorted.
+
+    New footprints normally sort last and are appended in place. Anything
+    else returns a new index so concurrent readers never see the two lists
+    out of step.
+    """
+    key = pagination.sort_key(footprint)
+    if not index["keys"] or index["keys"][-1] <= key:
+        index["records"].append(footprint)
+        index["keys"].append(key)
+        return index
+    position = bisect_right(index["keys"], key)
+    return {
+        "records": index["records"][:position] + [footprint] + index["records"][position:],
+        "keys": index["keys"][:position] + [key] + index["keys"][position:]
+    }
+
+def _get_cache():
+    """Return the cached dataset, re-parsing only when the files changed.
+
+    Sessions that miss at the same time queue on the lock and reuse the
+    result of the first parse instead of each parsing the file.
+    """
+    global _cache
+    cache = _cache
+    if cache["key"] is not None and cache["key"] == _storage_key():
+        return cache
+
+    with _cache_lock:
+        key = _storage_key()
+        if _cache["key"] is not None and _cache["key"] == key:
+            return _cache
+        # Readers do not take the storage lock. The generation's snapshot never
+        # changes and its journal only grows, so whatever we parse is at least
+        # as new as key. A generation retired while we read it is retried on
+        # the newer one.
+        for attempt in range(3):
+            try:
+                data = _read_data(key[0])
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+                key = _storage_key()
+            except Exception as e:
+                if _cache["data"] is None:
+                    raise
+                print(f"Error loading generation {key[0]}, still serving generation {_cache['key'][0]}: {e}")
+                return _cache
+        _cache = _build_cache(key, data)
+        return _cache
+
+def _apply_to_cache(table, records, journal_key_before, line_size, replaces=False):
+    """Add records we just journaled to the cache without re-parsing.
+
+    With replaces, the records are revisions that take the place of the
+    records with their ids. Only done when the journal grew by exactly our
+    lines since the cache was built; any other writer in between makes us
+    fall back to a re-parse.
+    """
+    with _cache_lock:
+        cache = _cache
+        if cache["key"] is None or cache["key"][2] != journal_key_before:
+            return
+        generation, snapshot_key, journal_key = _storage_key()
+        before_size = journal_key_before[1] if journal_key_before else 0
+        if (generation, snapshot_key) != cache["key"][:2] or journal_key is None \
+                or journal_key[1] != before_size + line_size:
+            return
+        if replaces:
+            _replace_in_cache(cache, records)
+            cache["key"] = (generation, snapshot_key, journal_key)
+            return
+        # Readers only ever copy these lists, so appending in place is safe
+        cache["data"][table].extend(records)
+        for record in records:
+            if table == "users":
+                cache["users_by_email"].setdefault(record.get("email"), record)
+            else:
+                by_user = cache["footprints_by_user"]
+                index = by_user.get(record.get("user_id"), {"records": [], "keys": []})
+                by_user[record.get("user_id")] = _insert_footprint(index, record)
+        cache["key"] = (generation, snapshot_key, journal_key)
+
+def _replace_in_cache(cache, records):
+    """Swap revised footprints into the cached list and per-user indexes.
+
+    A revision keeps its id and created_at, so it takes exactly the place
+    of the record it revises; single list items are replaced atomically.
+    """
+    footprints = cache["data"]["carbon_footprints"]
+    revised = {record["id"]: record for record in records}
+    for i, footprint in enumerate(footprints):
+        if footprint.get("id") in revised:
+            footprints[i] = revised[footprint.get("id")]
+    for record in records:
+        index = cache["footprints_by_user"][record["user_id"]]
+        position = bisect_right(index["keys"], pagination.sort_key(record)) - 1
+        index["records"][position] = record
+
+def invalidate_cache():
+    """Drop the in-process cache so the next read re-parses the files."""
+    global _cache
+    with _cache_lock:
+        _cache = {"key": None, "data": None, "users_by_email": {}, "footprints_by_user": {}}
+
 def load_data():
-    """Load all data from the JSON file with error handling and validation."""
-    try:
-        # If file doesn't exist, initialize it
-        if not DATA_FILE.exists():
-            reset_data()
-            return {"users": [], "carbon_footprints": []}
-            
-        # Try to read and parse the file
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-            
-        # Validate the data structure
-        if not isinstance(data, dict) or "users" not in data or "carbon_footprints" not in data:
-            print("Invalid data structure, resetting...")
-            reset_data()
-            return {"users": [], "carbon_footprints": []}
-            
-        return data
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        # Try to recover by resetting the file
-        reset_data()
-        return {"users": [], "carbon_footprints": []}
-        
-    except Exception as e:
-        print(f"Unexpected error loading data: {e}")
-        reset_data()
+    """Load all data from the JSON file with error handling and validation.
+
+    Served from the process-wide cache. The returned lists are fresh copies,
+    but the records in them are shared with the cache and must not be mutated.
+    Archived footprints are not included (see iter_archived_footprints).
+    """
+    if STORAGE_LAYOUT == "sharded":
+        return _load_sharded_data()
+    data = _get_cache()["data"]
+    return {"users": list(data["users"]), "carbon_footprints": list(data["carbon_footprints"])}
+
+def _read_data(generation=None):
+    """Parse a generation's snapshot (the current one by default) and replay its journal.
+
+    Raises on unreadable or invalid data instead of touching the files.
+    """
+    if generation is None:
+        generation = current_generation()
+    snapshot, journal = _generation_files(generation)
+
+    # A missing original data file just means nothing was saved yet
+    if generation == 0 and not snapshot.exists():
         return {"users": [], "carbon_footprints": []}
 
+    data = serialization.read_file(snapshot)
+
+    # Validate the data structure
+    if not isinstance(data, dict) or "users" not in data or "carbon_footprints" not in data:
+        raise ValueError(f"Invalid data structure in {snapshot}")
+
+    return _replay_journal(data, journal, generation)
+
 def save_data(data):
-    """Save data to the JSON file with error handling and backup."""
-    try:
-        # Create a backup of the current data
-        backup_file = f"{DATA_FILE}.bak"
-        if DATA_FILE.exists():
-            import shutil
-            shutil.copy2(DATA_FILE, backup_file)
-        
-        # Write new data
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-            
-        # Verify the data was written correctly
-        with open(DATA_FILE, 'r') as f:
-            loaded = json.load(f)
-            if loaded != data:
-                raise ValueError("Data verification failed after write")
-                
-    except Exception as e:
-        print(f"Error saving data: {e}")
-        # Try to restore from backup if available
-        if 'backup_file' in locals() and os.path.exists(backup_file):
-            try:
-                shutil.copy2(backup_file, DATA_FILE)
-                print("Restored data from backup")
-            except Exception as restore_error:
-                print(f"Failed to restore from backup: {restore_error}")
-        raise
+    """Save data as a new snapshot generation.
+
+    The previous generation is kept as the backup.
+    """
+    with storage_lock():
+        _publish(serialization.dumps(data, STORAGE_FORMAT, pretty=(EMISSION_ENCODING == "dict")))
 
 def reset_data():
-    """Reset the data file to initial state."""
-    with open(DATA_FILE, 'w') as f:
-        json.dump({"users": [], "carbon_footprints": []}, f, indent=2)
+    """Reset the data to its initial, empty state."""
+    save_data({"users": [], "carbon_footprints": []})
+
+# Id sequences
+def _max_id(table):
+    """Highest id currently stored in a table, used to seed its sequence."""
+    highest = max((record.get("id") or 0 for record in load_data()[table]), default=0)
+    if table == "carbon_footprints":
+        highest = max([highest] + [s["max_id"] for s in _read_manifest()["segments"]])
+    return highest
+
+def next_id(table):
+    """Allocate the next id for a table ('users' or 'carbon_footprints')."""
+    return next_ids(table, 1)[0]
+
+def next_ids(table, count):
+    """Allocate count consecutive ids for a table and return them as a range.
+
+    The last issued id per table is kept in sequences.json and only advanced
+    under the storage lock, so ids stay unique across processes.
+    """
+    with storage_lock():
+        sequences = {}
+        if SEQUENCE_FILE.exists():
+            with open(SEQUENCE_FILE, 'r') as f:
+                sequences = json.load(f)
+        if table not in sequences:
+            sequences[table] = _max_id(table)
+        first = sequences[table] + 1
+        sequences[table] += count
+        _atomic_write(SEQUENCE_FILE, json.dumps(sequences).encode())
+        return range(first, first + count)
+
+# Journal operations
+def _replay_journal(data, journal, generation):
+    """Apply a generation's journal entries to its snapshot data.
+
+    Raises FileNotFoundError when the journal of a generation that is no
+    longer current is missing: it was retired while we read it, and the
+    caller retries on the current one.
+    """
+    if not journal.exists():
+        if generation != current_generation():
+            raise FileNotFoundError(f"Generation {generation} was retired while reading {journal}")
+        return data
+
+    # Records already folded into the snapshot are skipped, so a crash between
+    # writing the snapshot and truncating the journal cannot duplicate them.
+    # A record with a higher revision replaces the one it revises.
+    positions = {
+        table: {record.get("id"): i for i, record in enumerate(data[table])}
+        for table in ("users", "carbon_footprints")
+    }
+    with open(journal, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line is what an interrupted append leaves behind
+                print(f"Skipping unreadable journal entry at line {line_no}")
+                continue
+            table = entry.get("table")
+            record = entry.get("record")
+            if table not in positions or not isinstance(record, dict):
+                continue
+            position = positions[table].get(record.get("id"))
+            if position is None:
+                positions[table][record.get("id")] = len(data[table])
+                data[table].append(record)
+            elif (record.get("revision") or 0) > (data[table][position].get("revision") or 0):
+                data[table][position] = record
+    return data
+
+def append_journal(table, record):
+    """Append a single new record to the journal."""
+    append_journal_records(table, [record])
+
+def append_journal_records(table, records, replaces=False):
+    """Append new records to the journal in one write.
+
+    The cost of this write depends only on the size of the records. The
+    journal is compacted into the snapshot once it exceeds
+    JOURNAL_COMPACT_BYTES. With replaces, the records are revisions of
+    existing ones.
+    """
+    lines = "".join(
+        json.dumps({"table": table, "record": record}, separators=(',', ':')) + "\n" for record in records
+    )
+    with storage_lock():
+        journal = _generation_files(current_generation())[1]
+        journal_key_before = _file_key(journal)
+        with open(journal, 'a') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        _apply_to_cache(table, records, journal_key_before, len(lines.encode()), replaces)
+
+        if journal.stat().st_size >= JOURNAL_COMPACT_BYTES:
+            compact_journal()
+
+def compact_journal():
+    """Fold the journal into the snapshot file and truncate the journal.
+
+    Applies the ARCHIVE_AFTER_DAYS retention policy on the way.
+    """
+    with storage_lock():
+        journal = _generation_files(current_generation())[1]
+        if not journal.exists() or journal.stat().st_size == 0:
+            return
+        data = load_data()
+        if ARCHIVE_AFTER_DAYS > 0:
+            data["carbon_footprints"] = _archive_old(
+                {None: data["carbon_footprints"]}, ARCHIVE_AFTER_DAYS
+            )[None]
+        # The new generation starts with an empty journal
+        save_data(data)
+
+# Sharded layout
+_file_cache = OrderedDict()  # path -> (stat signature, parsed value), least recently used first
+
+def _cached_read(path, parser):
+    """Parse a file once and reuse the result until its stat signature changes.
+
+    At most FILE_CACHE_SIZE files stay parsed; the least recently used one
+    is dropped first.
+    """
+    with _cache_lock:
+        key = _file_key(path)
+        entry = _file_cache.get(path)
+        if entry is None or entry[0] != key:
+            entry = _file_cache[path] = (key, parser(path))
+        _file_cache.move_to_end(path)
+        while len(_file_cache) > FILE_CACHE_SIZE:
+            _file_cache.popitem(last=False)
+        return entry[1]
+
+def _shard_file(user_id):
+    """Path of the footprint shard for a user."""
+    return SHARD_DIR / f"{user_id}.jsonl"
+
+def _parse_users_index(path):
+    """Parse the users index and build the email lookup."""
+    index = {"users": []}
+    if path.exists():
+        with open(path, 'r') as f:
+            index.update(json.load(f))
+    users_by_email = {}
+    for user in index["users"]:
+        users_by_email.setdefault(user.get("email"), user)
+    return {"index": index, "users_by_email": users_by_email}
+
+def _parse_shard(path):
+    """Parse the records of one footprint shard, keeping the latest revision of each."""
+    records, positions = [], {}
+    if not path.exists():
+        return records
+    with open(path, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable record in {path.name} at line {line_no}")
+                continue
+            position = positions.get(record.get("id"))
+            if position is None:
+                positions[record.get("id")] = len(records)
+                records.append(record)
+            elif (record.get("revision") or 0) > (records[position].get("revision") or 0):
+                records[position] = record
+    return records
+
+def _parse_shard_index(path):
+    """Parse a footprint shard into a sorted per-user index."""
+    return _index_footprints(_parse_shard(path))
+
+def _read_users_index():
+    """Return the parsed users index of the sharded layout."""
+    return _cached_read(USERS_INDEX_FILE, _parse_users_index)
+
+def _write_users_index(index):
+    """Write the users index of the sharded layout."""
+    _atomic_write(USERS_INDEX_FILE, json.dumps(index, separators=(',', ':')).encode())
+
+def _append_lines(path, records):
+    """Append records to a JSONL file in one write."""
+    with storage_lock(), open(path, 'a') as f:
+        f.write("".join(json.dumps(record, separators=(',', ':')) + "\n" for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+def _append_shard(user_id, records):
+    """Append footprints to their user's shard in one write."""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    _append_lines(_shard_file(user_id), records)
+
+def _load_sharded_data():
+    """Assemble the full dataset from the users index and every shard."""
+    index = _read_users_index()["index"]
+    footprints = []
+    if SHARD_DIR.exists():
+        for path in sorted(SHARD_DIR.glob("*.jsonl")):
+            footprints.extend(_cached_read(path, _parse_shard_index)["records"])
+    return {"users": list(index["users"]), "carbon_footprints": footprints}
+
+def convert_to_sharded():
+    """One-shot conversion of carbon_data.json (plus journal) to the sharded layout.
+
+    The original data file is left untouched so the conversion can be
+    re-run or rolled back by switching STORAGE_LAYOUT back to 'single'.
+    """
+    with storage_lock():
+        _convert_to_sharded()
+
+def _convert_to_sharded():
+    data = _read_data()
+    if SHARD_DIR.exists() and any(SHARD_DIR.glob("*.jsonl")):
+        raise ValueError(f"Shard directory {SHARD_DIR} is not empty")
+
+    by_user = {}
+    for footprint in data["carbon_footprints"]:
+        by_user.setdefault(footprint.get("user_id"), []).append(footprint)
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    for user_id, footprints in by_user.items():
+        payload = "".join(json.dumps(fp, separators=(',', ':')) + "\n" for fp in footprints)
+        _atomic_write(_shard_file(user_id), payload.encode())
+
+    _write_users_index({"users": data["users"]})
+    print(f"Converted {len(data['users'])} users and {len(data['carbon_footprints'])} footprints "
+          f"into {len(by_user)} shards under {SHARD_DIR}")
+
+# Emission details encoding
+def _parse_schemas(path):
+    """Parse the schema list and index it by layout."""
+    layouts = []
+    if path.exists():
+        with open(path, 'r') as f:
+            layouts = [tuple(tuple(key) for key in layout) for layout in json.load(f)]
+    return {"layouts": layouts, "ids": {layout: i for i, layout in enumerate(layouts)}}
+
+def _read_schemas():
+    """Return the registered emission_details key layouts."""
+    return _cached_read(SCHEMA_FILE, _parse_schemas)
+
+def _schema_id(layout):
+    """Return the id of a key layout, registering it on first use."""
+    schema_id = _read_schemas()["ids"].get(layout)
+    if schema_id is not None:
+        return schema_id
+    with storage_lock():
+        schemas = _read_schemas()
+        if layout in schemas["ids"]:
+            return schemas["ids"][layout]
+        layouts = schemas["layouts"] + [layout]
+        _atomic_write(SCHEMA_FILE, json.dumps([list(map(list, l)) for l in layouts]).encode())
+        return len(layouts) - 1
+
+def encode_emission_details(details):
+    """Convert emission_details to the configured storage encoding."""
+    if EMISSION_ENCODING != "columnar":
+        return details
+    layout = emission_codec.layout_of(details)
+    if not layout:
+        return details
+    return emission_codec.encode(details, _schema_id(layout), EMISSION_FLOAT32)
+
+def decode_footprint(record):
+    """Return a footprint with its emission_details in nested dict form."""
+    details = record.get("emission_details")
+    if not emission_codec.is_encoded(details):
+        return record
+    return {**record, "emission_details": emission_codec.decode(details, _read_schemas()["layouts"])}
 
 # User operations
 def get_user_by_email(email):
     """Get a user by email."""
-    data = load_data()
-    for user in data["users"]:
-        if user["email"] == email:
-            return user
-    return None
+    if STORAGE_LAYOUT == "sharded":
+        return _read_users_index()["users_by_email"].get(email)
+    return _get_cache()["users_by_email"].get(email)
 
 def create_user(email, password):
     """Create a new user."""
-    data = load_data()
-    
-    # Check if user already exists
-    if get_user_by_email(email):
-        raise ValueError("User with this email already exists")
-    
-    # Create new user
-    user_id = len(data["users"]) + 1
-    new_user = {
-        "id": user_id,
-        "email": email,
-        "password": password,  # In a real app, this should be hashed
-        "created_at": datetime.utcnow().timestamp()
-    }
-    
-    data["users"].append(new_user)
-    save_data(data)
-    return new_user
+    if STORAGE_LAYOUT == "sharded":
+        return _create_user_sharded(email, password)
+
+    # The uniqueness check and the insert must not interleave with another writer
+    with storage_lock():
+        data = load_data()
+
+        # Check if user already exists
+        if get_user_by_email(email):
+            raise ValueError("User with this email already exists")
+
+        # Create new user
+        new_user = {
+            "id": next_id("users"),
+            "email": email,
+            "password": password,  # In a real app, this should be hashed
+            "created_at": datetime.utcnow().timestamp()
+        }
+
+        if STORAGE_JOURNAL:
+            append_journal("users", new_user)
+        else:
+            data["users"].append(new_user)
+            save_data(data)
+        return new_user
+
+def _create_user_sharded(email, password):
+    """Create a new user in the sharded layout's users index."""
+    with storage_lock():
+        index = dict(_read_users_index()["index"])
+        if get_user_by_email(email):
+            raise ValueError("User with this email already exists")
+
+        new_user = {
+            "id": next_id("users"),
+            "email": email,
+            "password": password,  # In a real app, this should be hashed
+            "created_at": datetime.utcnow().timestamp()
+        }
+        index["users"] = index["users"] + [new_user]
+        _write_users_index(index)
+        return new_user
 
 def verify_user(email, password):
     """Verify user credentials."""
@@ -134,55 +800,706 @@ def verify_user(email, password):
     return None
 
 # Carbon footprint operations
-def save_carbon_footprint(user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions, emission_details):
-    """Save a new carbon footprint record."""
+def save_carbon_footprint(user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions, emission_details,
+                          inputs=None, factor_set_version=None, input_hash=None, formula_version=None):
+    """Save a new carbon footprint record.
+
+    inputs (the calculator values that differ from their defaults),
+    factor_set_version and formula_version record how the footprint was
+    calculated, and input_hash identifies them (emissions_engine.input_hash).
+    """
+    return save_carbon_footprints(user_id, [{
+        "scope1_emissions": scope1_emissions,
+        "scope2_emissions": scope2_emissions,
+        "scope3_emissions": scope3_emissions,
+        "total_emissions": total_emissions,
+        "emission_details": emission_details,
+        "inputs": inputs,
+        "factor_set_version": factor_set_version,
+        "input_hash": input_hash,
+        "formula_version": formula_version
+    }])[0]
+
+def save_carbon_footprints(user_id, footprints):
+    """Save many footprints of a user in one write and return the saved records.
+
+    footprints are dicts with the scope totals and emission_details, and
+    optionally inputs, factor_set_version, formula_version and input_hash;
+    they all get the same created_at and consecutive ids. With
+    FOOTPRINT_DEDUPE, those with the input_hash of an earlier footprint are
+    stored as references to it.
+    """
+    if not footprints:
+        return []
     try:
         # Ensure data directory exists
         os.makedirs(DATA_DIR, exist_ok=True)
-        
-        # Initialize data file if it doesn't exist
-        if not DATA_FILE.exists():
-            with open(DATA_FILE, 'w') as f:
-                json.dump({"users": [], "carbon_footprints": []}, f)
-        
-        # Load existing data
-        data = load_data()
-        
-        # Create new record
-        new_record = {
-            "id": len(data["carbon_footprints"]) + 1,
-            "user_id": user_id,
-            "created_at": datetime.utcnow().timestamp(),
-            "scope1_emissions": scope1_emissions,
-            "scope2_emissions": scope2_emissions,
-            "scope3_emissions": scope3_emissions,
-            "total_emissions": total_emissions,
-            "emission_details": emission_details
-        }
-        
-        # Add new record and save
-        data["carbon_footprints"].append(new_record)
-        save_data(data)
-        return new_record
+        if STORAGE_LAYOUT != "sharded":
+            _ensure_data_file()
+
+        created_at = datetime.utcnow().timestamp()
+        reference_ids = dedupe.reference_ids(footprints, lambda hashes: _find_by_hash(user_id, hashes))
+        new_records, saved = [], []
+        for footprint, reference_id in zip(footprints, reference_ids):
+            stored = dedupe.stored_form(footprint, reference_id)
+            new_record = {
+                "id": None,
+                "user_id": user_id,
+                "created_at": created_at,
+                "scope1_emissions": footprint["scope1_emissions"],
+                "scope2_emissions": footprint["scope2_emissions"],
+                "scope3_emissions": footprint["scope3_emissions"],
+                "total_emissions": footprint["total_emissions"],
+                "emission_details": encode_emission_details(stored["emission_details"])
+            }
+            # Only stored when known, so older records keep their shape
+            for field in ("inputs", "factor_set_version", "formula_version", "input_hash", "reference_id"):
+                if stored.get(field) is not None:
+                    new_record[field] = stored[field]
+            new_records.append(new_record)
+            complete = {**new_record, "emission_details": footprint["emission_details"]}
+            if reference_id is not None:
+                complete["inputs"] = footprint.get("inputs")
+            saved.append(complete)
+
+        # Add the new records and save. The ids are taken under the same lock,
+        # so footprints are stored in id order (see utils/parquet_mirror.py)
+        with storage_lock():
+            for record_id, new_record, complete in zip(next_ids("carbon_footprints", len(saved)), new_records, saved):
+                new_record["id"] = complete["id"] = record_id
+            _index_dependencies(saved)
+            if STORAGE_LAYOUT == "sharded":
+                _append_shard(user_id, new_records)
+            elif STORAGE_JOURNAL:
+                append_journal_records("carbon_footprints", new_records)
+            else:
+                data = load_data()
+                data["carbon_footprints"].extend(new_records)
+                save_data(data)
+            _update_rollups(user_id, saved)
+        return saved
     except Exception as e:
-        print(f"Error in save_carbon_footprint: {str(e)}")
+        print(f"Error in save_carbon_footprints: {str(e)}")
         raise
 
-def get_user_footprints(user_id):
-    """Get all carbon footprints for a user."""
+def get_user_footprints(user_id, since=None, until=None, limit=None, order="desc", cursor=None):
+    """Get carbon footprints for a user, newest first by default.
+
+    since/until (datetime or timestamp) bound created_at inclusively, limit
+    caps the page size, and cursor (from pagination.encode_cursor on the last
+    footprint of the previous page) continues after that footprint.
+    """
+    # Validate arguments before the error handler below can swallow them
+    pagination.check_order(order)
+    if cursor is not None:
+        pagination.decode_cursor(cursor)
     try:
-        # Ensure data directory and file exist
-        os.makedirs(DATA_DIR, exist_ok=True)
-        if not DATA_FILE.exists():
-            with open(DATA_FILE, 'w') as f:
-                json.dump({"users": [], "carbon_footprints": []}, f)
-        
-        # Load data and filter by user_id
-        data = load_data()
-        if not isinstance(data, dict) or "carbon_footprints" not in data:
-            return []
-            
-        return [f for f in data["carbon_footprints"] if f.get("user_id") == user_id]
+        if STORAGE_LAYOUT == "sharded":
+            index = _cached_read(_shard_file(user_id), _parse_shard_index)
+        else:
+            # Look up the user's footprints in the cached index
+            index = _get_cache()["footprints_by_user"].get(user_id, {"records": [], "keys": []})
+
+        page = pagination.paginate_sorted(
+            index["records"], index["keys"], since, until, limit, order, cursor
+        )
+        page = _with_archived(user_id, page, since, until, limit, order, cursor)
+        return _resolve([decode_footprint(f) for f in page])
     except Exception as e:
         print(f"Error in get_user_footprints: {str(e)}")
         return []
+
+# Revisions
+def _hot_footprints(user_id):
+    """A user's footprint records as stored, without the archived ones."""
+    if STORAGE_LAYOUT == "sharded":
+        return _cached_read(_shard_file(user_id), _parse_shard_index)["records"]
+    return _get_cache()["footprints_by_user"].get(user_id, {"records": []})["records"]
+
+# Deduplication
+_by_user = OrderedDict()  # user_id -> lookup entry, least recently used first
+_by_user_lock = threading.Lock()
+_BY_USER_LIMIT = 256
+
+def _preferred(record, current):
+    # The latest footprint with a hash, preferring ones stored in full
+    return current is None or (
+        (record.get("reference_id") is None, pagination.sort_key(record))
+        >= (current.get("reference_id") is None, pagination.sort_key(current))
+    )
+
+def _index_records(entry, records):
+    for record in records:
+        entry["by_id"][record.get("id")] = record
+        input_hash = record.get("input_hash")
+        if input_hash and _preferred(record, entry["by_hash"].get(input_hash)):
+            entry["by_hash"][input_hash] = record
+
+def _new_lookup():
+    return {"count": 0, "last": None, "build": None, "file": None, "offset": 0, "by_id": {}, "by_hash": {}}
+
+def _extend_from_shard(user_id, entry):
+    """Index the lines appended to a user's shard since the entry last read it."""
+    path = _shard_file(user_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return _new_lookup()
+    # Archiving and conversion replace the file: read it again from the start
+    if entry["file"] != (stat.st_dev, stat.st_ino) or stat.st_size < entry["offset"]:
+        entry = _new_lookup()
+        entry["file"] = (stat.st_dev, stat.st_ino)
+    if stat.st_size > entry["offset"]:
+        with open(path, 'rb') as f:
+            f.seek(entry["offset"])
+            tail = f.read(stat.st_size - entry["offset"])
+        # Only whole lines; a write still in progress is read next time
+        end = tail.rfind(b"\n") + 1
+        records = []
+        for line in tail[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        # Revisions come later in the file, so they replace what they revise
+        _index_records(entry, records)
+        entry["offset"] += end
+    return entry
+
+def _extend_from_cache(user_id, entry):
+    """Index the records added to a user's sorted records in the cache since the entry last saw them.
+
+    The entry only extends the cache it was built from. A re-parse, after
+    another process saved or revised footprints, starts it over: a revision
+    keeps the count and the last key of the records it replaces.
+    """
+    cache = _get_cache()
+    records = cache["footprints_by_user"].get(user_id, {"records": []})["records"]
+    if entry["build"] != cache["build"] or len(records) < entry["count"] or (
+            entry["count"] and pagination.sort_key(records[entry["count"] - 1]) != entry["last"]):
+        entry = _new_lookup()
+        entry["build"] = cache["build"]
+    if len(records) > entry["count"]:
+        _index_records(entry, records[entry["count"]:])
+        entry["count"], entry["last"] = len(records), pagination.sort_key(records[-1])
+    return entry
+
+def _user_lookup(user_id):
+    """A user's hot footprints by id and by input_hash.
+
+    Built once per user and then only extended with the footprints saved
+    since: from the bytes appended to the user's shard, or from the records
+    past the last one it indexed in the cached sorted records. Only a
+    rewritten shard, a re-parsed cache, or a record inserted out of order or
+    archived makes it start over.
+    """
+    with _by_user_lock:
+        entry = _by_user.get(user_id) or _new_lookup()
+        if STORAGE_LAYOUT == "sharded":
+            entry = _extend_from_shard(user_id, entry)
+        else:
+            entry = _extend_from_cache(user_id, entry)
+        _by_user[user_id] = entry
+        _by_user.move_to_end(user_id)
+        while len(_by_user) > _BY_USER_LIMIT:
+            _by_user.popitem(last=False)
+        return entry
+
+def _index_revised(user_id, records):
+    """Update the lookup entry of a user with revisions written to the cached records in place."""
+    with _by_user_lock:
+        entry = _by_user.get(user_id)
+        if entry is not None:
+            _index_records(entry, records)
+
+def _find_by_hash(user_id, hashes):
+    by_hash = _user_lookup(user_id)["by_hash"]
+    found = {h: by_hash[h] for h in hashes if h in by_hash}
+    missing = {h for h in hashes if h not in found}
+    if missing:
+        # Only segments listing the hash prefix are opened, oldest first so later ones win
+        manifest = _read_manifest()
+        for segment in sorted(manifest["by_user"].get(user_id, []), key=lambda s: s["max_created_at"]):
+            prefixes = manifest["hash_prefixes"][segment["file"]]
+            if not any(h[:archive.HASH_PREFIX_LENGTH] in prefixes for h in missing):
+                continue
+            for record in _segment_index(segment)["records"]:
+                input_hash = record.get("input_hash")
+                if input_hash in missing and _preferred(record, found.get(input_hash)):
+                    found[input_hash] = record
+    return found
+
+def _lookup(user_id, ids):
+    by_id = _user_lookup(user_id)["by_id"]
+    found = {i: by_id[i] for i in ids if i in by_id}
+    missing = {i for i in ids if i not in found}
+    if missing:
+        # Hot records win: a crash during archiving can leave a record in both
+        for segment in _read_manifest()["by_user"].get(user_id, []):
+            if any(segment["min_id"] <= i <= segment["max_id"] for i in missing):
+                for record in _segment_index(segment)["records"]:
+                    if record.get("id") in missing and record.get("id") not in found:
+                        found[record["id"]] = record
+    return {i: decode_footprint(record) for i, record in found.items()}
+
+def _resolve(footprints):
+    """Resolve the references among decoded footprints (see utils/dedupe.py)."""
+    return dedupe.resolve(footprints, _lookup, get_footprint_revisions)
+
+def revise_footprints(revisions):
+    """Replace footprints with recalculated revisions and return the revised records.
+
+    revisions carry the id, user_id and current revision of the footprint
+    they revise and its new totals, emission_details, inputs,
+    factor_set_version and formula_version (see
+    StorageBackend.revise_footprints). Footprints that are archived, missing
+    or already revised further are skipped.
+    """
+    if not revisions:
+        return []
+    try:
+        superseded_at = datetime.utcnow().timestamp()
+        by_user = {}
+        for revision in revisions:
+            by_user.setdefault(revision["user_id"], []).append(revision)
+
+        with storage_lock():
+            new_records, history, revised, changes = [], [], [], {}
+            for user_id, user_revisions in by_user.items():
+                current = {f.get("id"): f for f in _hot_footprints(user_id)}
+                for revision in user_revisions:
+                    old = current.get(revision["id"])
+                    number = revision.get("revision", 0)
+                    if old is None or (old.get("revision") or 0) != number:
+                        continue
+                    new_record = {
+                        "id": old["id"],
+                        "user_id": old["user_id"],
+                        "created_at": old["created_at"],
+                        "scope1_emissions": revision["scope1_emissions"],
+                        "scope2_emissions": revision["scope2_emissions"],
+                        "scope3_emissions": revision["scope3_emissions"],
+                        "total_emissions": revision["total_emissions"],
+                        "emission_details": encode_emission_details(revision["emission_details"])
+                    }
+                    for field in ("inputs", "factor_set_version", "formula_version", "input_hash"):
+                        if revision.get(field) is not None:
+                            new_record[field] = revision[field]
+                    new_record["revision"] = number + 1
+                    new_records.append(new_record)
+                    history.append({
+                        "footprint_id": old["id"],
+                        **{key: value for key, value in old.items() if key != "id"},
+                        "revision": number,
+                        "superseded_at": superseded_at
+                    })
+                    new = {**new_record, "emission_details": revision["emission_details"]}
+                    revised.append(new)
+                    changes.setdefault(user_id, ([], []))
+                    changes[user_id][0].append(new)
+                    changes[user_id][1].append(_resolve([decode_footprint(old)])[0])
+            if not new_records:
+                return []
+
+            # History first: a crash before the new revisions land only
+            # leaves a duplicate history entry, which readers drop, and an
+            # index entry for a revision that revise_footprints() skips
+            _append_lines(REVISIONS_FILE, history)
+            _index_dependencies(revised)
+            if STORAGE_LAYOUT == "sharded":
+                for user_id in changes:
+                    _append_shard(user_id, [r for r in new_records if r["user_id"] == user_id])
+            elif STORAGE_JOURNAL:
+                append_journal_records("carbon_footprints", new_records, replaces=True)
+            else:
+                data = load_data()
+                positions = {f.get("id"): i for i, f in enumerate(data["carbon_footprints"])}
+                for record in new_records:
+                    data["carbon_footprints"][positions[record["id"]]] = record
+                save_data(data)
+            for user_id, (footprints, replaced) in changes.items():
+                _update_rollups(user_id, footprints, replaced)
+                if STORAGE_LAYOUT != "sharded":
+                    _index_revised(user_id, [r for r in new_records if r["user_id"] == user_id])
+        return revised
+    except Exception as e:
+        print(f"Error in revise_footprints: {str(e)}")
+        raise
+
+def _parse_revisions(path):
+    """Parse the revision history into {footprint_id: [revisions, oldest first]}."""
+    by_footprint = {}
+    if path.exists():
+        with open(path, 'r') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable revision in {path.name} at line {line_no}")
+                    continue
+                by_footprint.setdefault(record.get("footprint_id"), {})[record.get("revision")] = record
+    return {
+        footprint_id: [revisions[number] for number in sorted(revisions)]
+        for footprint_id, revisions in by_footprint.items()
+    }
+
+def get_footprint_revisions(footprint_id):
+    """Previous revisions of a footprint, oldest first, decoded."""
+    revisions = _cached_read(REVISIONS_FILE, _parse_revisions).get(footprint_id, [])
+    return _resolve([
+        {"inputs": None, "factor_set_version": None, "formula_version": None, "input_hash": None, **decode_footprint(r)}
+        for r in revisions
+    ])
+
+# Dependency index
+def _parse_dependencies(path):
+    """Parse the dependency index into {footprint_id: entry}, keeping the latest revision of each."""
+    entries = {}
+    with open(path, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable entry in {path.name} at line {line_no}")
+                continue
+            previous = entries.get(entry["id"])
+            if previous is None or entry["revision"] >= previous["revision"]:
+                entries[entry["id"]] = entry
+    return entries
+
+def rebuild_dependencies():
+    """Rewrite the dependency index from the hot footprints, e.g. for data saved before it existed.
+
+    Archived footprints are left out: revise_footprints skips them, so
+    recalculation must not count them as stale.
+    """
+    with storage_lock():
+        payload = "".join(
+            json.dumps(recalculation.dependency_entry(footprint), separators=(',', ':')) + "\n"
+            for footprint in _iter_hot_footprints()
+        )
+        _atomic_write(DEPENDENCIES_FILE, payload.encode())
+
+def _drop_dependencies(ids):
+    """Rewrite the dependency index without the entries of ids, e.g. footprints just archived."""
+    with storage_lock():
+        if not DEPENDENCIES_FILE.exists():
+            return
+        entries = [entry for entry in _parse_dependencies(DEPENDENCIES_FILE).values() if entry["id"] not in ids]
+        payload = "".join(json.dumps(entry, separators=(',', ':')) + "\n" for entry in entries)
+        _atomic_write(DEPENDENCIES_FILE, payload.encode())
+
+def _index_dependencies(footprints):
+    """Append saved or revised footprints (decoded, complete) to the dependency index."""
+    with storage_lock():
+        if not DEPENDENCIES_FILE.exists():
+            rebuild_dependencies()
+        _append_lines(DEPENDENCIES_FILE, [recalculation.dependency_entry(f) for f in footprints])
+
+def _dependencies():
+    """The parsed dependency index, built first if it is missing."""
+    if not DEPENDENCIES_FILE.exists():
+        rebuild_dependencies()
+    return _cached_read(DEPENDENCIES_FILE, _parse_dependencies)
+
+def count_footprints_by_version():
+    """{(factor_set_version, formula_version): (footprints, footprints without inputs)}, from the dependency index."""
+    counts = {}
+    for entry in _dependencies().values():
+        key = (entry["factor_set_version"], entry["formula_version"])
+        count, without_inputs = counts.get(key, (0, 0))
+        counts[key] = (count + 1, without_inputs + (entry["inputs"] is None))
+    return counts
+
+def iter_dependent_footprints(factor_set_version, formula_version, factor_ids=None):
+    """Yield the footprints of these versions depending on any of factor_ids (any when None).
+
+    Answered from the dependency index alone; see
+    StorageBackend.iter_dependent_footprints for the fields.
+    """
+    for entry in _dependencies().values():
+        if (entry["factor_set_version"], entry["formula_version"]) != (factor_set_version, formula_version):
+            continue
+        if entry["factor_ids"] is None:
+            continue
+        matched = entry["factor_ids"] if factor_ids is None else [i for i in entry["factor_ids"] if i in factor_ids]
+        if matched:
+            yield {**{key: entry[key] for key in ("id", "user_id", "revision", "inputs")}, "factor_ids": matched}
+
+# Archive tier
+def _parse_manifest(path):
+    """Parse the archive manifest and group its segments by user."""
+    segments = []
+    if path.exists():
+        with open(path, 'r') as f:
+            segments = json.load(f)["segments"]
+    by_user = {}
+    for segment in segments:
+        by_user.setdefault(segment["user_id"], []).append(segment)
+    # Segments archived before hashes were listed are never searched by hash
+    hash_prefixes = {segment["file"]: frozenset(segment.get("hash_prefixes", ())) for segment in segments}
+    return {"segments": segments, "by_user": by_user, "hash_prefixes": hash_prefixes}
+
+def _read_manifest():
+    """Return the parsed archive manifest."""
+    return _cached_read(ARCHIVE_MANIFEST, _parse_manifest)
+
+def _parse_segment(path):
+    """Decompress an archive segment into a sorted footprint index."""
+    compression = "zstd" if path.name.endswith(archive.COMPRESSIONS["zstd"]) else "gzip"
+    with open(path, 'rb') as f:
+        return _index_footprints(archive.decode_segment(f.read(), compression))
+
+def _segment_index(segment):
+    """Return the sorted footprints of a manifest segment, decompressed again on every call."""
+    return _parse_segment(ARCHIVE_DIR / segment["file"])
+
+def iter_archived_footprints(user_id=None):
+    """Yield archived footprints as stored, for one user or all of them."""
+    manifest = _read_manifest()
+    segments = manifest["segments"] if user_id is None else manifest["by_user"].get(user_id, [])
+    for segment in segments:
+        yield from _segment_index(segment)["records"]
+
+def _with_archived(user_id, page, since, until, limit, order, cursor):
+    """Merge archived footprints into a page of hot ones.
+
+    Segments are skipped from their manifest entry whenever their
+    created_at range lies outside since/until, before the cursor, or behind
+    a page that is already full, so recent pages never decompress anything.
+    """
+    segments = _read_manifest()["by_user"].get(user_id)
+    if not segments:
+        return page
+    since, until = pagination.to_timestamp(since), pagination.to_timestamp(until)
+    after = pagination.decode_cursor(cursor)[0] if cursor is not None else None
+    desc = order == "desc"
+    candidates = [
+        s for s in segments
+        if (since is None or s["max_created_at"] >= since)
+        and (until is None or s["min_created_at"] <= until)
+        and (after is None or (s["min_created_at"] <= after if desc else s["max_created_at"] >= after))
+    ]
+    candidates.sort(key=lambda s: s["max_created_at"] if desc else s["min_created_at"], reverse=desc)
+    for segment in candidates:
+        if limit is not None and len(page) >= limit:
+            edge = pagination.sort_key(page[-1])[0]
+            if (segment["max_created_at"] < edge) if desc else (segment["min_created_at"] > edge):
+                break
+        index = _segment_index(segment)
+        extra = pagination.paginate_sorted(index["records"], index["keys"], since, until, limit, order, cursor)
+        # A crash during archiving can leave a record both hot and archived
+        seen = {f.get("id") for f in page}
+        page = sorted(page + [f for f in extra if f.get("id") not in seen], key=pagination.sort_key, reverse=desc)
+        if limit is not None:
+            page = page[:limit]
+    return page
+
+def _archive_old(footprints_by_key, older_than_days):
+    """Archive footprints older than the retention cutoff.
+
+    footprints_by_key maps any key (a shard path, or None for the data
+    file) to a list of footprints. Only whole months before the cutoff are
+    archived, so each user-month normally ends up in a single segment.
+    Segments and the manifest are written before anything is removed from
+    the hot files, and the archived footprints leave the dependency index,
+    as they can no longer be revised. Returns the same mapping with the
+    footprints to keep.
+    """
+    moment = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    cutoff = archive.month_start(moment)
+    compression = archive.available_compression(ARCHIVE_COMPRESSION)
+
+    kept, groups = {}, {}
+    for key, footprints in footprints_by_key.items():
+        kept[key] = []
+        for footprint in footprints:
+            if (footprint.get("created_at") or 0.0) < cutoff:
+                month = archive.month_of(footprint.get("created_at"))
+                groups.setdefault((footprint.get("user_id"), month), []).append(footprint)
+            else:
+                kept[key].append(footprint)
+    if not groups:
+        return footprints_by_key
+
+    manifest = _read_manifest()
+    segments = list(manifest["segments"])
+    for (user_id, month), records in sorted(groups.items(), key=lambda item: str(item[0])):
+        existing = [s for s in manifest["by_user"].get(user_id, []) if s["month"] == month]
+        # Records a previous, interrupted run archived already
+        archived_ids = {f.get("id") for s in existing for f in _segment_index(s)["records"]}
+        records = sorted((f for f in records if f.get("id") not in archived_ids), key=pagination.sort_key)
+        if not records:
+            continue
+        name = archive.segment_name(user_id, month, len(existing), compression)
+        os.makedirs((ARCHIVE_DIR / name).parent, exist_ok=True)
+        _atomic_write(ARCHIVE_DIR / name, archive.encode_segment(records, compression))
+        segments.append(archive.describe(user_id, month, name, compression, records))
+    _atomic_write(ARCHIVE_MANIFEST, json.dumps({"segments": segments}, indent=2).encode())
+    _drop_dependencies({f.get("id") for records in groups.values() for f in records})
+    return kept
+
+def archive_footprints(older_than_days=None):
+    """Apply the retention policy now. Returns the number of footprints archived."""
+    older_than_days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    if older_than_days <= 0:
+        raise ValueError("Set ARCHIVE_AFTER_DAYS or pass a positive number of days")
+    with storage_lock():
+        if STORAGE_LAYOUT == "sharded":
+            shards = {path: _parse_shard(path) for path in sorted(SHARD_DIR.glob("*.jsonl"))} if SHARD_DIR.exists() else {}
+            kept = _archive_old(shards, older_than_days)
+            moved = 0
+            for path, footprints in kept.items():
+                if len(footprints) != len(shards[path]):
+                    moved += len(shards[path]) - len(footprints)
+                    payload = "".join(json.dumps(fp, separators=(',', ':')) + "\n" for fp in footprints)
+                    _atomic_write(path, payload.encode())
+            return moved
+
+        data = load_data()
+        before = len(data["carbon_footprints"])
+        data["carbon_footprints"] = _archive_old({None: data["carbon_footprints"]}, older_than_days)[None]
+        moved = before - len(data["carbon_footprints"])
+        if moved:
+            save_data(data)
+        return moved
+
+# Rollups
+def _rollup_file(user_id):
+    """Path of the rollups of a user."""
+    return ROLLUP_DIR / f"{user_id}.json"
+
+def _parse_rollups(path):
+    """Parse a user's rollups ({period: {period_key: bucket}})."""
+    if not path.exists():
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _write_rollups(user_id, user_rollups):
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    _atomic_write(_rollup_file(user_id), json.dumps(user_rollups, separators=(',', ':')).encode())
+
+def _update_rollups(user_id, footprints, replaced=()):
+    """Add saved footprints (with decoded emission_details) to their user's rollups.
+
+    replaced footprints (previous revisions) are subtracted.
+    """
+    with storage_lock():
+        # Parsed afresh rather than from _file_cache, whose value readers share
+        user_rollups = _parse_rollups(_rollup_file(user_id))
+        _write_rollups(user_id, rollups.apply_many(user_rollups, footprints, replaced))
+
+def get_rollups(user_id, period="month"):
+    """Get a user's rollup buckets for 'month', 'quarter' or 'year', oldest first."""
+    return rollups.sorted_buckets(_cached_read(_rollup_file(user_id), _parse_rollups), period)
+
+def rebuild_rollups(user_id=None):
+    """Recompute rollups from the stored footprints, for one user or all of them.
+
+    Returns the number of users rebuilt.
+    """
+    with storage_lock():
+        by_user = {}
+        for footprint in load_data()["carbon_footprints"]:
+            if user_id is None or footprint.get("user_id") == user_id:
+                by_user.setdefault(footprint.get("user_id"), []).append(decode_footprint(footprint))
+        for footprint in iter_archived_footprints(user_id):
+            by_user.setdefault(footprint.get("user_id"), []).append(decode_footprint(footprint))
+        if user_id is not None:
+            by_user.setdefault(user_id, [])
+        for uid, footprints in by_user.items():
+            _write_rollups(uid, rollups.build(_resolve(footprints)))
+        if user_id is None and ROLLUP_DIR.exists():
+            # Drop rollups of users who no longer have any footprints
+            keep = {str(uid) for uid in by_user}
+            for path in ROLLUP_DIR.glob("*.json"):
+                if path.stem not in keep:
+                    path.unlink()
+        return sum(1 for footprints in by_user.values() if footprints)
+
+def _iter_hot_footprints(after_id=0):
+    """Yield the footprints not archived yet, decoded."""
+    for footprint in load_data()["carbon_footprints"]:
+        if (footprint.get("id") or 0) > after_id:
+            yield _resolve([decode_footprint(footprint)])[0]
+
+def iter_footprints(after_id=None):
+    """Yield every footprint of every user, archived ones included, decoded.
+
+    With after_id, only footprints with a larger id.
+    """
+    if after_id is None:
+        after_id = 0
+    yield from _iter_hot_footprints(after_id)
+    for segment in _read_manifest()["segments"]:
+        if segment["max_id"] > after_id:
+            for footprint in _segment_index(segment)["records"]:
+                if (footprint.get("id") or 0) > after_id:
+                    yield _resolve([decode_footprint(footprint)])[0]
+
+def data_version():
+    """Signature that changes whenever stored footprints change."""
+    if STORAGE_LAYOUT == "sharded":
+        shards = tuple(
+            (path.name, _file_key(path)) for path in sorted(SHARD_DIR.glob("*.jsonl"))
+        ) if SHARD_DIR.exists() else ()
+        return (shards, _file_key(ARCHIVE_MANIFEST))
+    return (_storage_key(), _file_key(ARCHIVE_MANIFEST))
+
+
+def convert_file(source=None, target=None, fmt=STORAGE_FORMAT, pretty=False):
+    """Rewrite a data file in another serialization format.
+
+    Converting the current data in place (no source, or carbon_data.json,
+    and no target) publishes it, journal included, as a new generation.
+    """
+    with storage_lock():
+        snapshot = _generation_files(current_generation())[0]
+        if target is None and (source is None or (snapshot.exists() and os.path.samefile(source, snapshot))):
+            generation = _publish(serialization.dumps(_read_data(), fmt, pretty=pretty))
+            print(f"Published generation {generation} as {fmt}")
+            return
+        source = Path(source)
+        target = Path(target) if target else source
+        data = serialization.read_file(source)
+        _atomic_write(target, serialization.dumps(data, fmt, pretty=pretty))
+    print(f"Wrote {target} as {fmt}")
+
+def main():
+    """Command line entry point for storage maintenance tasks."""
+    parser = argparse.ArgumentParser(description="Terrametrics JSON storage maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("compact", help="Fold the journal into carbon_data.json")
+    subparsers.add_parser("shard", help="Convert carbon_data.json to the per-user sharded layout")
+    convert = subparsers.add_parser("convert", help="Convert a data file between serialization formats")
+    convert.add_argument("source", nargs="?", help="Default: the current data, converted in place")
+    convert.add_argument("target", nargs="?", help="Output path (default: convert in place)")
+    convert.add_argument("--format", choices=serialization.FORMATS, default="json")
+    convert.add_argument("--pretty", action="store_true", help="Indent JSON output")
+    archive_cmd = subparsers.add_parser("archive", help="Move old footprints to compressed archive segments")
+    archive_cmd.add_argument("--older-than-days", type=int, help="Default: ARCHIVE_AFTER_DAYS")
+    bench = subparsers.add_parser("benchmark", help="Time load/save of a data file in each format")
+    bench.add_argument("source", nargs="?", default=str(DATA_FILE))
+    bench.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact_journal()
+    elif args.command == "shard":
+        convert_to_sharded()
+    elif args.command == "convert":
+        convert_file(args.source, args.target, args.format, args.pretty)
+    elif args.command == "archive":
+        print(f"Archived {archive_footprints(args.older_than_days)} footprints")
+    elif args.command == "benchmark":
+        serialization.benchmark(args.source, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Time-range and cursor pagination for footprint queries.
+
+Footprints are ordered by (created_at, id). A cursor is the position of the
+last footprint of a page; passing it back returns the footprints after it
+in the requested order, so pages stay stable while new footprints arrive.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+ORDERS = ("asc", "desc")
+
+
+def to_timestamp(value):
+    """Accept a datetime or a UNIX timestamp and return a timestamp (or None)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def sort_key(footprint):
+    """Position of a footprint in (created_at, id) order."""
+    return (footprint.get("created_at") or 0.0, footprint.get("id") or 0)
+
+
+def encode_cursor(footprint):
+    """Cursor pointing just past footprint."""
+    created_at, footprint_id = sort_key(footprint)
+    return f"{created_at!r}:{footprint_id}"
+
+
+def decode_cursor(cursor):
+    """Parse a cursor back into a (created_at, id) key."""
+    try:
+        created_at, footprint_id = cursor.rsplit(":", 1)
+        return (float(created_at), int(footprint_id))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def check_order(order):
+    if order not in ORDERS:
+        raise ValueError(f"order must be one of {ORDERS}, got {order!r}")
+
+
+def paginate_sorted(records, keys, since=None, until=None, limit=None, order="desc", cursor=None):
+    """Select a page from records sorted by (created_at, id).
+
+    keys is the parallel list of sort_key() values, searched with bisect so
+    the cost depends on the page size, not on how many records there are.
+    since and until are inclusive bounds on created_at.
+    """
+    check_order(order)
+    since, until = to_timestamp(since), to_timestamp(until)
+    lo = 0 if since is None else bisect_left(keys, (since, float("-inf")))
+    hi = len(keys) if until is None else bisect_right(keys, (until, float("inf")))
+    if cursor is not None:
+        position = decode_cursor(cursor)
+        if order == "desc":
+            hi = min(hi, bisect_left(keys, position))
+        else:
+            lo = max(lo, bisect_right(keys, position))
+    if hi <= lo:
+        return []
+    if order == "desc":
+        start = lo if limit is None else max(lo, hi - limit)
+        return records[start:hi][::-1]
+    end = hi if limit is None else min(hi, lo + limit)
+    return records[lo:end]
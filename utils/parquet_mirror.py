@@ -0,0 +1,269 @@
+"""
+Parquet analytics mirror of the footprint store.
+
+The mirror is a Hive-partitioned Parquet dataset with one file per month:
+
+    PARQUET_MIRROR_DIR/year=2025/month=3/part-0.parquet
+
+Each row is one footprint with the columns of utils/footprint_query.py
+(id, user_id, created_at, date, scope totals and '<scope>__<category>'
+columns), sorted by id. Analysts scan it with pyarrow without touching
+the operational storage; read_dataset() returns it as a pyarrow dataset
+with the partition schemas unified.
+
+sync() adds the footprints saved since the last sync, rewriting only the
+months they fall in. Ids are not committed in id order (a SQL transaction
+can commit after a later one), so the state keeps a watermark below which
+every footprint is mirrored and the ids mirrored above it; each sync
+rescans from the watermark. An id missing below mirrored ones is waited
+for COMMIT_GRACE seconds, then taken for a save that failed. With PARQUET_MIRROR enabled the storage layer runs it
+after a save once PARQUET_MIRROR_BATCH footprints are pending; otherwise
+run it from a periodic job:
+
+    python -m utils.parquet_mirror sync
+    python -m utils.parquet_mirror rebuild
+
+Revised footprints (utils/recalculation.py) keep their id; after_revise()
+rewrites the ones already mirrored in place.
+
+rebuild() recreates the whole mirror from storage. The files only depend
+on the stored footprints, so a rebuild of unchanged data gives the same
+dataset. Requires pyarrow.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+import pandas as pd
+
+from config.settings import PARQUET_MIRROR_DIR, PARQUET_MIRROR_BATCH
+from utils import footprint_query
+
+STATE_FILE = "_mirror_state.json"  # pyarrow skips files starting with '_'
+LOCK_FILE = ".mirror.lock"
+PART_FILE = "part-0.parquet"
+CHUNK_SIZE = 50000
+COMMIT_GRACE = 600  # seconds a missing id may still be committed
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The Parquet mirror requires the pyarrow package")
+    return pyarrow
+
+
+@contextmanager
+def _mirror_lock(root, blocking=True):
+    """Hold the mirror's lock; yields False if blocking is off and it is taken."""
+    os.makedirs(root, exist_ok=True)
+    fd = os.open(Path(root) / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def read_state(root=PARQUET_MIRROR_DIR):
+    """Return the mirror's state.
+
+    watermark is the id up to which every footprint is mirrored, and
+    mirrored maps the ids mirrored above it to their created_at.
+    """
+    path = Path(root) / STATE_FILE
+    if not path.exists():
+        return {"watermark": 0, "mirrored": {}}
+    with open(path, "r") as f:
+        state = json.load(f)
+    state.setdefault("mirrored", {})
+    return state
+
+
+def _write_state(root, state):
+    path = Path(root) / STATE_FILE
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _partition_file(root, year, month):
+    return Path(root) / f"year={year}" / f"month={month}" / PART_FILE
+
+
+def _ordered(frame):
+    """Sort rows by id and columns canonically, so files do not depend on write order."""
+    details = sorted(c for c in frame.columns if footprint_query.DETAIL_SEPARATOR in c)
+    columns = footprint_query.KEY_COLUMNS + ["date"] + footprint_query.SCOPE_COLUMNS + details
+    return frame.sort_values("id", kind="stable")[columns].reset_index(drop=True)
+
+
+def _write_partitions(root, frame):
+    """Merge rows into their month files, replacing each file atomically."""
+    pa = _pyarrow()
+    for (year, month), rows in frame.groupby(["year", "month"], sort=True):
+        path = _partition_file(root, year, month)
+        rows = rows.drop(columns=["year", "month"])
+        if path.exists():
+            existing = pa.parquet.read_table(path).to_pandas()
+            rows = pd.concat([existing, rows], ignore_index=True)
+            # A sync interrupted before saving its watermark is simply redone
+            rows = rows.drop_duplicates("id", keep="last")
+        table = pa.Table.from_pandas(_ordered(rows), preserve_index=False)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".part-", suffix=".tmp")
+        os.close(fd)
+        try:
+            pa.parquet.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+def _copy_footprints(root, footprints, mirrored):
+    """Write footprints to the mirror in chunks, adding them to mirrored. Returns the count."""
+    count = 0
+    footprints = iter(footprints)
+    while True:
+        chunk = list(itertools.islice(footprints, CHUNK_SIZE))
+        if not chunk:
+            return count
+        _write_partitions(root, footprint_query.build_frame(chunk))
+        count += len(chunk)
+        mirrored.update((str(f["id"]), f["created_at"]) for f in chunk)
+
+
+def _advance(state, now=None):
+    """Move the watermark up over the mirrored ids that follow it.
+
+    A missing id stops it until the footprint after the gap is COMMIT_GRACE
+    seconds old; by then the id's save failed or was rolled back.
+    """
+    now = time.time() if now is None else now
+    watermark, mirrored = state["watermark"], dict(state["mirrored"])
+    for footprint_id in sorted(int(i) for i in mirrored):
+        if footprint_id != watermark + 1 and (mirrored[str(footprint_id)] or 0) > now - COMMIT_GRACE:
+            break
+        watermark = footprint_id
+        del mirrored[str(footprint_id)]
+    return {**state, "watermark": watermark, "mirrored": mirrored}
+
+
+def sync(storage=None, root=PARQUET_MIRROR_DIR, blocking=True):
+    """Copy footprints saved since the last sync into the mirror. Returns the number copied."""
+    _pyarrow()
+    if storage is None:
+        from utils.storage import get_storage
+        storage = get_storage()
+    with _mirror_lock(root, blocking) as locked:
+        if not locked:
+            return 0
+        state = read_state(root)
+        mirrored = dict(state["mirrored"])
+        pending = (f for f in storage.iter_footprints(state["watermark"]) if str(f["id"]) not in mirrored)
+        count = _copy_footprints(root, pending, mirrored)
+        advanced = _advance({**state, "mirrored": mirrored})
+        if advanced != state:
+            _write_state(root, advanced)
+        return count
+
+
+def rebuild(storage=None, root=PARQUET_MIRROR_DIR):
+    """Recreate the mirror from scratch and swap it in place. Returns the number of footprints."""
+    _pyarrow()
+    if storage is None:
+        from utils.storage import get_storage
+        storage = get_storage()
+    root = Path(root)
+    with _mirror_lock(root):
+        staging = Path(tempfile.mkdtemp(dir=root.parent, prefix=f".{root.name}."))
+        try:
+            mirrored = {}
+            count = _copy_footprints(staging, storage.iter_footprints(), mirrored)
+            _write_state(staging, _advance({"watermark": 0, "mirrored": mirrored}))
+            # Swap the partition directories; the lock file stays where it is
+            for old in root.glob("year=*"):
+                shutil.rmtree(old)
+            for new in staging.glob("year=*"):
+                os.replace(new, root / new.name)
+            os.replace(staging / STATE_FILE, root / STATE_FILE)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    return count
+
+
+def after_save(footprint):
+    """Sync once PARQUET_MIRROR_BATCH footprints are pending. Never raises."""
+    try:
+        if footprint["id"] - read_state()["watermark"] >= PARQUET_MIRROR_BATCH:
+            # Another process already syncing will pick these up
+            sync(blocking=False)
+    except Exception as e:
+        print(f"Error updating the Parquet mirror: {e}")
+
+
+def after_revise(footprints, root=PARQUET_MIRROR_DIR):
+    """Replace the mirrored rows of revised footprints. Never raises.
+
+    Footprints not mirrored yet are left to the next sync.
+    """
+    try:
+        _pyarrow()
+        with _mirror_lock(root):
+            state = read_state(root)
+            mirrored = [f for f in footprints if f["id"] <= state["watermark"] or str(f["id"]) in state["mirrored"]]
+            if mirrored:
+                # Merged rows are deduplicated by id, keeping the new ones
+                _write_partitions(root, footprint_query.build_frame(mirrored))
+    except Exception as e:
+        print(f"Error updating the Parquet mirror: {e}")
+
+
+def read_dataset(root=PARQUET_MIRROR_DIR):
+    """Open the mirror as a pyarrow dataset, with year/month partition columns."""
+    _pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([("year", pa.int32()), ("month", pa.int32())]), flavor="hive")
+    dataset = ds.dataset(root, format="parquet", partitioning=partitioning)
+    # Months can hold different categories; merge their columns into one schema
+    schema = pa.unify_schemas(
+        [fragment.physical_schema for fragment in dataset.get_fragments()] + [partitioning.schema]
+    )
+    return ds.dataset(root, format="parquet", partitioning=partitioning, schema=schema)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the Parquet analytics mirror")
+    parser.add_argument("command", choices=["sync", "rebuild"])
+    parser.add_argument("--root", default=PARQUET_MIRROR_DIR, help="Mirror directory")
+    args = parser.parse_args()
+    if args.command == "sync":
+        print(f"Mirrored {sync(root=args.root)} new footprints to {args.root}")
+    else:
+        print(f"Rebuilt {args.root} with {rebuild(root=args.root)} footprints")
+
+
+if __name__ == "__main__":
+    main()
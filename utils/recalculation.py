@@ -0,0 +1,255 @@
+"""
+Recalculation of stored footprints after emission factors change.
+
+Published factor sets are never edited (utils/factor_store.py); a corrected
+factor ships in a new version. A footprint records the factor set version
+it was calculated with and its non-default inputs, which tells which factor
+ids it depends on (emissions_engine.dependencies) and is enough to
+calculate it again.
+
+Every storage backend keeps a dependency index next to the footprints,
+written with each save and revision: the factor ids each footprint depends
+on (dependency_entry), in the footprint_dependencies table of the SQL
+backends and in data/footprint_dependencies.jsonl for the JSON storage.
+plan() asks it for the footprints of each older version that depend on a
+factor whose value differs between that version and the target version,
+without scanning or re-deriving every footprint. They are recomputed in chunks of CHUNK_SIZE, one
+vectorized emissions_engine.evaluate() call per chunk, spread over a
+process pool, and written back with revise_footprints() as new revisions
+(the previous revision stays in the footprint's history).
+
+Formula changes are handled the same way. Each activity's formula has an
+id among the ids a footprint depends on (formula_id), and a footprint
+saved with an older emissions_engine.FORMULA_VERSION is stale if it uses
+an activity whose formula changed since (emissions_engine.FORMULA_CHANGES).
+This holds even when it is on the target factor set version.
+
+A revised footprint carries the target version and is no longer stale, so
+an interrupted run continues with the remaining footprints when started
+again. Footprints saved before inputs were recorded cannot be recalculated
+and are only counted.
+
+    python -m utils.recalculation --to 2026.2
+    python -m utils.recalculation --to 2026.2 --rebuild-index
+    python -m utils.recalculation --to 2026.2 --factor "IPCC|GLOBAL|2006|natural_gas_combustion|kg CO2/TJ" --dry-run
+"""
+import argparse
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from config.settings import FACTOR_SET_VERSION
+from utils import emissions_engine, factor_store
+
+CHUNK_SIZE = 5000
+
+
+def formula_id(activity):
+    """Id of an activity's formula among the factor ids footprints depend on."""
+    return f"formula|{activity.scope}|{activity.category}"
+
+
+def changed_formula_ids(formula_version):
+    """Ids of the formulas whose results changed since an older formula version."""
+    return frozenset(formula_id(activity) for activity in emissions_engine.changed_activities(formula_version))
+
+
+@lru_cache(maxsize=None)
+def _factor_ids(input_keys):
+    names = emissions_engine.dependencies(input_keys)
+    ids = {factor_store.factor_id(emissions_engine.FACTORS[name]) for name in names}
+    ids.update(formula_id(activity) for activity in emissions_engine.used_activities(input_keys))
+    return frozenset(ids)
+
+
+def footprint_factor_ids(footprint):
+    """Ids of the factors and formulas a stored footprint depends on (none if its inputs are unknown)."""
+    inputs = footprint.get("inputs")
+    if inputs is None:
+        return frozenset()
+    return _factor_ids(frozenset(inputs))
+
+
+def dependency_entry(footprint):
+    """A saved footprint's entry in the dependency index of the storage backends.
+
+    Its id, user_id, revision, factor_set_version, formula_version (1 when
+    not recorded) and inputs, and the sorted ids of the factors and formulas
+    it depends on (None when its inputs are unknown).
+    """
+    inputs = footprint.get("inputs")
+    return {
+        "id": footprint["id"],
+        "user_id": footprint["user_id"],
+        "revision": footprint.get("revision") or 0,
+        "factor_set_version": footprint.get("factor_set_version"),
+        "formula_version": footprint.get("formula_version") or 1,
+        "inputs": inputs,
+        "factor_ids": sorted(footprint_factor_ids(footprint)) if inputs is not None else None
+    }
+
+
+def changed_factor_ids(version, target):
+    """Ids of the factors that differ between two factor set versions.
+
+    Returns None when the old version is no longer available, meaning any
+    factor may have changed.
+    """
+    try:
+        old = factor_store.get_factor_set(version)
+    except ValueError:
+        print(f"Factor set {version} is not available; its footprints are treated as depending on changed factors")
+        return None
+    new = factor_store.get_factor_set(target)
+    return frozenset(factor_store.factor_id(key) for key in factor_store.changed_keys(old, new))
+
+
+def plan(target, factor_ids=None, storage=None):
+    """Find the footprints that are stale for a target factor set version, through the dependency index.
+
+    Footprints of an older FORMULA_VERSION are stale when they use a changed
+    formula, whatever their factor set version. factor_ids limits the changed factors considered. Returns (stale,
+    report): the stale footprints as dicts with their id, user_id, revision
+    and inputs, and counts of the footprints scanned, already on the target
+    version, without inputs, unaffected and stale, plus the number of stale
+    footprints per changed factor id.
+    """
+    if storage is None:
+        from utils.storage import get_storage
+        storage = get_storage()
+    factor_ids = frozenset(factor_ids) if factor_ids else None
+    stale = []
+    report = {"scanned": 0, "current": 0, "without_inputs": 0, "unaffected": 0, "stale": 0, "by_factor": {}}
+    counts = storage.count_footprints_by_version()
+    for (version, formula_version), (count, without_inputs) in sorted(counts.items(), key=str):
+        report["scanned"] += count
+        if version == target and formula_version >= emissions_engine.FORMULA_VERSION:
+            report["current"] += count
+            continue
+        if version is None:
+            report["without_inputs"] += count
+            continue
+        report["without_inputs"] += without_inputs
+        wanted = changed_factor_ids(version, target) if version != target else frozenset()
+        if wanted is not None:
+            wanted = wanted | changed_formula_ids(formula_version)
+        if factor_ids is not None:
+            wanted = factor_ids if wanted is None else wanted & factor_ids
+        dependent = 0
+        if wanted is None or wanted:
+            for footprint in storage.iter_dependent_footprints(version, formula_version, wanted):
+                dependent += 1
+                for factor_id in footprint["factor_ids"]:
+                    report["by_factor"][factor_id] = report["by_factor"].get(factor_id, 0) + 1
+                stale.append({key: footprint[key] for key in ("id", "user_id", "revision", "inputs")})
+        report["unaffected"] += count - without_inputs - dependent
+    stale.sort(key=lambda footprint: footprint["id"])
+    report["stale"] = len(stale)
+    return stale, report
+
+
+def recalculate_chunk(target, footprints):
+    """Recompute a chunk of stale footprints with a factor set version.
+
+    Returns their revisions, ready for revise_footprints().
+    """
+    result = emissions_engine.evaluate(
+        [footprint["inputs"] for footprint in footprints], factor_set=factor_store.get_factor_set(target)
+    )
+    return [
+        {**calculated, "id": footprint["id"], "user_id": footprint["user_id"], "revision": footprint["revision"]}
+        for footprint, calculated in zip(footprints, emissions_engine.to_footprints(result))
+    ]
+
+
+def _computed_chunks(target, chunks, workers):
+    """Yield the revisions of each chunk in order, computed in a process pool when workers > 1.
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    while the caller writes the previous results.
+    """
+    if workers <= 1 or len(chunks) == 1:
+        for chunk in chunks:
+            yield recalculate_chunk(target, chunk)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        remaining = iter(chunks)
+        pending = deque(pool.submit(recalculate_chunk, target, chunk)
+                        for chunk in itertools.islice(remaining, 2 * workers))
+        while pending:
+            results = pending.popleft().result()
+            chunk = next(remaining, None)
+            if chunk is not None:
+                pending.append(pool.submit(recalculate_chunk, target, chunk))
+            yield results
+
+
+def recalculate(target=None, factor_ids=None, workers=None, chunk_size=CHUNK_SIZE, dry_run=False, storage=None):
+    """Recalculate the stale footprints for a target factor set version (FACTOR_SET_VERSION by default).
+
+    With dry_run, only plans. Returns the plan() report with the number of
+    footprints revised, those the storage skipped (archived, or revised by
+    someone else meanwhile), the elapsed seconds and the throughput in
+    footprints per second.
+    """
+    target = target or FACTOR_SET_VERSION
+    factor_store.get_factor_set(target)  # fail on an unknown version before scanning
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    stale, report = plan(target, factor_ids, storage)
+    print(f"{report['stale']} of {report['scanned']} footprints are stale for factor set {target} "
+          f"({time.monotonic() - started:.1f}s)")
+
+    if storage is None:
+        from utils.storage import revise_footprints
+    else:
+        revise_footprints = storage.revise_footprints
+    revised = computed = 0
+    if not dry_run and stale:
+        chunks = [stale[start:start + chunk_size] for start in range(0, len(stale), chunk_size)]
+        for revisions in _computed_chunks(target, chunks, workers):
+            revised += len(revise_footprints(revisions))
+            computed += len(revisions)
+            elapsed = max(time.monotonic() - started, 1e-9)
+            print(f"{computed}/{len(stale)} footprints recalculated ({computed / elapsed:.0f}/s)")
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    report.update(
+        target=target, revised=revised, skipped=computed - revised,
+        seconds=elapsed, footprints_per_second=computed / elapsed
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalculate footprints that depend on changed emission factors")
+    parser.add_argument("--to", dest="target", default=FACTOR_SET_VERSION,
+                        help="Factor set version to recalculate with (default: FACTOR_SET_VERSION)")
+    parser.add_argument("--factor", action="append", metavar="ID",
+                        help="Only consider this changed factor or formula id (repeatable)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Footprints per vectorized batch")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the stale footprints")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Rebuild the dependency index from the stored footprints first")
+    args = parser.parse_args()
+
+    if args.rebuild_index:
+        from utils.storage import get_storage
+        get_storage().rebuild_dependencies()
+
+    report = recalculate(args.target, args.factor, args.workers, args.chunk_size, args.dry_run)
+    for factor_id, count in sorted(report["by_factor"].items(), key=lambda item: -item[1]):
+        print(f"  {count:>8}  {factor_id}")
+    print(f"Scanned {report['scanned']}: {report['current']} already on {report['target']}, "
+          f"{report['without_inputs']} without inputs, {report['unaffected']} unaffected, {report['stale']} stale")
+    if not args.dry_run:
+        print(f"Revised {report['revised']} footprints ({report['skipped']} skipped: archived or changed meanwhile) "
+              f"in {report['seconds']:.1f}s, {report['footprints_per_second']:.0f} footprints/s")
+
+
+if __name__ == "__main__":
+    main()
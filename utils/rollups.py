@@ -0,0 +1,145 @@
+"""
+Per-user emission rollups by month, quarter and year.
+
+Every storage backend keeps one bucket per (user, period, period key) with
+the number of footprints, the scope 1/2/3 and total sums, and the sum of
+every emission_details category. Buckets are updated as each footprint is
+saved, so trend views read a handful of buckets instead of every footprint.
+
+Rebuild them from the raw footprints with
+
+    python -m utils.rollups rebuild [--user-id ID]
+"""
+import argparse
+from datetime import datetime, timezone
+
+PERIODS = ("month", "quarter", "year")
+SCOPE_FIELDS = ("scope1_emissions", "scope2_emissions", "scope3_emissions", "total_emissions")
+
+
+def period_key(created_at, period):
+    """Return the bucket key ('2025-03', '2025-Q1' or '2025') of a timestamp."""
+    moment = datetime.fromtimestamp(created_at or 0, timezone.utc)
+    if period == "month":
+        return f"{moment.year:04d}-{moment.month:02d}"
+    if period == "quarter":
+        return f"{moment.year:04d}-Q{(moment.month - 1) // 3 + 1}"
+    if period == "year":
+        return f"{moment.year:04d}"
+    raise ValueError(f"period must be one of {PERIODS}, got {period!r}")
+
+
+def new_bucket(key):
+    bucket = {"period_key": key, "count": 0, "categories": {}}
+    for field in SCOPE_FIELDS:
+        bucket[field] = 0.0
+    return bucket
+
+
+def add_to_bucket(bucket, footprint, sign=1):
+    """Add one footprint to a bucket in place (or remove it, with sign=-1)."""
+    bucket["count"] += sign
+    for field in SCOPE_FIELDS:
+        bucket[field] += sign * (footprint.get(field) or 0.0)
+    for scope, categories in (footprint.get("emission_details") or {}).items():
+        if not isinstance(categories, dict):
+            continue
+        sums = bucket["categories"].setdefault(scope, {})
+        for category, value in categories.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                sums[category] = sums.get(category, 0.0) + sign * value
+    return bucket
+
+
+def merge_bucket(bucket, other):
+    """Add the sums of another bucket to a bucket in place."""
+    bucket["count"] += other["count"]
+    for field in SCOPE_FIELDS:
+        bucket[field] += other[field]
+    for scope, categories in other["categories"].items():
+        sums = bucket["categories"].setdefault(scope, {})
+        for category, value in categories.items():
+            sums[category] = sums.get(category, 0.0) + value
+    return bucket
+
+
+def summarize(footprints, replaced=()):
+    """Sum footprints into one bucket per month.
+
+    replaced footprints are subtracted: passing the previous revisions of
+    revised footprints swaps their sums without changing the counts.
+    Returns a list of (created_at of one of the month's footprints, bucket),
+    which apply_many() merges into every period.
+    """
+    months = {}
+    keys = {}
+    for sign, records in ((-1, replaced), (1, footprints)):
+        for footprint in records:
+            created_at = footprint.get("created_at")
+            key = keys.get(created_at)
+            if key is None:
+                key = keys[created_at] = period_key(created_at, "month")
+            if key not in months:
+                months[key] = (created_at, new_bucket(key))
+            add_to_bucket(months[key][1], footprint, sign)
+    return list(months.values())
+
+
+def apply_many(rollups, footprints, replaced=()):
+    """Add many footprints to a user's rollups in place.
+
+    Each footprint is added once to its month's sum, and the month sums are
+    merged into the month, quarter and year buckets. replaced footprints
+    are taken out again (see summarize).
+    """
+    for created_at, month in summarize(footprints, replaced):
+        for period in PERIODS:
+            key = period_key(created_at, period)
+            buckets = rollups.setdefault(period, {})
+            merge_bucket(buckets.setdefault(key, new_bucket(key)), month)
+    return rollups
+
+
+def apply(rollups, footprint):
+    """Add a footprint to a user's rollups ({period: {key: bucket}}) in place.
+
+    The cost depends only on the footprint, not on how many are stored.
+    """
+    for period in PERIODS:
+        key = period_key(footprint.get("created_at"), period)
+        buckets = rollups.setdefault(period, {})
+        add_to_bucket(buckets.setdefault(key, new_bucket(key)), footprint)
+    return rollups
+
+
+def build(footprints):
+    """Build a user's rollups from scratch."""
+    rollups = {period: {} for period in PERIODS}
+    for footprint in footprints:
+        apply(rollups, footprint)
+    return rollups
+
+
+def sorted_buckets(rollups, period):
+    """Buckets of one period in chronological order."""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {PERIODS}, got {period!r}")
+    buckets = rollups.get(period, {})
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-user emission rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="Recompute rollups from the stored footprints")
+    rebuild.add_argument("--user-id", type=int, help="Only rebuild this user (default: all users)")
+    args = parser.parse_args()
+
+    from utils.storage import get_storage
+    if args.command == "rebuild":
+        count = get_storage().rebuild_rollups(args.user_id)
+        print(f"Rebuilt rollups for {count} user(s)")
+
+
+if __name__ == "__main__":
+    main()
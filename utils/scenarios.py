@@ -0,0 +1,189 @@
+"""
+What-if scenario sweeps over Calculator inputs.
+
+sweep() takes a baseline (Calculator values or a stored footprint with its
+inputs) and a grid of levers, {input key: values}, and evaluates every
+combination of the lever values. Each lever is laid along its own axis, so
+the whole Cartesian product is a single broadcast
+emissions_engine.evaluate() call: a 100 × 100 × 100 grid is a million
+footprints computed at once. Lever values can also be a {label: value}
+mapping, e.g. commute modes and their emission factors.
+
+The result is a DataFrame with one row per combination; heatmap() draws a
+total over two of the levers.
+
+    from utils import scenarios
+    frame = scenarios.sweep(footprint, {
+        "custom_renewable_percentage": range(0, 101, 10),
+        "custom_fleet_fuel_consumption": scenarios.relative(footprint, "custom_fleet_fuel_consumption",
+                                                            np.linspace(-0.5, 0, 6)),
+        "scope3_ef_mode_commute": {"car": 0.17, "bus": 0.10, "rail": 0.04},
+    })
+    scenarios.heatmap(frame, "custom_renewable_percentage", "custom_fleet_fuel_consumption",
+                      fixed={"scope3_ef_mode_commute": "bus"})
+
+    python -m utils.scenarios --set custom_electricity_usage=12000 \\
+        --lever custom_renewable_percentage=0:100:11 --lever scope2_purchased_energy=0,5000,10000 --csv out.csv
+"""
+import argparse
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from utils import emissions_engine
+
+
+def baseline_inputs(baseline):
+    """Calculator values of a baseline: a stored footprint's inputs, or the values themselves."""
+    if "inputs" in baseline:
+        if baseline["inputs"] is None:
+            raise ValueError("The baseline footprint was saved without its inputs")
+        return dict(baseline["inputs"])
+    return dict(baseline)
+
+
+def relative(baseline, key, changes, factor_set=None):
+    """Lever values for relative changes of a baseline input: -0.5 is half of it, 0 leaves it unchanged."""
+    value = baseline_inputs(baseline).get(key, emissions_engine.defaults(factor_set)[key])
+    return float(value) * (1 + np.asarray(changes, dtype=np.float64))
+
+
+def _lever_values(key, values):
+    """Check a lever. Returns (float64 values, labels or None)."""
+    if key not in emissions_engine.INPUTS:
+        raise ValueError(f"Unknown calculator input: {key}")
+    labels = None
+    if isinstance(values, Mapping):
+        labels = list(values.keys())
+        values = list(values.values())
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if values.size == 0:
+        raise ValueError(f"Lever {key} has no values")
+    low, high = emissions_engine.input_bounds(key)
+    if np.isnan(values).any() or values.min() < low or (high is not None and values.max() > high):
+        bounds = f"between {low} and {high}" if high is not None else f"at least {low}"
+        raise ValueError(f"Lever {key} values must be {bounds}")
+    return values, labels
+
+
+def sweep(baseline, grid, factor_set=None, details=False):
+    """Evaluate a baseline with every combination of the levers in grid.
+
+    grid maps input keys to their values (a sequence, or a {label: value}
+    mapping whose labels go in the frame). Returns a DataFrame with one row
+    per combination, the first lever varying slowest: a column per lever,
+    the scope1/scope2/scope3/total_emissions and the total's
+    change_from_baseline, plus a '<scope>.<category>' column per non-zero
+    category with details. frame.attrs['levers'] lists the lever columns.
+    """
+    if not grid:
+        raise ValueError("The grid has no levers")
+    values = baseline_inputs(baseline)
+    point = emissions_engine.calculate(values, factor_set=factor_set)
+
+    levers = {}
+    for axis, (key, lever) in enumerate(grid.items()):
+        lever_values, labels = _lever_values(key, lever)
+        # Lever i varies along axis i only; evaluate() broadcasts them into the full grid
+        axis_shape = [1] * len(grid)
+        axis_shape[axis] = lever_values.size
+        values[key] = lever_values.reshape(axis_shape)
+        levers[key] = labels
+    result = emissions_engine.evaluate(values, factor_set=factor_set)
+    shape = result["total_emissions"].shape
+
+    columns = {}
+    for key, labels in levers.items():
+        index = np.broadcast_to(np.arange(values[key].size).reshape(values[key].shape), shape).ravel()
+        if labels is None:
+            columns[key] = values[key].ravel()[index]
+        else:
+            columns[key] = pd.Categorical.from_codes(index, categories=labels)
+    for key in emissions_engine.TOTALS:
+        columns[key] = result[key].ravel()
+    columns["change_from_baseline"] = columns["total_emissions"] - point["total_emissions"]
+    if details:
+        for scope, categories in result["emission_details"].items():
+            for category, samples in categories.items():
+                if np.any(samples):
+                    columns[f"{scope}.{category}"] = np.ravel(samples)
+    frame = pd.DataFrame(columns)
+    frame.attrs["levers"] = list(levers)
+    return frame
+
+
+def heatmap(frame, x, y, value="total_emissions", fixed=None, title=None):
+    """Plotly heatmap of a sweep() column over two levers.
+
+    Every other lever must be given a value (or label) in fixed.
+    """
+    import plotly.graph_objects as go
+
+    fixed = fixed or {}
+    levers = frame.attrs.get("levers", [x, y])
+    missing = [lever for lever in levers if lever not in (x, y) and lever not in fixed]
+    if missing:
+        raise ValueError(f"Fix a value for the other levers: {', '.join(missing)}")
+    selected = frame
+    for lever, lever_value in fixed.items():
+        selected = selected[selected[lever] == lever_value]
+    if selected.empty:
+        raise ValueError("No scenario matches the fixed lever values")
+    table = selected.pivot_table(index=y, columns=x, values=value, observed=True, sort=False)
+    fig = go.Figure(data=go.Heatmap(
+        z=table.to_numpy(), x=[str(c) for c in table.columns], y=[str(i) for i in table.index],
+        colorscale="RdYlGn_r", colorbar=dict(title="kgCO₂e")
+    ))
+    fig.update_layout(title=title or value.replace("_", " ").capitalize(), xaxis_title=x, yaxis_title=y, height=500)
+    return fig
+
+
+def parse_lever(text):
+    """Parse 'key=start:stop:count' or 'key=v1,v2,...' into (key, values)."""
+    key, sep, spec = text.partition("=")
+    if not sep or not spec:
+        raise ValueError(f"Expected KEY=START:STOP:COUNT or KEY=V1,V2,..., got {text!r}")
+    if ":" in spec:
+        start, stop, count = spec.split(":")
+        return key.strip(), np.linspace(float(start), float(stop), int(count))
+    return key.strip(), [float(v) for v in spec.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep calculator inputs over a grid of scenarios")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Baseline calculator input (repeatable)")
+    parser.add_argument("--lever", action="append", required=True, metavar="KEY=START:STOP:COUNT",
+                        help="Lever values, a range or a comma separated list (repeatable)")
+    parser.add_argument("--csv", help="Write the scenarios to this CSV file")
+    parser.add_argument("--html", help="Write a heatmap of the first two levers to this HTML file")
+    args = parser.parse_args()
+
+    try:
+        baseline = {}
+        for pair in args.set:
+            key, sep, value = pair.partition("=")
+            if not sep:
+                raise ValueError(f"Expected KEY=VALUE, got {pair!r}")
+            baseline[key] = float(value)
+        grid = dict(parse_lever(text) for text in args.lever)
+        frame = sweep(baseline, grid)
+    except ValueError as e:
+        parser.error(str(e))
+    best = frame.loc[frame["total_emissions"].idxmin()]
+    print(f"{len(frame)} scenarios, total emissions {frame['total_emissions'].min():.1f} – "
+          f"{frame['total_emissions'].max():.1f} kgCO2e")
+    print("Lowest: " + ", ".join(f"{lever}={best[lever]}" for lever in frame.attrs["levers"]))
+    if args.csv:
+        frame.to_csv(args.csv, index=False)
+    if args.html:
+        levers = frame.attrs["levers"]
+        if len(levers) < 2:
+            parser.error("A heatmap needs two levers")
+        fixed = {lever: frame[lever].iloc[0] for lever in levers[2:]}
+        heatmap(frame, levers[0], levers[1], fixed=fixed).write_html(args.html)
+
+
+if __name__ == "__main__":
+    main()
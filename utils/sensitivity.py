@@ -0,0 +1,307 @@
+"""
+Sensitivity of footprints to every Calculator input and emission factor.
+
+Every parameter (each numeric input of emissions_engine.INPUTS and each
+factor of emissions_engine.FACTORS) of a footprint is moved down and up,
+one at a time, and the footprint evaluated again. The perturbations are
+laid out as a (footprints × parameters × 2) array, so a batch of CHUNK_SIZE
+footprints with all their parameters is a single broadcast
+emissions_engine.evaluate() call.
+
+analyze() moves each parameter by a small step and takes central
+differences: the partial derivative of each scope total and its elasticity
+(% change of the total per % change of the parameter). Most formulas are
+products, so the differences are exact up to rounding. tornado() moves each
+parameter by ±swing (10% by default) and reports the resulting totals,
+ranked by their range.
+
+An emission factor input left at its default follows its factor: moving
+the factor moves it too, and it is left out of the rankings so its effect
+is not counted twice.
+
+A stored footprint is analyzed with the factor set it was calculated with
+(its factor_set_version), so the base totals match the stored ones; dicts
+of Calculator values use the configured set. Passing factor_set analyzes
+every footprint with that set instead. The results list the version used
+for each footprint.
+
+    from utils import sensitivity
+    analysis = sensitivity.analyze(get_user_footprints(user_id))
+    sensitivity.ranking(analysis, 0)
+    sensitivity.tornado(get_user_footprints(user_id), swing=0.1)
+
+    python -m utils.sensitivity --user-id 3 --top 10
+"""
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from utils import emissions_engine
+from utils.factor_store import get_factor_set
+
+STEP = 1e-4  # relative step of the finite differences
+SWING = 0.1
+CHUNK_SIZE = 250
+
+Parameter = namedtuple("Parameter", "kind name")  # kind is 'input' or 'factor'
+
+PARAMETERS = [
+    Parameter("input", key) for key, default in emissions_engine.INPUTS.items() if not isinstance(default, bool)
+] + [Parameter("factor", name) for name in emissions_engine.FACTORS]
+
+
+def _footprint_inputs(footprint):
+    """Calculator values of a stored footprint (its inputs) or of a dict of values."""
+    if "inputs" in footprint:
+        if footprint["inputs"] is None:
+            raise ValueError(f"Footprint {footprint.get('id')} was saved without its inputs")
+        return footprint["inputs"]
+    return footprint
+
+
+def _bounds(parameter):
+    if parameter.kind == "factor":
+        return 0, None
+    return emissions_engine.input_bounds(parameter.name)
+
+
+def _swing_chunk(rows, relative, absolute, factor_set):
+    """Evaluate rows with every parameter moved down and up.
+
+    Each parameter x moves to x·(1 ∓ relative) ∓ absolute·max(|x|, 1),
+    kept within its bounds. Returns (values, follows, moved, totals, base):
+    parameter values and the mask of inputs following their factor
+    (rows × parameters), the moved values (rows × parameters × 2), the
+    totals with each move ({total: rows × parameters × 2}) and without
+    ({total: rows}).
+    """
+    count, size = len(rows), len(PARAMETERS)
+    point_factors = emissions_engine.factor_values(factor_set)
+    input_defaults = emissions_engine.defaults(factor_set)
+    unknown = {key for row in rows for key in row if key not in emissions_engine.INPUTS}
+    if unknown:
+        raise ValueError(f"Unknown calculator inputs: {', '.join(sorted(unknown))}")
+
+    base = {
+        key: np.array([float(row.get(key, default)) for row in rows])
+        for key, default in input_defaults.items()
+    }
+    values = np.empty((count, size))
+    follows = np.zeros((count, size), dtype=bool)
+    for j, parameter in enumerate(PARAMETERS):
+        if parameter.kind == "factor":
+            values[:, j] = point_factors[parameter.name]
+        else:
+            values[:, j] = base[parameter.name]
+            if isinstance(emissions_engine.INPUTS[parameter.name], emissions_engine.Factor):
+                follows[:, j] = [parameter.name not in row for row in rows]
+
+    step = relative * np.abs(values) + absolute * np.maximum(np.abs(values), 1.0)
+    moved = np.stack([values - step, values + step], axis=2)
+    for j, parameter in enumerate(PARAMETERS):
+        low, high = _bounds(parameter)
+        moved[:, j] = np.clip(moved[:, j], low, high)
+
+    index = {parameter: j for j, parameter in enumerate(PARAMETERS)}
+    shape = (count, size, 2)
+    columns = {}
+    for key, column in base.items():
+        j = index.get(Parameter("input", key))
+        if j is None:  # not a parameter (booleans)
+            columns[key] = column[:, None, None]
+            continue
+        column = np.broadcast_to(column[:, None, None], shape).copy()
+        column[:, j] = moved[:, j]
+        default = emissions_engine.INPUTS[key]
+        if isinstance(default, emissions_engine.Factor):
+            # Where the input follows its factor, moving the factor moves it
+            f = index[Parameter("factor", default.name)]
+            column[follows[:, j], f] = moved[follows[:, j], f]
+        columns[key] = column
+    factors = {}
+    for name, value in point_factors.items():
+        f = index[Parameter("factor", name)]
+        factor = np.full((1, size, 2), value)
+        factor[0, f] = moved[0, f]
+        factors[name] = factor
+
+    result = emissions_engine.evaluate(columns, factors, factor_set)
+    point = emissions_engine.evaluate(base, factor_set=factor_set)
+    totals = {key: result[key] for key in emissions_engine.TOTALS}
+    return values, follows, moved, totals, {key: point[key] for key in emissions_engine.TOTALS}
+
+
+def _factor_sets(footprints, factor_set):
+    """The factor set to analyze each footprint with.
+
+    factor_set if given, else each stored footprint's own factor set version,
+    falling back to the configured set when that version is not available.
+    """
+    if factor_set is not None:
+        return [factor_set] * len(footprints)
+    sets = {}
+    for footprint in footprints:
+        version = footprint.get("factor_set_version") if "inputs" in footprint else None
+        if version not in sets:
+            try:
+                sets[version] = get_factor_set(version)
+            except ValueError:
+                print(f"Factor set {version} is not available; its footprints are analyzed with "
+                      f"factor set {get_factor_set().version}")
+                sets[version] = get_factor_set()
+    return [sets[footprint.get("factor_set_version") if "inputs" in footprint else None] for footprint in footprints]
+
+
+def _swings(footprints, relative, absolute, factor_set, chunk_size):
+    """_swing_chunk() over all footprints, chunk by chunk and factor set by factor set.
+
+    Returns its arrays in the order of footprints, plus the factor set
+    version each footprint was analyzed with.
+    """
+    rows = [_footprint_inputs(footprint) for footprint in footprints]
+    if not rows:
+        raise ValueError("No footprints to analyze")
+    sets = _factor_sets(footprints, factor_set)
+    groups = {}
+    for position, footprint_set in enumerate(sets):
+        groups.setdefault(footprint_set.version, (footprint_set, []))[1].append(position)
+    parts, order = [], []
+    for footprint_set, positions in groups.values():
+        for start in range(0, len(positions), chunk_size):
+            chunk = positions[start:start + chunk_size]
+            parts.append(_swing_chunk([rows[i] for i in chunk], relative, absolute, footprint_set))
+            order.extend(chunk)
+    inverse = np.argsort(order)
+    values, follows, moved, totals, base = zip(*parts)
+    return (
+        np.concatenate(values)[inverse], np.concatenate(follows)[inverse], np.concatenate(moved)[inverse],
+        {key: np.concatenate([part[key] for part in totals])[inverse] for key in emissions_engine.TOTALS},
+        {key: np.concatenate([part[key] for part in base])[inverse] for key in emissions_engine.TOTALS},
+        [footprint_set.version for footprint_set in sets],
+    )
+
+
+def _labels(footprints):
+    return [footprint.get("id", i) for i, footprint in enumerate(footprints)]
+
+
+def analyze(footprints, factor_set=None, chunk_size=CHUNK_SIZE):
+    """Partial derivatives and elasticities of the totals of footprints.
+
+    footprints are stored footprints (with their inputs) or dicts of
+    Calculator values. Returns a dict with the 'footprints' (their ids, or
+    positions), the 'factor_set_versions' they were analyzed with, the
+    'parameters' (PARAMETERS),
+    their 'values' and the 'follows' mask (footprints × parameters), the
+    'totals' ({total: footprints}), and 'derivatives' and 'elasticities'
+    ({total: footprints × parameters}). The elasticity is 0 where the total
+    is 0.
+    """
+    footprints = list(footprints)
+    values, follows, moved, totals, base, versions = _swings(footprints, 0.0, STEP, factor_set, chunk_size)
+    width = moved[:, :, 1] - moved[:, :, 0]
+    derivatives, elasticities = {}, {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for key in emissions_engine.TOTALS:
+            derivative = (totals[key][:, :, 1] - totals[key][:, :, 0]) / width
+            derivatives[key] = np.where(width > 0, derivative, 0.0)
+            total = base[key][:, None]
+            elasticities[key] = np.where(total != 0, derivatives[key] * values / total, 0.0)
+    return {
+        "footprints": _labels(footprints),
+        "factor_set_versions": versions,
+        "parameters": PARAMETERS,
+        "values": values,
+        "follows": follows,
+        "totals": base,
+        "derivatives": derivatives,
+        "elasticities": elasticities,
+    }
+
+
+def ranking(analysis, index=0, target="total_emissions"):
+    """The parameters of one analyzed footprint that move a total, by decreasing |elasticity|."""
+    frame = pd.DataFrame({
+        "kind": [parameter.kind for parameter in analysis["parameters"]],
+        "name": [parameter.name for parameter in analysis["parameters"]],
+        "value": analysis["values"][index],
+        "derivative": analysis["derivatives"][target][index],
+        "elasticity": analysis["elasticities"][target][index],
+    })
+    frame = frame[(frame["derivative"] != 0) & ~analysis["follows"][index]]
+    order = frame["elasticity"].abs().sort_values(ascending=False, kind="stable").index
+    return frame.loc[order].reset_index(drop=True)
+
+
+def drivers(analysis, target="total_emissions"):
+    """Parameters ranked by their mean |elasticity| over all analyzed footprints.
+
+    Also counts the footprints where each parameter is the largest driver.
+    """
+    elasticity = np.where(analysis["follows"], 0.0, np.abs(analysis["elasticities"][target]))
+    top = np.bincount(elasticity.argmax(axis=1)[elasticity.max(axis=1) > 0], minlength=elasticity.shape[1])
+    frame = pd.DataFrame({
+        "kind": [parameter.kind for parameter in analysis["parameters"]],
+        "name": [parameter.name for parameter in analysis["parameters"]],
+        "mean_abs_elasticity": elasticity.mean(axis=0),
+        "top_driver_of": top,
+    })
+    frame = frame[frame["mean_abs_elasticity"] > 0]
+    return frame.sort_values("mean_abs_elasticity", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def tornado(footprints, swing=SWING, target="total_emissions", factor_set=None, chunk_size=CHUNK_SIZE):
+    """Tornado data: a total with each parameter moved by ±swing, one at a time.
+
+    Returns a DataFrame with one row per footprint and parameter that moves
+    the total: the footprint (its id, or position), the factor set version
+    it was analyzed with, the parameter kind, name
+    and value, the total with the parameter at its low and high value, the
+    base total and the range, ranked by decreasing range within each
+    footprint.
+    """
+    footprints = list(footprints)
+    values, follows, moved, totals, base, versions = _swings(footprints, swing, 0.0, factor_set, chunk_size)
+    low_total, high_total = totals[target][:, :, 0], totals[target][:, :, 1]
+    spread = np.abs(high_total - low_total)
+    rows, columns = np.nonzero((spread > 0) & ~follows)
+    frame = pd.DataFrame({
+        "footprint": np.asarray(_labels(footprints), dtype=object)[rows],
+        "factor_set_version": np.asarray(versions, dtype=object)[rows],
+        "kind": [PARAMETERS[j].kind for j in columns],
+        "name": [PARAMETERS[j].name for j in columns],
+        "value": values[rows, columns],
+        "low": moved[rows, columns, 0],
+        "high": moved[rows, columns, 1],
+        "low_total": low_total[rows, columns],
+        "high_total": high_total[rows, columns],
+        "base_total": base[target][rows],
+        "range": spread[rows, columns],
+    })
+    frame["_position"] = rows
+    frame = frame.sort_values(["_position", "range"], ascending=[True, False], kind="stable")
+    return frame.drop(columns="_position").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank the inputs and factors that drive a user's footprints")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--target", choices=emissions_engine.TOTALS, default="total_emissions")
+    parser.add_argument("--top", type=int, default=15, help="Number of drivers to show")
+    args = parser.parse_args()
+
+    from utils.storage import get_user_footprints
+    footprints = [footprint for footprint in get_user_footprints(args.user_id) if footprint.get("inputs") is not None]
+    if not footprints:
+        parser.error(f"User {args.user_id} has no footprints with recorded inputs")
+    analysis = analyze(footprints)
+    versions = pd.Series(analysis["factor_set_versions"]).value_counts().sort_index()
+    used = ", ".join(f"{version} ({count})" for version, count in versions.items())
+    print(f"Drivers of {args.target} over {len(footprints)} footprints, by factor set version: {used}")
+    print(drivers(analysis, args.target).head(args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
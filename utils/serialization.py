@@ -0,0 +1,120 @@
+"""
+Serialization formats for the storage data file.
+
+- 'json':    JSON text, encoded with orjson when it is installed and the
+             standard library otherwise. Compact unless pretty is requested.
+- 'msgpack': MessagePack behind a short magic header (requires msgpack).
+
+Readers do not need to know the format: loads() detects it from the first
+bytes of the payload, so files can be converted in place at any time with
+
+    python -m utils.json_storage convert --format msgpack
+"""
+import json
+import os
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MAGIC = b"TMMP\x01"
+FORMATS = ("json", "msgpack")
+
+
+def detect_format(payload):
+    """Return the format of a serialized payload from its header."""
+    if payload.startswith(MSGPACK_MAGIC):
+        return "msgpack"
+    return "json"
+
+
+def dumps(data, fmt="json", pretty=False):
+    """Serialize data to bytes in the given format."""
+    if fmt == "msgpack":
+        if msgpack is None:
+            raise ValueError("The msgpack format requires the msgpack package")
+        return MSGPACK_MAGIC + msgpack.packb(data, use_bin_type=True)
+    if fmt != "json":
+        raise ValueError(f"Unknown storage format: {fmt}")
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(data, indent=2).encode()
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def loads(payload):
+    """Deserialize bytes written by dumps(), whatever their format."""
+    if detect_format(payload) == "msgpack":
+        if msgpack is None:
+            raise ValueError("Reading this file requires the msgpack package")
+        return msgpack.unpackb(payload[len(MSGPACK_MAGIC):], raw=False, strict_map_key=False)
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def read_file(path):
+    """Read and deserialize a data file."""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def benchmark(path, repeat=5):
+    """Time loading and saving a data file in every available format.
+
+    The baseline is the original storage format: json.load and
+    json.dump(indent=2) from the standard library. Returns a list of result
+    dicts and prints them as a table.
+    """
+    data = read_file(path)
+    candidates = [
+        ("json indent=2 (baseline)",
+         lambda d: json.dumps(d, indent=2).encode(), json.loads),
+        ("json compact (stdlib)",
+         lambda d: json.dumps(d, separators=(',', ':')).encode(), json.loads),
+    ]
+    if orjson is not None:
+        candidates.append(("json compact (orjson)", orjson.dumps, orjson.loads))
+    if msgpack is not None:
+        candidates.append(("msgpack", lambda d: dumps(d, "msgpack"), loads))
+
+    tmp_path = f"{path}.bench"
+    results = []
+    try:
+        for name, dump, load in candidates:
+            save_times, load_times = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                payload = dump(data)
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                save_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                with open(tmp_path, 'rb') as f:
+                    load(f.read())
+                load_times.append(time.perf_counter() - start)
+            results.append({
+                "format": name,
+                "size": len(payload),
+                "save_ms": min(save_times) * 1000,
+                "load_ms": min(load_times) * 1000,
+            })
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    baseline = results[0]
+    print(f"{'format':<28}{'size':>12}{'save ms':>10}{'load ms':>10}{'save x':>8}{'load x':>8}")
+    for r in results:
+        print(f"{r['format']:<28}{r['size']:>12,}{r['save_ms']:>10.1f}{r['load_ms']:>10.1f}"
+              f"{baseline['save_ms'] / r['save_ms']:>8.1f}{baseline['load_ms'] / r['load_ms']:>8.1f}")
+    return results
@@ -0,0 +1,787 @@
+"""
+Storage backend selection.
+
+Pages and auth import their storage functions from this module. The backend
+behind them is chosen with STORAGE_BACKEND in config/settings.py:
+
+- 'json':   the JSON file storage in utils/json_storage.py
+- 'sqlite': an indexed SQLite database in WAL mode at SQLITE_PATH
+- 'postgresql': the SQLAlchemy models in database/models.py on DATABASE_URL,
+  with a pooled engine (see database/backend.py)
+
+Every backend returns users and footprints as plain dicts with the same keys
+as the JSON storage, so callers do not depend on the backend in use.
+Footprint queries take the same time-range and cursor arguments everywhere
+(see utils/pagination.py), and every backend maintains the per-user rollups
+of utils/rollups.py as footprints are saved. Saves through this module also
+feed the Parquet mirror of utils/parquet_mirror.py when PARQUET_MIRROR is on.
+
+Footprints are never edited, only revised: revise_footprints() replaces a
+footprint with a recalculated revision (same id, revision + 1) and keeps
+the previous one in its revision history (see utils/recalculation.py).
+Saves and revisions also maintain the index of the factor ids each
+footprint depends on, which recalculation queries for stale footprints.
+
+With FOOTPRINT_DEDUPE, a footprint saved with the input_hash of an earlier
+footprint of its user is stored as a reference to it and resolved on read
+(see utils/dedupe.py).
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from config.settings import STORAGE_BACKEND, SQLITE_PATH, PARQUET_MIRROR
+from utils import dedupe, pagination, recalculation, rollups
+
+
+class StorageBackend:
+    """Interface implemented by every storage backend."""
+
+    # User operations
+    def get_user_by_email(self, email):
+        """Get a user by email, or None."""
+        raise NotImplementedError
+
+    def create_user(self, email, password):
+        """Create a new user. Raises ValueError if the email is taken."""
+        raise NotImplementedError
+
+    def verify_user(self, email, password):
+        """Verify user credentials."""
+        user = self.get_user_by_email(email)
+        if user and user["password"] == password:  # In a real app, use proper password hashing
+            return user
+        return None
+
+    # Carbon footprint operations
+    def save_carbon_footprint(self, user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions,
+                              emission_details, inputs=None, factor_set_version=None, input_hash=None,
+                              formula_version=None):
+        """Save a new carbon footprint record and return it.
+
+        inputs (the calculator values that differ from their defaults),
+        factor_set_version and formula_version record how the footprint was
+        calculated, and input_hash identifies them (emissions_engine.input_hash).
+        """
+        raise NotImplementedError
+
+    def save_carbon_footprints(self, user_id, footprints):
+        """Save many footprints of a user in one bulk write and return the saved records.
+
+        footprints are dicts with the four scope totals and emission_details,
+        and optionally inputs, factor_set_version, formula_version and
+        input_hash. With FOOTPRINT_DEDUPE, a footprint with the input_hash of
+        an earlier one of the user is stored as a reference to it
+        (utils/dedupe.py); the saved records are complete either way.
+        """
+        raise NotImplementedError
+
+    def get_user_footprints(self, user_id, since=None, until=None, limit=None, order="desc", cursor=None):
+        """Get a user's carbon footprints ordered by (created_at, id).
+
+        since/until bound created_at inclusively (datetime or timestamp),
+        limit caps the number returned and cursor continues after the
+        footprint it was made from (pagination.encode_cursor).
+        """
+        raise NotImplementedError
+
+    def revise_footprints(self, revisions):
+        """Replace footprints with recalculated revisions and return the revised records.
+
+        revisions are dicts with the id, user_id and revision of the stored
+        footprint they revise, and its new scope totals, emission_details,
+        inputs, factor_set_version and formula_version. Each is saved as
+        revision + 1 and the previous revision moves to the footprint's
+        history; footprints that are missing, archived or already past that
+        revision are skipped.
+        Rollups are updated in the same write.
+        """
+        raise NotImplementedError
+
+    def get_footprint_revisions(self, footprint_id):
+        """Previous revisions of a footprint, oldest first.
+
+        Each has the footprint's fields plus footprint_id, revision and the
+        superseded_at timestamp of the recalculation that replaced it.
+        """
+        raise NotImplementedError
+
+    def iter_footprints(self, after_id=None):
+        """Yield every stored footprint of every user (for analytics).
+
+        With after_id, only footprints with a larger id.
+        """
+        raise NotImplementedError
+
+    def data_version(self):
+        """Cheap value that changes whenever footprints are added or changed."""
+        raise NotImplementedError
+
+    # Dependency index (see utils/recalculation.py)
+    def count_footprints_by_version(self):
+        """{(factor_set_version, formula_version): (footprints, footprints without inputs)}.
+
+        Over every stored footprint that can be revised, so archived ones
+        are left out; a missing formula_version counts as 1.
+        """
+        raise NotImplementedError
+
+    def iter_dependent_footprints(self, factor_set_version, formula_version, factor_ids=None):
+        """Yield the footprints calculated with these versions that depend on any of factor_ids.
+
+        Found through the dependency index; factor_ids None means any factor.
+        Each is a dict with the id, user_id, revision and inputs of the
+        footprint and the factor_ids among those it depends on.
+        """
+        raise NotImplementedError
+
+    def rebuild_dependencies(self):
+        """Recompute the dependency index from the stored footprints."""
+        raise NotImplementedError
+
+    # Rollups
+    def get_rollups(self, user_id, period="month"):
+        """Get a user's rollup buckets for 'month', 'quarter' or 'year', oldest first."""
+        raise NotImplementedError
+
+    def rebuild_rollups(self, user_id=None):
+        """Recompute rollups from the stored footprints. Returns the number of users rebuilt."""
+        raise NotImplementedError
+
+    # Queries
+    def get_latest_footprint(self, user_id):
+        """Get the most recent carbon footprint of a user, or None."""
+        footprints = self.get_user_footprints(user_id, limit=1)
+        return footprints[0] if footprints else None
+
+
+class JsonStorageBackend(StorageBackend):
+    """Backend on top of the JSON file storage."""
+
+    def __init__(self):
+        from utils import json_storage
+        self.store = json_storage
+
+    def get_user_by_email(self, email):
+        return self.store.get_user_by_email(email)
+
+    def create_user(self, email, password):
+        return self.store.create_user(email, password)
+
+    def verify_user(self, email, password):
+        return self.store.verify_user(email, password)
+
+    def save_carbon_footprint(self, user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions,
+                              emission_details, inputs=None, factor_set_version=None, input_hash=None,
+                              formula_version=None):
+        return self.store.save_carbon_footprint(
+            user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions, emission_details,
+            inputs, factor_set_version, input_hash, formula_version
+        )
+
+    def save_carbon_footprints(self, user_id, footprints):
+        return self.store.save_carbon_footprints(user_id, footprints)
+
+    def get_user_footprints(self, user_id, since=None, until=None, limit=None, order="desc", cursor=None):
+        return self.store.get_user_footprints(user_id, since, until, limit, order, cursor)
+
+    def revise_footprints(self, revisions):
+        return self.store.revise_footprints(revisions)
+
+    def get_footprint_revisions(self, footprint_id):
+        return self.store.get_footprint_revisions(footprint_id)
+
+    def iter_footprints(self, after_id=None):
+        return self.store.iter_footprints(after_id)
+
+    def data_version(self):
+        return self.store.data_version()
+
+    def count_footprints_by_version(self):
+        return self.store.count_footprints_by_version()
+
+    def iter_dependent_footprints(self, factor_set_version, formula_version, factor_ids=None):
+        return self.store.iter_dependent_footprints(factor_set_version, formula_version, factor_ids)
+
+    def rebuild_dependencies(self):
+        return self.store.rebuild_dependencies()
+
+    def get_rollups(self, user_id, period="month"):
+        return self.store.get_rollups(user_id, period)
+
+    def rebuild_rollups(self, user_id=None):
+        return self.store.rebuild_rollups(user_id)
+
+
+class SQLiteStorageBackend(StorageBackend):
+    """Backend on an SQLite database in WAL mode.
+
+    Logins hit the unique index on users.email, and History queries hit the
+    (user_id, created_at) index on carbon_footprints, so both stay fast with
+    hundreds of thousands of rows. Each thread gets its own connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email);
+        CREATE TABLE IF NOT EXISTS carbon_footprints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            created_at REAL NOT NULL,
+            scope1_emissions REAL NOT NULL,
+            scope2_emissions REAL NOT NULL,
+            scope3_emissions REAL NOT NULL,
+            total_emissions REAL NOT NULL,
+            emission_details TEXT NOT NULL,
+            inputs TEXT,
+            factor_set_version TEXT,
+            revision INTEGER NOT NULL DEFAULT 0,
+            input_hash TEXT,
+            reference_id INTEGER,
+            formula_version INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS ix_carbon_footprints_user_created
+            ON carbon_footprints (user_id, created_at);
+        CREATE TABLE IF NOT EXISTS footprint_revisions (
+            footprint_id INTEGER NOT NULL REFERENCES carbon_footprints (id),
+            revision INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            scope1_emissions REAL NOT NULL,
+            scope2_emissions REAL NOT NULL,
+            scope3_emissions REAL NOT NULL,
+            total_emissions REAL NOT NULL,
+            emission_details TEXT NOT NULL,
+            inputs TEXT,
+            factor_set_version TEXT,
+            superseded_at REAL NOT NULL,
+            input_hash TEXT,
+            reference_id INTEGER,
+            formula_version INTEGER,
+            PRIMARY KEY (footprint_id, revision)
+        );
+        CREATE TABLE IF NOT EXISTS footprint_dependencies (
+            footprint_id INTEGER NOT NULL REFERENCES carbon_footprints (id),
+            factor_id TEXT NOT NULL,
+            PRIMARY KEY (factor_id, footprint_id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_footprint_dependencies_footprint
+            ON footprint_dependencies (footprint_id);
+        CREATE TABLE IF NOT EXISTS footprint_rollups (
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            period TEXT NOT NULL,
+            period_key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            scope1_emissions REAL NOT NULL,
+            scope2_emissions REAL NOT NULL,
+            scope3_emissions REAL NOT NULL,
+            total_emissions REAL NOT NULL,
+            categories TEXT NOT NULL,
+            PRIMARY KEY (user_id, period, period_key)
+        );
+    """
+
+    FOOTPRINT_COLUMNS = (
+        "id, user_id, created_at, scope1_emissions, scope2_emissions, scope3_emissions, "
+        "total_emissions, emission_details, inputs, factor_set_version, revision, input_hash, reference_id, "
+        "formula_version"
+    )
+    REVISION_COLUMNS = (
+        "footprint_id, revision, user_id, created_at, scope1_emissions, scope2_emissions, scope3_emissions, "
+        "total_emissions, emission_details, inputs, factor_set_version, superseded_at, input_hash, reference_id, "
+        "formula_version"
+    )
+    # Columns added to the tables after their first release
+    ADDED_COLUMNS = (
+        ("carbon_footprints", "inputs", "TEXT"), ("carbon_footprints", "factor_set_version", "TEXT"),
+        ("carbon_footprints", "revision", "INTEGER NOT NULL DEFAULT 0"),
+        ("carbon_footprints", "input_hash", "TEXT"), ("carbon_footprints", "reference_id", "INTEGER"),
+        ("footprint_revisions", "input_hash", "TEXT"), ("footprint_revisions", "reference_id", "INTEGER"),
+        ("carbon_footprints", "formula_version", "INTEGER"), ("footprint_revisions", "formula_version", "INTEGER")
+    )
+    ROLLUP_COLUMNS = (
+        "period_key, count, scope1_emissions, scope2_emissions, "
+        "scope3_emissions, total_emissions, categories"
+    )
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        indexed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'footprint_dependencies'"
+        ).fetchone()
+        conn.executescript(self.SCHEMA)
+        existing = {}
+        for table, column, sql_type in self.ADDED_COLUMNS:
+            if table not in existing:
+                existing[table] = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing[table]:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+        # Deduplicated saves look up a user's footprints by input_hash
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_carbon_footprints_user_hash ON carbon_footprints (user_id, input_hash)"
+        )
+        if not indexed:
+            # Footprints saved before the dependency index existed
+            self.rebuild_dependencies()
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _footprint(row):
+        footprint = dict(row)
+        footprint["emission_details"] = json.loads(footprint["emission_details"])
+        if footprint["inputs"] is not None:
+            footprint["inputs"] = json.loads(footprint["inputs"])
+        return footprint
+
+    def _lookup(self, user_id, ids):
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows = self.connection().execute(
+                f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints "
+                f"WHERE user_id = ? AND id IN ({', '.join('?' * len(batch))})", [user_id] + batch
+            )
+            found.update((row["id"], self._footprint(row)) for row in rows)
+        return found
+
+    def _find_by_hash(self, user_id, hashes):
+        hashes = list(hashes)
+        found = {}
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self.connection().execute(
+                "SELECT id, input_hash, reference_id FROM carbon_footprints "
+                f"WHERE user_id = ? AND input_hash IN ({', '.join('?' * len(batch))}) "
+                # The latest footprint with each hash comes last, preferring ones stored in full
+                "ORDER BY reference_id IS NULL, created_at, id",
+                [user_id] + batch
+            )
+            found.update((row["input_hash"], dict(row)) for row in rows)
+        return found
+
+    def _resolve(self, footprints):
+        """Resolve the references among footprints (see utils/dedupe.py)."""
+        return dedupe.resolve(footprints, self._lookup, self.get_footprint_revisions)
+
+    @staticmethod
+    def _index_dependencies(conn, footprints, replace=False):
+        """Record the factor ids footprints depend on inside the caller's transaction.
+
+        With replace, the entries of revised footprints are replaced.
+        """
+        footprints = list(footprints)
+        if replace:
+            conn.executemany(
+                "DELETE FROM footprint_dependencies WHERE footprint_id = ?", [(f["id"],) for f in footprints]
+            )
+        conn.executemany(
+            "INSERT INTO footprint_dependencies (footprint_id, factor_id) VALUES (?, ?)",
+            [(f["id"], factor_id) for f in footprints for factor_id in recalculation.footprint_factor_ids(f)]
+        )
+
+    @staticmethod
+    def _bucket(row):
+        bucket = dict(row)
+        bucket["categories"] = json.loads(bucket["categories"])
+        return bucket
+
+    def _write_buckets(self, conn, user_id, period, buckets):
+        conn.executemany(
+            f"INSERT OR REPLACE INTO footprint_rollups (user_id, period, {self.ROLLUP_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, period, b["period_key"], b["count"], b["scope1_emissions"], b["scope2_emissions"],
+              b["scope3_emissions"], b["total_emissions"], json.dumps(b["categories"])) for b in buckets]
+        )
+
+    def _update_rollups(self, conn, user_id, footprints, replaced=()):
+        """Add footprints of a user to its rollups inside the caller's transaction.
+
+        replaced footprints (previous revisions) are subtracted.
+        """
+        months = rollups.summarize(footprints, replaced)
+        for period in rollups.PERIODS:
+            buckets = {}
+            for created_at, month in months:
+                key = rollups.period_key(created_at, period)
+                if key not in buckets:
+                    row = conn.execute(
+                        f"SELECT {self.ROLLUP_COLUMNS} FROM footprint_rollups "
+                        "WHERE user_id = ? AND period = ? AND period_key = ?",
+                        (user_id, period, key)
+                    ).fetchone()
+                    buckets[key] = self._bucket(row) if row else rollups.new_bucket(key)
+                rollups.merge_bucket(buckets[key], month)
+            self._write_buckets(conn, user_id, period, list(buckets.values()))
+
+    def get_user_by_email(self, email):
+        row = self.connection().execute(
+            "SELECT id, email, password, created_at FROM users WHERE email = ?", (email,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def create_user(self, email, password):
+        created_at = datetime.utcnow().timestamp()
+        conn = self.connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO users (email, password, created_at) VALUES (?, ?, ?)",
+                    (email, password, created_at)
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError("User with this email already exists")
+        return {"id": cursor.lastrowid, "email": email, "password": password, "created_at": created_at}
+
+    def save_carbon_footprint(self, user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions,
+                              emission_details, inputs=None, factor_set_version=None, input_hash=None,
+                              formula_version=None):
+        return self.save_carbon_footprints(user_id, [{
+            "scope1_emissions": scope1_emissions,
+            "scope2_emissions": scope2_emissions,
+            "scope3_emissions": scope3_emissions,
+            "total_emissions": total_emissions,
+            "emission_details": emission_details,
+            "inputs": inputs,
+            "factor_set_version": factor_set_version,
+            "input_hash": input_hash,
+            "formula_version": formula_version
+        }])[0]
+
+    def save_carbon_footprints(self, user_id, footprints):
+        if not footprints:
+            return []
+        created_at = datetime.utcnow().timestamp()
+        reference_ids = dedupe.reference_ids(footprints, lambda hashes: self._find_by_hash(user_id, hashes))
+        records = [
+            {
+                "user_id": user_id,
+                "created_at": created_at,
+                "scope1_emissions": footprint["scope1_emissions"],
+                "scope2_emissions": footprint["scope2_emissions"],
+                "scope3_emissions": footprint["scope3_emissions"],
+                "total_emissions": footprint["total_emissions"],
+                "emission_details": footprint["emission_details"],
+                "inputs": footprint.get("inputs"),
+                "factor_set_version": footprint.get("factor_set_version"),
+                "formula_version": footprint.get("formula_version"),
+                "input_hash": footprint.get("input_hash"),
+                "reference_id": reference_id
+            }
+            for footprint, reference_id in zip(footprints, reference_ids)
+        ]
+        stored = [dedupe.stored_form(r, r["reference_id"]) for r in records]
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO carbon_footprints (user_id, created_at, scope1_emissions, scope2_emissions, "
+                "scope3_emissions, total_emissions, emission_details, inputs, factor_set_version, "
+                "input_hash, reference_id, formula_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(user_id, created_at, r["scope1_emissions"], r["scope2_emissions"], r["scope3_emissions"],
+                  r["total_emissions"], json.dumps(r["emission_details"]),
+                  json.dumps(r["inputs"]) if r["inputs"] is not None else None,
+                  r["factor_set_version"], r["input_hash"], r["reference_id"], r["formula_version"]) for r in stored]
+            )
+            # The inserts hold the write lock until commit, so their
+            # AUTOINCREMENT ids are consecutive and the rollup
+            # read-modify-write cannot interleave with another writer
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            first_id = last_id - len(records) + 1
+            saved = [{"id": first_id + i, **record, "revision": 0} for i, record in enumerate(records)]
+            self._index_dependencies(conn, saved)
+            self._update_rollups(conn, user_id, records)
+        return saved
+
+    def revise_footprints(self, revisions):
+        if not revisions:
+            return []
+        superseded_at = datetime.utcnow().timestamp()
+        conn = self.connection()
+        ids = [revision["id"] for revision in revisions]
+        revised, previous = [], []
+        with conn:
+            # Take the write lock first, so the rows read below cannot change before commit
+            conn.execute("BEGIN IMMEDIATE")
+            current = {}
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints "
+                    f"WHERE id IN ({', '.join('?' * len(batch))})", batch
+                )
+                current.update((row["id"], self._footprint(row)) for row in rows)
+            for revision in revisions:
+                old = current.get(revision["id"])
+                if old is None or old["revision"] != revision.get("revision", 0):
+                    continue
+                previous.append(old)
+                revised.append({
+                    **old,
+                    **{field: revision[field] for field in rollups.SCOPE_FIELDS},
+                    "emission_details": revision["emission_details"],
+                    "inputs": revision.get("inputs"),
+                    "factor_set_version": revision.get("factor_set_version"),
+                    "formula_version": revision.get("formula_version"),
+                    "revision": old["revision"] + 1,
+                    "input_hash": revision.get("input_hash"),
+                    "reference_id": None
+                })
+            conn.executemany(
+                f"INSERT INTO footprint_revisions ({self.REVISION_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(f["id"], f["revision"], f["user_id"], f["created_at"], f["scope1_emissions"],
+                  f["scope2_emissions"], f["scope3_emissions"], f["total_emissions"],
+                  json.dumps(f["emission_details"]), json.dumps(f["inputs"]) if f["inputs"] is not None else None,
+                  f["factor_set_version"], superseded_at, f["input_hash"], f["reference_id"], f["formula_version"])
+                 for f in previous]
+            )
+            conn.executemany(
+                "UPDATE carbon_footprints SET scope1_emissions = ?, scope2_emissions = ?, scope3_emissions = ?, "
+                "total_emissions = ?, emission_details = ?, inputs = ?, factor_set_version = ?, revision = ?, "
+                "input_hash = ?, reference_id = NULL, formula_version = ? WHERE id = ?",
+                [(f["scope1_emissions"], f["scope2_emissions"], f["scope3_emissions"], f["total_emissions"],
+                  json.dumps(f["emission_details"]), json.dumps(f["inputs"]) if f["inputs"] is not None else None,
+                  f["factor_set_version"], f["revision"], f["input_hash"], f["formula_version"], f["id"])
+                 for f in revised]
+            )
+            self._index_dependencies(conn, revised, replace=True)
+            by_user = {}
+            # The replaced revisions are subtracted from the rollups with their details
+            for old, new in zip(self._resolve(previous), revised):
+                by_user.setdefault(new["user_id"], ([], []))
+                by_user[new["user_id"]][0].append(new)
+                by_user[new["user_id"]][1].append(old)
+            for user_id, (footprints, replaced) in by_user.items():
+                self._update_rollups(conn, user_id, footprints, replaced)
+        return revised
+
+    def get_footprint_revisions(self, footprint_id):
+        rows = self.connection().execute(
+            f"SELECT {self.REVISION_COLUMNS} FROM footprint_revisions WHERE footprint_id = ? ORDER BY revision",
+            (footprint_id,)
+        ).fetchall()
+        return self._resolve([self._footprint(row) for row in rows])
+
+    def get_user_footprints(self, user_id, since=None, until=None, limit=None, order="desc", cursor=None):
+        pagination.check_order(order)
+        clauses, params = ["user_id = ?"], [user_id]
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(pagination.to_timestamp(since))
+        if until is not None:
+            clauses.append("created_at <= ?")
+            params.append(pagination.to_timestamp(until))
+        if cursor is not None:
+            clauses.append("(created_at, id) < (?, ?)" if order == "desc" else "(created_at, id) > (?, ?)")
+            params.extend(pagination.decode_cursor(cursor))
+        direction = "DESC" if order == "desc" else "ASC"
+        sql = (
+            f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints WHERE {' AND '.join(clauses)} "
+            f"ORDER BY created_at {direction}, id {direction}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = self.connection().execute(sql, params).fetchall()
+        return self._resolve([self._footprint(row) for row in rows])
+
+    def iter_footprints(self, after_id=None):
+        rows = self.connection().execute(
+            f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints WHERE id > ? ORDER BY id", (after_id or 0,)
+        )
+        for row in rows:
+            yield self._resolve([self._footprint(row)])[0]
+
+    def data_version(self):
+        # Revisions change rows in place, so they are counted too
+        return tuple(self.connection().execute(
+            "SELECT COUNT(*), MAX(id), TOTAL(revision) FROM carbon_footprints"
+        ).fetchone())
+
+    def count_footprints_by_version(self):
+        rows = self.connection().execute(
+            "SELECT factor_set_version, COALESCE(formula_version, 1), COUNT(*), "
+            "TOTAL(inputs IS NULL AND reference_id IS NULL) FROM carbon_footprints "
+            "GROUP BY factor_set_version, COALESCE(formula_version, 1)"
+        )
+        return {(row[0], row[1]): (row[2], int(row[3])) for row in rows}
+
+    def iter_dependent_footprints(self, factor_set_version, formula_version, factor_ids=None):
+        conn = self.connection()
+        sql = (
+            "SELECT d.footprint_id, d.factor_id FROM footprint_dependencies d "
+            "JOIN carbon_footprints f ON f.id = d.footprint_id "
+            "WHERE f.factor_set_version = ? AND COALESCE(f.formula_version, 1) = ?"
+        )
+        params = [factor_set_version, formula_version]
+        if factor_ids is not None:
+            factor_ids = sorted(factor_ids)
+            sql += f" AND d.factor_id IN ({', '.join('?' * len(factor_ids))})"
+            params.extend(factor_ids)
+        matched = {}
+        for footprint_id, factor_id in conn.execute(sql, params):
+            matched.setdefault(footprint_id, []).append(factor_id)
+        ids = sorted(matched)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints "
+                f"WHERE id IN ({', '.join('?' * len(batch))}) ORDER BY id", batch
+            ).fetchall()
+            for footprint in self._resolve([self._footprint(row) for row in rows]):
+                yield {
+                    "id": footprint["id"],
+                    "user_id": footprint["user_id"],
+                    "revision": footprint["revision"],
+                    "inputs": footprint["inputs"],
+                    "factor_ids": matched[footprint["id"]]
+                }
+
+    def rebuild_dependencies(self):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM footprint_dependencies")
+            rows = conn.execute(f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints ORDER BY id")
+            while True:
+                batch = rows.fetchmany(1000)
+                if not batch:
+                    break
+                self._index_dependencies(conn, self._resolve([self._footprint(row) for row in batch]))
+
+    def get_rollups(self, user_id, period="month"):
+        if period not in rollups.PERIODS:
+            raise ValueError(f"period must be one of {rollups.PERIODS}, got {period!r}")
+        rows = self.connection().execute(
+            f"SELECT {self.ROLLUP_COLUMNS} FROM footprint_rollups "
+            "WHERE user_id = ? AND period = ? ORDER BY period_key",
+            (user_id, period)
+        ).fetchall()
+        return [self._bucket(row) for row in rows]
+
+    def rebuild_rollups(self, user_id=None):
+        conn = self.connection()
+        where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+        with conn:
+            conn.execute(f"DELETE FROM footprint_rollups {where}", params)
+            rows = conn.execute(
+                f"SELECT {self.FOOTPRINT_COLUMNS} FROM carbon_footprints {where} ORDER BY user_id", params
+            )
+            users = 0
+            current, user_rollups = None, None
+            for row in rows:
+                footprint = self._resolve([self._footprint(row)])[0]
+                if footprint["user_id"] != current:
+                    if user_rollups is not None:
+                        self._write_rollups(conn, current, user_rollups)
+                    current, user_rollups = footprint["user_id"], rollups.build([])
+                    users += 1
+                rollups.apply(user_rollups, footprint)
+            if user_rollups is not None:
+                self._write_rollups(conn, current, user_rollups)
+        return users
+
+    def _write_rollups(self, conn, user_id, user_rollups):
+        for period in rollups.PERIODS:
+            self._write_buckets(conn, user_id, period, rollups.sorted_buckets(user_rollups, period))
+
+
+def _sqlalchemy_backend():
+    # Imported lazily so SQLAlchemy is only required when this backend is used
+    from database.backend import SQLAlchemyStorageBackend
+    return SQLAlchemyStorageBackend()
+
+BACKENDS = {
+    "json": JsonStorageBackend,
+    "sqlite": SQLiteStorageBackend,
+    "postgresql": _sqlalchemy_backend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_storage():
+    """Return the process-wide backend selected by STORAGE_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if STORAGE_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+                _backend = BACKENDS[STORAGE_BACKEND]()
+    return _backend
+
+# Module-level shortcuts used by pages and auth
+def get_user_by_email(email):
+    """Get a user by email."""
+    return get_storage().get_user_by_email(email)
+
+def create_user(email, password):
+    """Create a new user."""
+    return get_storage().create_user(email, password)
+
+def verify_user(email, password):
+    """Verify user credentials."""
+    return get_storage().verify_user(email, password)
+
+def save_carbon_footprint(user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions, emission_details,
+                          inputs=None, factor_set_version=None, input_hash=None, formula_version=None):
+    """Save a new carbon footprint record."""
+    footprint = get_storage().save_carbon_footprint(
+        user_id, scope1_emissions, scope2_emissions, scope3_emissions, total_emissions, emission_details,
+        inputs, factor_set_version, input_hash, formula_version
+    )
+    if PARQUET_MIRROR:
+        from utils import parquet_mirror
+        parquet_mirror.after_save(footprint)
+    return footprint
+
+def save_carbon_footprints(user_id, footprints):
+    """Save many footprints of a user in one bulk write."""
+    saved = get_storage().save_carbon_footprints(user_id, footprints)
+    if PARQUET_MIRROR and saved:
+        from utils import parquet_mirror
+        parquet_mirror.after_save(saved[-1])
+    return saved
+
+def revise_footprints(revisions):
+    """Replace footprints with recalculated revisions, keeping the previous ones as history."""
+    revised = get_storage().revise_footprints(revisions)
+    if PARQUET_MIRROR and revised:
+        from utils import parquet_mirror
+        parquet_mirror.after_revise(revised)
+    return revised
+
+def get_footprint_revisions(footprint_id):
+    """Get the previous revisions of a footprint, oldest first."""
+    return get_storage().get_footprint_revisions(footprint_id)
+
+def get_user_footprints(user_id, since=None, until=None, limit=None, order="desc", cursor=None):
+    """Get a user's carbon footprints, newest first by default."""
+    return get_storage().get_user_footprints(user_id, since, until, limit, order, cursor)
+
+def get_latest_footprint(user_id):
+    """Get the most recent carbon footprint of a user."""
+    return get_storage().get_latest_footprint(user_id)
+
+def get_rollups(user_id, period="month"):
+    """Get a user's monthly, quarterly or yearly rollups, oldest first."""
+    return get_storage().get_rollups(user_id, period)
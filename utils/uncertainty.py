@@ -0,0 +1,241 @@
+"""
+Monte Carlo uncertainty analysis of a footprint.
+
+Uncertain activity data inputs and emission factors get an Uncertainty: a
+distribution around their value and a spread, the relative half-width of
+its 95% interval (the ±% of the IPCC guidelines; for 'uniform' and
+'triangular' the relative half-width of the whole range). simulate() draws
+N samples of each as NumPy arrays and runs them through
+emissions_engine.evaluate(), so every sample goes through the same formulas
+as the Calculator, and percentiles() reports the resulting intervals per
+scope and category.
+
+Samples are drawn in chunks of CHUNK_SIZE, each with its own generator
+spawned from one np.random.SeedSequence, so a seed reproduces the same
+samples whether the chunks run in one process or across a process pool.
+
+    from utils import uncertainty
+    inputs, factors = uncertainty.uncertainties_for(values, activity_spread=0.05, factor_spread=0.10)
+    result = uncertainty.simulate(values, inputs, factors, samples=100000, seed=42)
+    uncertainty.percentiles(result)
+
+    python -m utils.uncertainty custom_electricity_usage=12000 --factor-spread 0.1 --seed 42
+"""
+import argparse
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import emissions_engine
+from utils.factor_store import get_factor_set
+
+DISTRIBUTIONS = ("normal", "lognormal", "uniform", "triangular")
+PERCENTILES = (2.5, 5, 50, 95, 97.5)
+SAMPLES = 100000
+CHUNK_SIZE = 50000
+Z95 = 1.959963984540054  # standard normal quantile of 97.5%
+
+Uncertainty = namedtuple("Uncertainty", "distribution spread")
+
+
+def check(uncertainty):
+    """Raise ValueError on an unknown distribution or a negative spread."""
+    if uncertainty.distribution not in DISTRIBUTIONS:
+        raise ValueError(f"distribution must be one of {DISTRIBUTIONS}, got {uncertainty.distribution!r}")
+    if not uncertainty.spread >= 0:
+        raise ValueError(f"spread must be >= 0, got {uncertainty.spread!r}")
+
+
+def draw(rng, value, uncertainty, size):
+    """Draw size samples around value."""
+    spread = uncertainty.spread
+    if value == 0 or spread == 0:
+        return np.full(size, float(value))
+    if uncertainty.distribution == "normal":
+        return rng.normal(value, abs(value) * spread / Z95, size)
+    if uncertainty.distribution == "lognormal":
+        # Median value, 97.5th percentile value × (1 + spread)
+        return value * rng.lognormal(0.0, np.log1p(spread) / Z95, size)
+    low, high = sorted((value * (1 - spread), value * (1 + spread)))
+    if uncertainty.distribution == "uniform":
+        return rng.uniform(low, high, size)
+    return rng.triangular(low, value, high, size)
+
+
+def uncertainties_for(values, activity_spread=0.0, factor_spread=0.0, distribution="normal", factor_set=None):
+    """The same Uncertainty for every activity data input set in values and every factor they use.
+
+    Emission factor inputs set on the form count as factors. Returns
+    (input_uncertainty, factor_uncertainty) for simulate().
+    """
+    changed = emissions_engine.changed_inputs(values, factor_set)
+    inputs, factors = {}, {}
+    for key, value in changed.items():
+        default = emissions_engine.INPUTS[key]
+        if isinstance(default, emissions_engine.Factor):
+            if factor_spread:
+                inputs[key] = Uncertainty(distribution, factor_spread)
+        elif activity_spread and not isinstance(default, bool):
+            inputs[key] = Uncertainty(distribution, activity_spread)
+    if factor_spread:
+        for name in emissions_engine.dependencies(changed):
+            factors[name] = Uncertainty(distribution, factor_spread)
+    return inputs, factors
+
+
+def _simulate_chunk(values, input_uncertainty, factor_uncertainty, size, seed, factor_set):
+    """Draw one chunk of samples and evaluate them. Returns arrays of shape (size,)."""
+    rng = np.random.default_rng(seed)
+    point_factors = emissions_engine.factor_values(factor_set)
+    input_defaults = emissions_engine.defaults(factor_set)
+    # Sorted, so the draws do not depend on the order the caller listed them in
+    factors = {
+        name: np.maximum(draw(rng, point_factors[name], uncertainty, size), 0.0)
+        for name, uncertainty in sorted(factor_uncertainty.items())
+    }
+    inputs = dict(values)
+    for key, uncertainty in sorted(input_uncertainty.items()):
+        low, high = emissions_engine.input_bounds(key)
+        samples = draw(rng, float(values.get(key, input_defaults[key])), uncertainty, size)
+        inputs[key] = np.clip(samples, low, high)
+
+    result = emissions_engine.evaluate(inputs, factors, factor_set)
+    shape = (size,)
+    return {
+        "emission_details": {
+            scope: {
+                category: np.broadcast_to(samples, shape).copy()
+                for category, samples in categories.items() if np.any(samples)
+            }
+            for scope, categories in result["emission_details"].items()
+        },
+        **{key: np.broadcast_to(result[key], shape).copy() for key in emissions_engine.TOTALS}
+    }
+
+
+def simulate(values, input_uncertainty=None, factor_uncertainty=None, samples=SAMPLES, seed=None,
+             workers=1, chunk_size=CHUNK_SIZE, factor_set=None):
+    """Run a Monte Carlo simulation of the footprint of a set of Calculator values.
+
+    input_uncertainty maps input keys and factor_uncertainty maps names of
+    emissions_engine.FACTORS to their Uncertainty. A factor's uncertainty
+    also applies to the emission factor inputs left at its value. With
+    workers > 1 the chunks are spread over a process pool; the samples only
+    depend on seed and chunk_size.
+
+    Returns a dict shaped like an evaluate() result, with arrays of the
+    samples (categories that are zero in every sample left out), plus the
+    'point' footprint, the number of 'samples', the 'seed' entropy that
+    reproduces them and the 'factor_set_version'.
+    """
+    if factor_set is None:
+        factor_set = get_factor_set()
+    values = emissions_engine.changed_inputs(values, factor_set)
+    input_uncertainty = input_uncertainty or {}
+    factor_uncertainty = factor_uncertainty or {}
+    for key, uncertainty in input_uncertainty.items():
+        if key not in emissions_engine.INPUTS:
+            raise ValueError(f"Unknown calculator input: {key}")
+        check(uncertainty)
+    for name, uncertainty in factor_uncertainty.items():
+        if name not in emissions_engine.FACTORS:
+            raise ValueError(f"Unknown emission factor: {name}")
+        check(uncertainty)
+    if samples < 1:
+        raise ValueError("samples must be at least 1")
+
+    seed_sequence = np.random.SeedSequence(seed)
+    sizes = [min(chunk_size, samples - start) for start in range(0, samples, chunk_size)]
+    tasks = [
+        (values, input_uncertainty, factor_uncertainty, size, child, factor_set)
+        for size, child in zip(sizes, seed_sequence.spawn(len(sizes)))
+    ]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            parts = list(pool.map(_simulate_chunk, *zip(*tasks)))
+    else:
+        parts = [_simulate_chunk(*task) for task in tasks]
+
+    details = {}
+    for scope in emissions_engine.SCOPES:
+        categories = list(parts[0]["emission_details"][scope])
+        for part in parts[1:]:
+            categories += [c for c in part["emission_details"][scope] if c not in categories]
+        details[scope] = {
+            category: np.concatenate([
+                part["emission_details"][scope].get(category, np.zeros(size))
+                for part, size in zip(parts, sizes)
+            ])
+            for category in categories
+        }
+    result = {"emission_details": details}
+    for key in emissions_engine.TOTALS:
+        result[key] = np.concatenate([part[key] for part in parts])
+    result.update(
+        point=emissions_engine.calculate(values, factor_set=factor_set),
+        samples=samples,
+        seed=seed_sequence.entropy,
+        factor_set_version=factor_set.version
+    )
+    return result
+
+
+def percentiles(result, q=PERCENTILES):
+    """Summarize a simulate() result as a DataFrame, one row per category and per total.
+
+    Columns: scope, category ('total' for the scope and overall totals), the
+    point value, the mean and standard deviation of the samples, and one
+    'p<q>' column per percentile.
+    """
+    point = result["point"]
+    labels, rows = [], []
+    for scope in emissions_engine.SCOPES:
+        for category, samples in result["emission_details"][scope].items():
+            labels.append((scope, category, point["emission_details"][scope][category]))
+            rows.append(samples)
+        labels.append((scope, "total", point[f"{scope}_emissions"]))
+        rows.append(result[f"{scope}_emissions"])
+    labels.append(("total", "total", point["total_emissions"]))
+    rows.append(result["total_emissions"])
+
+    matrix = np.vstack(rows)
+    values = np.percentile(matrix, q, axis=1).T
+    frame = pd.DataFrame(labels, columns=["scope", "category", "value"])
+    frame["mean"] = matrix.mean(axis=1)
+    frame["std"] = matrix.std(axis=1)
+    for i, percentile in enumerate(q):
+        frame[f"p{percentile:g}"] = values[:, i]
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo uncertainty of a footprint")
+    parser.add_argument("inputs", nargs="*", metavar="KEY=VALUE", help="Calculator inputs")
+    parser.add_argument("--activity-spread", type=float, default=0.05,
+                        help="Relative 95%% half-width of the activity data (default 0.05)")
+    parser.add_argument("--factor-spread", type=float, default=0.10,
+                        help="Relative 95%% half-width of the emission factors (default 0.10)")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="normal")
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    values = {}
+    for pair in args.inputs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            parser.error(f"Expected KEY=VALUE, got {pair!r}")
+        values[key] = float(value)
+    inputs, factors = uncertainties_for(values, args.activity_spread, args.factor_spread, args.distribution)
+    result = simulate(values, inputs, factors, args.samples, args.seed, args.workers)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(percentiles(result).round(3).to_string(index=False))
+    print(f"{result['samples']} samples, seed {result['seed']}, factor set {result['factor_set_version']}")
+
+
+if __name__ == "__main__":
+    main()
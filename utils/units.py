@@ -0,0 +1,166 @@
+"""
+Units of the Calculator inputs and emission factors.
+
+Every unit in UNITS has a dimension and its scale to the dimension's base
+unit (MJ, l, km, kg, m², USD, kg CO2e...). Compound units are written
+with '/' and '-' as in the factor sets: 'kg CO2e/tonne-km' is kg CO2e per
+(tonne × km). Count units (unit, night, trip, employee...) are
+dimensionless.
+
+Conversion factors are computed once per pair of units and cached, so a
+column converts with one multiplication, and a column of mixed units with
+one lookup of each row's unit in a table built for its distinct units.
+Converting between units of different dimensions raises ValueError.
+
+    from utils import units
+    units.convert(values, "MJ", "TJ")
+    units.convert_column(values, ["TJ", "GJ", "MWh"], "TJ")
+"""
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# A unit: its dimension, as sorted (base dimension, exponent) pairs, and the
+# size of one unit in the base units of that dimension
+Unit = namedtuple("Unit", "dimension scale")
+
+# Simple units by dimension: {symbol: scale to the first (base) unit}
+_TABLES = {
+    "energy": {
+        "MJ": 1.0, "J": 1e-6, "kJ": 1e-3, "GJ": 1e3, "TJ": 1e6,
+        "Wh": 3.6e-3, "kWh": 3.6, "MWh": 3.6e3, "GWh": 3.6e6,
+        "therm": 105.4804, "MMBtu": 1055.05585,
+    },
+    "volume": {"l": 1.0, "ml": 1e-3, "m3": 1e3, "gal": 3.785411784, "bbl": 158.987294928},
+    "distance": {"km": 1.0, "m": 1e-3, "mile": 1.609344, "nmi": 1.852},
+    "mass": {"kg": 1.0, "g": 1e-3, "tonne": 1e3, "lb": 0.45359237},
+    "area": {"m2": 1.0, "ft2": 0.09290304, "ha": 1e4},
+    "currency": {"USD": 1.0},
+    "time": {"day": 1.0, "week": 7.0, "year": 365.0},
+    # CO2 counts as CO2e (a GWP of 1)
+    "emissions": {"kg CO2e": 1.0, "g CO2e": 1e-3, "t CO2e": 1e3, "kg CO2": 1.0, "g CO2": 1e-3, "t CO2": 1e3},
+    "carbon": {"kg C": 1.0, "t C": 1e3},
+    "": {"unit": 1.0, "fraction": 1.0, "%": 0.01, "night": 1.0, "trip": 1.0, "employee": 1.0, "serving": 1.0},
+}
+
+ALIASES = {
+    "t": "tonne", "tonnes": "tonne", "tons": "tonne", "kgs": "kg",
+    "liter": "l", "liters": "l", "litre": "l", "litres": "l", "L": "l",
+    "m³": "m3", "m²": "m2", "sqm": "m2", "sqft": "ft2",
+    "miles": "mile", "mi": "mile", "$": "USD", "usd": "USD",
+    "units": "unit", "nights": "night", "trips": "trip", "employees": "employee", "servings": "serving",
+    "days": "day", "percent": "%", "tkm": "tonne-km",
+    "kgCO2e": "kg CO2e", "kgCO2": "kg CO2", "tCO2e": "t CO2e", "tCO2": "t CO2",
+}
+
+UNITS = {
+    symbol: Unit(((dimension, 1),) if dimension else (), scale)
+    for dimension, table in _TABLES.items()
+    for symbol, scale in table.items()
+}
+
+
+def _combine(units, sign):
+    exponents, scale = {}, 1.0
+    for unit, power in units:
+        for dimension, exponent in unit.dimension:
+            exponents[dimension] = exponents.get(dimension, 0) + exponent * power * sign
+        scale *= unit.scale ** (power * sign)
+    return exponents, scale
+
+
+@lru_cache(maxsize=None)
+def parse(text):
+    """Parse a unit ('kWh', 'kg CO2e/tonne-km', 'km/day'). Raises ValueError if unknown."""
+    symbol = str(text).strip()
+    symbol = ALIASES.get(symbol, symbol)
+    if symbol in UNITS:
+        return UNITS[symbol]
+    numerator, sep, denominator = symbol.partition("/")
+    parts = [(numerator, 1)] + ([(denominator, -1)] if sep else [])
+    exponents, scale = {}, 1.0
+    for part, sign in parts:
+        factors = [ALIASES.get(name.strip(), name.strip()) for name in part.replace("·", "-").split("-")]
+        if not all(factors) or any(name not in UNITS for name in factors) or (not sep and len(factors) == 1):
+            raise ValueError(f"Unknown unit: {text!r}")
+        part_exponents, part_scale = _combine([(UNITS[name], 1) for name in factors], sign)
+        for dimension, exponent in part_exponents.items():
+            exponents[dimension] = exponents.get(dimension, 0) + exponent
+        scale *= part_scale
+    return Unit(tuple(sorted((d, e) for d, e in exponents.items() if e)), scale)
+
+
+def multiply(*texts):
+    """Unit of the product of quantities in these units."""
+    exponents, scale = _combine([(parse(text), 1) for text in texts], 1)
+    return Unit(tuple(sorted((d, e) for d, e in exponents.items() if e)), scale)
+
+
+def compatible(source, target):
+    """Whether quantities in source units can be converted to target units."""
+    try:
+        return parse(source).dimension == parse(target).dimension
+    except ValueError:
+        return False
+
+
+def _factor(source, target):
+    if source.dimension != target.dimension:
+        raise ValueError("incompatible dimensions")
+    # 15 significant digits, so exact ratios such as kWh -> kWh·MJ/MJ stay exactly 1
+    return float(f"{source.scale / target.scale:.15g}")
+
+
+@lru_cache(maxsize=None)
+def conversion_factor(source, target):
+    """Number to multiply quantities in source units by to get target units."""
+    try:
+        return _factor(parse(source), parse(target))
+    except ValueError:
+        raise ValueError(f"Cannot convert {source} to {target}") from None
+
+
+def unit_factor(unit, target):
+    """Like conversion_factor(), for a Unit (e.g. from multiply())."""
+    try:
+        return _factor(unit, parse(target))
+    except ValueError:
+        raise ValueError(f"Cannot convert a quantity of dimension {format_dimension(unit)} to {target}") from None
+
+
+def format_dimension(unit):
+    if not unit.dimension:
+        return "1 (dimensionless)"
+    return " · ".join(f"{d}^{e}" if e != 1 else d for d, e in unit.dimension)
+
+
+def convert(values, source, target):
+    """Convert a scalar or a whole array from source to target units."""
+    factor = conversion_factor(source, target)
+    values = np.asarray(values, dtype=np.float64)
+    return values if factor == 1.0 else values * factor
+
+
+def convert_column(values, row_units, target, default=None):
+    """Convert a column whose rows each have their own unit.
+
+    row_units is a sequence of unit names, one per value; empty or missing
+    units mean default (target by default). Each distinct unit is parsed
+    once. Returns (converted values, mask of the rows with an unknown or
+    incompatible unit, which are left as NaN).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    labels = pd.Series(row_units, dtype=object).fillna("").astype(str).str.strip()
+    labels = labels.mask(labels.eq(""), default or target)
+    codes, uniques = pd.factorize(labels)
+    table = np.empty(len(uniques))
+    for i, unit in enumerate(uniques):
+        try:
+            table[i] = conversion_factor(unit, target)
+        except ValueError:
+            table[i] = math.nan
+    factors = table[codes]
+    return values * factors, np.isnan(factors)